@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""
+An in-memory index of the files served by /files.
+
+The index maps a file name to its directory, size, modification time and
+content type. It is built once at startup by scanning the asset directories
+and kept up to date by the generation pipeline whenever it writes a file, so
+serving a file does not have to search the asset directories for it; an
+entry found out of date while serving is refreshed. A background watcher
+can optionally refresh it for files written by other processes; it uses the
+`watchdog` package when installed and falls back to periodic rescans.
+"""
+import os
+import time
+import mimetypes
+import threading
+
+
+class AssetIndex:
+    """
+    Thread-safe map of file name to file information.
+    """
+
+    def __init__(self, directories):
+        """
+        Initialize an empty index.
+
+        Args:
+            directories (list): Top-level asset directories, in lookup priority order
+        """
+        self.directories = list(directories)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._watcher = None
+
+    def build(self):
+        """
+        Scan all asset directories (including shard subdirectories).
+
+        Returns:
+            int: Number of indexed files
+        """
+        entries = {}
+        # Reverse order so files in earlier directories win on name clashes
+        for directory in reversed(self.directories):
+            for path, stat in _scan_files(directory):
+                entries[os.path.basename(path)] = self._make_entry(directory, path, stat)
+
+        with self._lock:
+            self._entries = entries
+        return len(entries)
+
+    def add(self, path):
+        """
+        Add or refresh a file that was just written.
+
+        Args:
+            path (str): Path of the file inside one of the asset directories
+
+        Returns:
+            dict: The index entry, or None if the file is not in an asset directory
+        """
+        directory = self._directory_of(path)
+        if directory is None:
+            return None
+        entry = self._make_entry(directory, path, os.stat(path))
+        with self._lock:
+            self._entries[os.path.basename(path)] = entry
+        return entry
+
+    def remove(self, filename):
+        """Drop a file from the index."""
+        with self._lock:
+            self._entries.pop(filename, None)
+
+    def lookup(self, filename):
+        """
+        Look up a file by name without touching the filesystem.
+
+        Returns:
+            dict: directory, relative_path, path, size, mtime and content_type,
+                  or None if the file is not indexed
+        """
+        with self._lock:
+            return self._entries.get(filename)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def start_watcher(self, interval=30):
+        """
+        Keep the index in sync with changes made outside this process.
+
+        Uses watchdog if it is installed, otherwise rescans every interval seconds.
+
+        Args:
+            interval (float): Seconds between rescans in polling mode
+        """
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            Observer = None
+
+        if Observer is not None:
+            index = self
+
+            class Handler(FileSystemEventHandler):
+                def on_created(self, event):
+                    index._on_fs_change(event.src_path, event.is_directory)
+
+                def on_modified(self, event):
+                    index._on_fs_change(event.src_path, event.is_directory)
+
+                def on_moved(self, event):
+                    index.remove(os.path.basename(event.src_path))
+                    index._on_fs_change(event.dest_path, event.is_directory)
+
+                def on_deleted(self, event):
+                    if not event.is_directory:
+                        index.remove(os.path.basename(event.src_path))
+
+            observer = Observer()
+            for directory in self.directories:
+                observer.schedule(Handler(), directory, recursive=True)
+            observer.daemon = True
+            observer.start()
+            self._watcher = observer
+            return
+
+        def rescan_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.build()
+                except Exception as e:
+                    print(f"Error rescanning asset directories: {str(e)}")
+
+        self._watcher = threading.Thread(target=rescan_loop, name="asset-index-rescan", daemon=True)
+        self._watcher.start()
+
+    def _on_fs_change(self, path, is_directory):
+        if is_directory or os.path.basename(path).startswith("."):
+            return
+        try:
+            self.add(path)
+        except FileNotFoundError:
+            self.remove(os.path.basename(path))
+
+    def _directory_of(self, path):
+        absolute = os.path.abspath(path)
+        for directory in self.directories:
+            root = os.path.abspath(directory)
+            if absolute.startswith(root + os.sep):
+                return directory
+        return None
+
+    def _make_entry(self, directory, path, stat):
+        return {
+            "directory": directory,
+            "relative_path": os.path.relpath(path, directory),
+            "path": path,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "content_type": mimetypes.guess_type(path)[0] or "application/octet-stream"
+        }
+
+
+def _scan_files(directory):
+    if not os.path.isdir(directory):
+        return
+    stack = [directory]
+    while stack:
+        for entry in os.scandir(stack.pop()):
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                stack.append(entry.path)
+            elif entry.is_file():
+                yield entry.path, entry.stat()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Moving generated files into place without copying their content.
+
+Generated PLYs can be hundreds of megabytes, so copying them from the Gradio
+download directory into `plys/` and again into `storage/` is expensive. Files
+are placed with the cheapest operation the filesystem allows:
+
+1. `os.replace` (move) or a hardlink (keep the source) on the same filesystem
+2. a reflink (copy-on-write clone, e.g. on Btrfs/XFS) where supported
+3. a streamed copy, only when source and target are on different devices
+
+Copies are written to a temporary file next to the target and renamed over
+it, so readers never see a partial file.
+"""
+import os
+import uuid
+import shutil
+import tempfile
+
+# Linux ioctl that clones a file's extents (copy-on-write)
+FICLONE = 0x40049409
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def place_file(source, target, keep_source=False):
+    """
+    Move or link a file to its target path.
+
+    Args:
+        source (str): Path of the existing file
+        target (str): Destination path; its directory is created if needed
+        keep_source (bool): Leave the source in place (link or copy instead of move)
+
+    Returns:
+        str: The method used: "rename", "hardlink", "reflink" or "copy"
+    """
+    target_dir = os.path.dirname(target)
+    if target_dir:
+        os.makedirs(target_dir, exist_ok=True)
+
+    if not keep_source:
+        try:
+            os.replace(source, target)
+            return "rename"
+        except OSError:
+            # Typically EXDEV (different filesystem); fall through to a copy
+            pass
+    else:
+        try:
+            _link_over(source, target)
+            return "hardlink"
+        except OSError:
+            pass
+
+    method = _copy_over(source, target)
+    if not keep_source:
+        os.remove(source)
+    return method
+
+
+def cleanup_download_dir(path, root):
+    """
+    Remove the now empty per-file directory a Gradio download was stored in.
+
+    Gradio saves every downloaded file as <root>/<content hash>/<name>. After
+    the file was moved away, its directory is removed if it is empty.
+
+    Args:
+        path (str): Original path of the downloaded file
+        root (str): Gradio download directory
+
+    Returns:
+        bool: True if a directory was removed
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if os.path.dirname(directory) != os.path.abspath(root):
+        return False
+    try:
+        os.rmdir(directory)
+        return True
+    except OSError:
+        # Not empty (another download with the same content) or already gone
+        return False
+
+
+def _link_over(source, target):
+    tmp_path = _temp_path(target)
+    os.link(source, tmp_path)
+    try:
+        os.replace(tmp_path, target)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def _copy_over(source, target):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target) or ".", prefix=".tmp_")
+    try:
+        with open(source, "rb") as src, os.fdopen(fd, "wb") as dst:
+            if _reflink(src, dst):
+                method = "reflink"
+            else:
+                shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+                method = "copy"
+        shutil.copystat(source, tmp_path)
+        os.replace(tmp_path, target)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return method
+
+
+def _reflink(src, dst):
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        return False
+
+
+def _temp_path(target):
+    directory, name = os.path.split(target)
+    return os.path.join(directory, f".tmp_{uuid.uuid4().hex[:8]}_{name}")
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+"""
+HTTP caching helpers for the metadata and asset endpoints.
+
+Assets are served with a strong ETag, the SHA-256 of their content (shared
+with content_store, so a file hashed while it was written or uploaded is not
+hashed again). Files that never change under their name get an immutable
+Cache-Control header; the caller decides, since e.g. a job's PLY is rewritten
+in place until the job has finished. Metadata changes while a job runs, so
+it gets an ETag derived from its content and must be revalidated on every
+request. Both answer conditional requests (If-None-Match /
+If-Modified-Since) with 304 Not Modified.
+
+Files with precompressed copies next to them (`<name>.br`, `<name>.gz`) are
+sent as the copy the client accepts, with the matching Content-Encoding.
+
+Assets answer byte-range requests with 206 Partial Content, including
+several ranges at once (multipart/byteranges) and If-Range, so interrupted
+downloads resume where they stopped. Bodies ending at the end of the file
+are handed to the WSGI server's file wrapper, which gunicorn sends with
+sendfile() without copying through Python. With ASSET_OFFLOAD set to
+`x-accel` (nginx) or `x-sendfile` (Apache, lighttpd) the front-end server
+sends the file instead, ranges included, and the application only returns
+the headers.
+"""
+import os
+import json
+import uuid
+import hashlib
+import mimetypes
+from datetime import datetime, timezone
+from urllib.parse import quote
+from flask import current_app, request
+from werkzeug.exceptions import NotFound, RequestedRangeNotSatisfiable
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+from content_store import file_sha256
+
+# One year, the conventional maximum for immutable assets
+IMMUTABLE_MAX_AGE = 31536000
+# Content codings of precompressed copies, in order of preference
+PRECOMPRESSED_EXTENSIONS = {"br": ".br", "gzip": ".gz"}
+RANGE_CHUNK_SIZE = 256 * 1024
+# Requests with more ranges than this get the whole file
+MAX_RANGES = 16
+
+# none: send files from the application; x-accel: nginx X-Accel-Redirect;
+# x-sendfile: Apache/lighttpd X-Sendfile
+ASSET_OFFLOAD = os.environ.get("ASSET_OFFLOAD", "none").lower()
+# Internal nginx location mapped to ASSET_ROOT (x-accel only)
+ASSET_OFFLOAD_PREFIX = os.environ.get("ASSET_OFFLOAD_PREFIX", "/protected").rstrip("/")
+# Directory the offload paths are relative to, i.e. the server directory
+ASSET_ROOT = os.path.abspath(os.environ.get("ASSET_ROOT", "."))
+
+def file_etag(path, opened=None):
+    """
+    Return a strong ETag for a file based on its content hash.
+
+    The SHA-256 is cached per path, size and mtime by content_store, so a
+    file is only hashed again after it changed.
+
+    Args:
+        path (str): Path to the file
+        opened (file, optional): The file, already open; its fstat is used
+                                 instead of stat-ing the path
+
+    Returns:
+        str: The ETag value (without quotes)
+    """
+    return file_sha256(path, opened)[:32]
+
+
+def preferred_encoding(accept_encoding, available):
+    """
+    Pick the content coding to send from an Accept-Encoding header.
+
+    Args:
+        accept_encoding (str): The request's Accept-Encoding header
+        available (iterable): Content codings with a precompressed copy
+
+    Returns:
+        str: The best accepted coding, or None to send the file as is
+    """
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+    for coding in PRECOMPRESSED_EXTENSIONS:
+        if coding not in available:
+            continue
+        quality = accepted.get(coding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def parse_ranges(header, length):
+    """
+    Parse a Range header into the byte ranges to send.
+
+    Overlapping and adjacent ranges are merged (werkzeug's parser rejects
+    them). Malformed headers, units other than bytes and requests with more
+    than MAX_RANGES ranges are ignored, i.e. the whole file is sent.
+
+    Args:
+        header (str): Value of the Range header
+        length (int): Size of the file
+
+    Returns:
+        list: Sorted (start, end) pairs with exclusive ends, or None to send
+              the whole file
+
+    Raises:
+        RequestedRangeNotSatisfiable: If no range overlaps the file
+    """
+    units, _, specs = header.partition("=")
+    if units.strip().lower() != "bytes" or not specs or length == 0:
+        return None
+
+    ranges = []
+    for spec in specs.split(","):
+        first, dash, last = spec.strip().partition("-")
+        if not dash or not (first + last).isdigit():
+            return None
+        if not first:
+            # Suffix range: the last n bytes
+            start, end = max(0, length - int(last)), length
+        else:
+            start = int(first)
+            end = length if not last else min(int(last) + 1, length)
+            if last and int(last) < start:
+                return None
+        if start < end:
+            ranges.append((start, end))
+    if not ranges:
+        raise RequestedRangeNotSatisfiable(length=length)
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged if len(merged) <= MAX_RANGES else None
+
+
+class FileRange:
+    """
+    WSGI body sending byte ranges of a file, optionally as multipart parts.
+
+    The file is closed by close(), which the WSGI server calls even if the
+    body is never iterated (e.g. for HEAD requests).
+    """
+
+    def __init__(self, file, ranges, parts=None, chunk_size=RANGE_CHUNK_SIZE):
+        """
+        Initialize the body.
+
+        Args:
+            file (file): File to send, open in binary mode
+            ranges (list): (start, end) pairs with exclusive ends
+            parts (tuple, optional): (part headers per range, closing
+                                     delimiter) of a multipart body
+            chunk_size (int): Bytes read at a time
+        """
+        self.file = file
+        self.ranges = ranges
+        self.parts = parts
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        for index, (start, end) in enumerate(self.ranges):
+            if self.parts is not None:
+                yield self.parts[0][index]
+            self.file.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = self.file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+            if self.parts is not None:
+                yield b"\r\n"
+        if self.parts is not None:
+            yield self.parts[1]
+
+    def close(self):
+        self.file.close()
+
+
+def file_body(file, start, end, size):
+    """
+    Return a WSGI body sending bytes [start, end) of a file.
+
+    Bodies ending at the end of the file use the server's wsgi.file_wrapper,
+    which sends from the current file position (with sendfile() under
+    gunicorn). Other ranges are read in chunks, because not every file
+    wrapper stops at the Content-Length.
+
+    Args:
+        file (file): File to send, open in binary mode
+        start (int): First byte
+        end (int): End of the range (exclusive)
+        size (int): Size of the file
+
+    Returns:
+        iterable: The response body
+    """
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    if file_wrapper is None or end != size:
+        return FileRange(file, [(start, end)])
+    file.seek(start)
+    return file_wrapper(file, RANGE_CHUNK_SIZE)
+
+
+def offload_headers(path):
+    """
+    Return the headers handing a file to the front-end server, if enabled.
+
+    Args:
+        path (str): Absolute path of the file
+
+    Returns:
+        dict: X-Accel-Redirect or X-Sendfile header, or {} if the application
+              sends the file itself
+    """
+    if ASSET_OFFLOAD == "x-accel":
+        relative_path = os.path.relpath(path, ASSET_ROOT).replace(os.sep, "/")
+        return {"X-Accel-Redirect": quote(f"{ASSET_OFFLOAD_PREFIX}/{relative_path}")}
+    if ASSET_OFFLOAD == "x-sendfile":
+        return {"X-Sendfile": path}
+    return {}
+
+
+def send_asset(directory, filename, immutable=True, stat_key=None, on_stale=None,
+               content_encoding=None, mimetype=None):
+    """
+    Send a file with a content-hash ETag, caching headers and range support.
+
+    The file is opened once; its size, mtime and ETag come from the open
+    file, so they always describe the bytes that are sent, even if the file
+    is replaced while the response is built.
+
+    Args:
+        directory (str): Directory containing the file
+        filename (str): File name relative to the directory
+        immutable (bool): Whether the file never changes under this name
+        stat_key (tuple, optional): Known (size, mtime_ns) of the file, e.g.
+                                    from the asset index
+        on_stale (callable, optional): Called with the file's path if
+                                       stat_key is out of date
+        content_encoding (str, optional): Content coding of a precompressed
+                                          file, sent as Content-Encoding
+        mimetype (str, optional): Content type, e.g. of the uncompressed file
+
+    Returns:
+        Response: The file, 206 with the requested ranges, or 304 if the
+                  client copy is current
+
+    Raises:
+        NotFound: If the file does not exist
+        RequestedRangeNotSatisfiable: If no requested range overlaps the file
+    """
+    path = safe_join(directory, filename)
+    if not path:
+        raise NotFound()
+    path = os.path.abspath(path)
+    try:
+        f = open(path, "rb")
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        raise NotFound()
+    try:
+        return _send_file(f, path, filename, immutable, stat_key, on_stale, content_encoding, mimetype)
+    except BaseException:
+        f.close()
+        raise
+
+
+def _send_file(f, path, filename, immutable, stat_key, on_stale, content_encoding, mimetype):
+    # The response body closes f; returning without one closes it here
+    stat = os.fstat(f.fileno())
+    if stat_key is not None and stat_key != (stat.st_size, stat.st_mtime_ns) and on_stale is not None:
+        on_stale(path)
+    size = stat.st_size
+    etag = file_etag(path, f)
+    last_modified = datetime.fromtimestamp(stat.st_mtime_ns // 1000000000, tz=timezone.utc)
+
+    guessed_type, guessed_encoding = mimetypes.guess_type(filename)
+    response = current_app.response_class(
+        mimetype=mimetype or guessed_type or "application/octet-stream",
+        direct_passthrough=True
+    )
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.accept_ranges = "bytes"
+    if content_encoding or guessed_encoding:
+        response.headers["Content-Encoding"] = content_encoding or guessed_encoding
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    else:
+        response.cache_control.no_cache = True
+
+    environ = request.environ
+    if request.method in ("GET", "HEAD") and not is_resource_modified(environ, etag, last_modified=last_modified):
+        response.status_code = 304
+        f.close()
+        return response
+
+    offload = offload_headers(path)
+    if offload:
+        # The front-end server sends the body and answers Range itself
+        response.headers.update(offload)
+        f.close()
+        return response
+
+    ranges = None
+    if request.method in ("GET", "HEAD") and "HTTP_RANGE" in environ:
+        if "HTTP_IF_RANGE" not in environ or \
+                not is_resource_modified(environ, etag, last_modified=last_modified, ignore_if_range=False):
+            ranges = parse_ranges(environ["HTTP_RANGE"], size)
+    if ranges is not None and len(ranges) > 1 and response.content_encoding:
+        # Parts of a multipart body cannot carry the Content-Encoding of the file
+        ranges = None
+
+    if ranges is None:
+        response.response = file_body(f, 0, size, size)
+        response.content_length = size
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response.status_code = 206
+        response.response = file_body(f, start, end, size)
+        response.content_length = end - start
+        response.headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    else:
+        boundary = uuid.uuid4().hex
+        headers = [
+            (f"--{boundary}\r\nContent-Type: {response.mimetype}\r\n"
+             f"Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n").encode("latin-1")
+            for start, end in ranges
+        ]
+        closing = f"--{boundary}--\r\n".encode("latin-1")
+        response.status_code = 206
+        response.response = FileRange(f, ranges, (headers, closing))
+        response.content_length = sum(len(header) + end - start + 2
+                                      for header, (start, end) in zip(headers, ranges)) + len(closing)
+        response.headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+    return response
+
+
+def json_response(data):
+    """
+    Send JSON data with a content-hash ETag that must be revalidated.
+
+    Args:
+        data (dict): JSON-serializable data
+
+    Returns:
+        Response: The JSON response, or 304 if the client copy is current
+    """
+    body = json.dumps(data, indent=4)
+    response = current_app.response_class(body, mimetype="application/json")
+    response.set_etag(hashlib.sha256(body.encode("utf-8")).hexdigest()[:32])
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
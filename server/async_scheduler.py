@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+An asyncio variant of the pipelined job scheduler.
+
+The stage functions are coroutine functions that run on one event loop in a
+dedicated thread. A job waiting for OpenAI, Gradio or a storage provider
+holds no thread, so the concurrency of a stage can be sized to the upstream
+quotas (hundreds of jobs) instead of to the number of threads the process
+can afford. Blocking work (file I/O, hashing, PLY processing) is run by the
+stages with asyncio.to_thread in the loop's thread pool.
+
+Admission, backpressure between stages, statistics and draining behave as
+in JobScheduler: every stage has a bounded queue and a fixed number of
+worker tasks, submit() raises QueueFullError when the first queue is full,
+and shutdown() lets the admitted jobs finish.
+"""
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from job_scheduler import Stage, QueueFullError, SchedulerShutdownError
+
+
+class AsyncStage(Stage):
+    """
+    A pipeline stage whose function is a coroutine function and whose
+    workers are tasks on the scheduler's event loop.
+    """
+
+    def __init__(self, name, func, num_workers=1, max_queue_size=16, latency_window=100):
+        super().__init__(name, func, num_workers, max_queue_size, latency_window)
+        # Only used from the event loop; qsize() is also read by stats()
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+
+
+class AsyncJobScheduler:
+    """
+    Runs jobs through a sequence of async stages on a dedicated event loop.
+    """
+
+    def __init__(self, stages, on_error=None, retry_after=30, max_threads=32):
+        """
+        Initialize the scheduler, start the event loop thread and the stage workers.
+
+        Args:
+            stages (list): Ordered list of AsyncStage instances
+            on_error (callable, optional): Called as on_error(job, stage_name, exception)
+                                           when a stage function raises
+            retry_after (int): Seconds clients are told to wait when rejected
+            max_threads (int): Threads of the loop's executor (asyncio.to_thread)
+        """
+        self.stages = list(stages)
+        self.on_error = on_error
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._completed = 0
+        self._dropped = 0
+        self._failed = 0
+        self._rejected = 0
+        self._accepting = True
+        self._workers = []
+
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="pipeline-io"))
+        self._thread = threading.Thread(target=self._run_loop, name="pipeline-loop", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start_workers(), self.loop).result()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _start_workers(self):
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.num_workers):
+                self._workers.append(asyncio.ensure_future(self._worker_loop(index)))
+
+    def submit(self, job):
+        """
+        Admit a job into the first stage of the pipeline.
+
+        Can be called from any thread.
+
+        Args:
+            job (dict): Job state passed from stage to stage
+
+        Raises:
+            SchedulerShutdownError: If the scheduler is draining
+            QueueFullError: If the first stage has no free queue slot
+        """
+        if not self._accepting:
+            raise SchedulerShutdownError("Server is shutting down", retry_after=self.retry_after)
+
+        with self._lock:
+            self._in_flight += 1
+        admitted = asyncio.run_coroutine_threadsafe(self._admit(job), self.loop).result()
+        if not admitted:
+            first = self.stages[0]
+            with self._lock:
+                self._in_flight -= 1
+                self._rejected += 1
+            raise QueueFullError(
+                f"Job queue is full ({first.max_queue_size} jobs waiting)",
+                retry_after=self.retry_after
+            )
+
+    async def _admit(self, job):
+        try:
+            self.stages[0].queue.put_nowait((job, time.monotonic()))
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def restore(self, job, stage_name):
+        """
+        Re-admit a job recovered after a restart, starting at the given stage.
+
+        Can be called from any thread; waits for a free slot in the stage's
+        queue instead of rejecting the job.
+
+        Args:
+            job (dict): Job state passed from stage to stage
+            stage_name (str): Name of the stage to continue with
+        """
+        index = [stage.name for stage in self.stages].index(stage_name)
+        with self._lock:
+            self._in_flight += 1
+        queue = self.stages[index].queue
+        asyncio.run_coroutine_threadsafe(queue.put((job, time.monotonic())), self.loop).result()
+
+    def stats(self):
+        """
+        Return a snapshot of the scheduler and per-stage state.
+
+        Returns:
+            dict: Pipeline counters and statistics for every stage
+        """
+        with self._lock:
+            snapshot = {
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "dropped": self._dropped,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "deferred": 0,
+                "overflow": 0,
+                "accepting": self._accepting
+            }
+        snapshot["stages"] = {stage.name: stage.stats() for stage in self.stages}
+        return snapshot
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stop accepting jobs, drain the pipeline and stop the event loop.
+
+        Args:
+            wait (bool): Whether to wait for the admitted jobs to finish
+            timeout (float, optional): Maximum number of seconds to wait
+
+        Returns:
+            bool: True if all jobs were drained
+        """
+        self._accepting = False
+        if not wait:
+            return False
+
+        with self._idle:
+            drained = self._idle.wait_for(lambda: self._in_flight == 0, timeout)
+        if not self.loop.is_running():
+            return drained
+        try:
+            asyncio.run_coroutine_threadsafe(self._stop(), self.loop).result(timeout=10)
+        except Exception as e:
+            print(f"Error stopping the pipeline event loop: {str(e)}")
+        return drained
+
+    async def _stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self.loop.call_soon(self.loop.stop)
+
+    async def _worker_loop(self, index):
+        stage = self.stages[index]
+
+        while True:
+            job, enqueued_at = await stage.queue.get()
+            started_at = time.monotonic()
+            stage.begin()
+            failed = False
+            result = None
+            try:
+                result = await stage.func(job)
+            except Exception as e:
+                failed = True
+                self._handle_error(job, stage, e)
+
+            stage.record(started_at - enqueued_at, time.monotonic() - started_at, failed)
+            await self._forward(index, result, failed)
+
+    def _handle_error(self, job, stage, error):
+        print(f"Error in {stage.name} stage: {str(error)}")
+        if self.on_error:
+            try:
+                self.on_error(job, stage.name, error)
+            except Exception as handler_error:
+                print(f"Error in {stage.name} error handler: {str(handler_error)}")
+
+    async def _forward(self, index, result, failed):
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        if result is not None and next_stage is not None:
+            # Waits when the next stage is saturated, which applies backpressure
+            await next_stage.queue.put((result, time.monotonic()))
+            return
+
+        with self._idle:
+            self._in_flight -= 1
+            if failed:
+                self._failed += 1
+            elif result is None and next_stage is not None:
+                self._dropped += 1
+            else:
+                self._completed += 1
+            self._idle.notify_all()
+
+
+def create_async_scheduler_from_env(stage_funcs, on_error=None):
+    """
+    Create an AsyncJobScheduler configured from environment variables.
+
+    Environment variables:
+        JOB_QUEUE_SIZE: Maximum number of jobs waiting for admission (default 16)
+        STAGE_QUEUE_SIZE: Maximum number of jobs waiting between stages (default 16)
+        <STAGE>_CONCURRENCY: Worker tasks per stage, e.g. IMAGE_CONCURRENCY
+                             (defaults: image 64, ply GRADIO_POOL_SIZE, optimize 2, others 64)
+        ASYNC_THREADS: Threads for blocking work of all stages (default 32)
+        JOB_RETRY_AFTER: Retry-After seconds for rejected jobs (default 30)
+
+    Args:
+        stage_funcs (list): Ordered (name, coroutine function) pairs
+        on_error (callable, optional): Error handler passed to the scheduler
+
+    Returns:
+        AsyncJobScheduler: A started scheduler
+    """
+    # Every reconstruction holds a pooled Gradio client, and PLY processing is CPU-bound
+    default_workers = {"image": 64, "ply": int(os.environ.get("GRADIO_POOL_SIZE", 2)), "optimize": 2}
+    stages = []
+    for index, (name, func) in enumerate(stage_funcs):
+        env_name = "JOB_QUEUE_SIZE" if index == 0 else "STAGE_QUEUE_SIZE"
+        stages.append(AsyncStage(
+            name,
+            func,
+            num_workers=int(os.environ.get(f"{name.upper()}_CONCURRENCY", default_workers.get(name, 64))),
+            max_queue_size=int(os.environ.get(env_name, 16))
+        ))
+
+    return AsyncJobScheduler(
+        stages,
+        on_error=on_error,
+        retry_after=int(os.environ.get("JOB_RETRY_AFTER", 30)),
+        max_threads=int(os.environ.get("ASYNC_THREADS", 32))
+    )
@@ -6,8 +6,10 @@ import os
 import sys
 import json
 import requests
+import http_client
 import argparse
 from datetime import datetime
+from storage_layout import sharded_path
 
 def check_generation_status(generation_id=None, metadata_url=None):
     """
@@ -26,7 +28,7 @@ def check_generation_status(generation_id=None, metadata_url=None):
     # If metadata_url is provided, use it directly
     if metadata_url:
         try:
-            response = requests.get(metadata_url)
+            response = http_client.get(metadata_url)
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
@@ -37,7 +39,7 @@ def check_generation_status(generation_id=None, metadata_url=None):
     if generation_id:
         # Try to construct the metadata URL
         # First, check the local file
-        metadata_path = os.path.join("metadata", f"metadata_{generation_id}.json")
+        metadata_path = sharded_path("metadata", f"metadata_{generation_id}.json")
         
         if os.path.exists(metadata_path):
             try:
@@ -52,7 +54,7 @@ def check_generation_status(generation_id=None, metadata_url=None):
         metadata_url = f"{base_url}/metadata/metadata_{generation_id}.json"
         
         try:
-            response = requests.get(metadata_url)
+            response = http_client.get(metadata_url)
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
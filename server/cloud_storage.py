@@ -10,33 +10,62 @@ import sys
 import json
 import uuid
 import time
+import asyncio
 import mimetypes
+import threading
 from datetime import datetime
 from urllib.parse import urlparse
+from storage_layout import sharded_path
+from asset_placement import place_file
+import http_client
+from content_store import content_name
+from upload_streaming import FileBody, MULTIPART_THRESHOLD, MULTIPART_PART_SIZE
 
 class CloudStorage:
     """Base class for cloud storage providers."""
     
+    # Provider name, as reported in the 'provider' field of upload results
+    name = 'unknown'
+    
+    # Store files under their SHA-256 digest and skip uploads of content that
+    # is already stored (set by the constructors of the providers)
+    content_addressed = False
+    
     def upload_file(self, file_path, content_type=None):
         """Upload a file to cloud storage."""
         raise NotImplementedError("Subclasses must implement upload_file")
+    
+    async def upload_file_async(self, file_path, content_type=None):
+        """
+        Upload a file from the asyncio pipeline.
+        
+        Runs upload_file in a worker thread; providers with an asyncio HTTP
+        implementation override this.
+        """
+        return await asyncio.to_thread(self.upload_file, file_path, content_type)
 
 class LocalFileStorage(CloudStorage):
-    """Local file storage that just copies files to a designated directory."""
+    """Local file storage that links or copies files into a designated directory."""
     
-    def __init__(self, storage_dir="storage"):
+    name = 'local'
+    
+    def __init__(self, storage_dir="storage", sharded=False, content_addressed=False):
         """
         Initialize local file storage.
         
         Args:
             storage_dir (str): Directory where files will be stored
+            sharded (bool): Store files in hashed shard subdirectories
+            content_addressed (bool): Store files as <sha256>.<ext>, once per content
         """
         self.storage_dir = storage_dir
+        self.sharded = sharded
+        self.content_addressed = content_addressed
         os.makedirs(storage_dir, exist_ok=True)
     
     def upload_file(self, file_path, content_type=None):
         """
-        'Upload' a file by copying it to the storage directory.
+        'Upload' a file by linking (or copying) it into the storage directory.
         
         Args:
             file_path (str): Path to the file to upload
@@ -45,17 +74,25 @@ class LocalFileStorage(CloudStorage):
         Returns:
             dict: Response with URL and other metadata
         """
-        import shutil
-        
-        # Generate a unique filename
-        filename = os.path.basename(file_path)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        unique_id = str(uuid.uuid4())[:8]
-        target_filename = f"{timestamp}_{unique_id}_{filename}"
-        target_path = os.path.join(self.storage_dir, target_filename)
+        digest = None
+        if self.content_addressed:
+            target_filename, digest = content_name(file_path)
+        else:
+            # Generate a unique filename
+            filename = os.path.basename(file_path)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            unique_id = str(uuid.uuid4())[:8]
+            target_filename = f"{timestamp}_{unique_id}_{filename}"
+        if self.sharded:
+            target_path = sharded_path(self.storage_dir, target_filename)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        else:
+            target_path = os.path.join(self.storage_dir, target_filename)
         
-        # Copy the file
-        shutil.copy2(file_path, target_path)
+        # Hardlink the file where possible; stored files are never modified
+        deduplicated = self.content_addressed and os.path.exists(target_path)
+        if not deduplicated:
+            place_file(file_path, target_path, keep_source=True)
         
         # Determine content type if not provided
         if content_type is None:
@@ -68,7 +105,9 @@ class LocalFileStorage(CloudStorage):
             'filename': target_filename,
             'contentType': content_type,
             'size': os.path.getsize(target_path),
-            'provider': 'local'
+            'provider': 'local',
+            'digest': digest,
+            'deduplicated': deduplicated
         }
 
 class VercelPublicBlobStorage(CloudStorage):
@@ -79,16 +118,20 @@ class VercelPublicBlobStorage(CloudStorage):
     It may not work in all cases due to Vercel's authentication requirements.
     """
     
-    def __init__(self, blob_url, store_id):
+    name = 'vercel-blob'
+    
+    def __init__(self, blob_url, store_id, content_addressed=False):
         """
         Initialize the Vercel Blob Storage client.
         
         Args:
             blob_url (str): Base URL for the Vercel Blob storage
             store_id (str): Store ID for the Vercel Blob storage
+            content_addressed (bool): Store files as <sha256>.<ext>, once per content
         """
         self.blob_url = blob_url.rstrip('/')
         self.store_id = store_id
+        self.content_addressed = content_addressed
     
     def upload_file(self, file_path, content_type=None):
         """
@@ -101,71 +144,146 @@ class VercelPublicBlobStorage(CloudStorage):
         Returns:
             dict: Response with URL and other metadata
         """
-        import requests
+        upload_url, unique_path, content_type, digest = self._upload_target(file_path, content_type)
+        
+        # Content that is already stored does not need to be sent again
+        if self.content_addressed and http_client.head(upload_url).status_code == 200:
+            return self._result(upload_url, unique_path, content_type, os.path.getsize(file_path), digest, True)
+        
+        # Stream the file instead of reading it into memory
+        body = FileBody(file_path)
+        
+        # Make the PUT request
+        response = http_client.put(
+            upload_url,
+            data=body,
+            headers=self._upload_headers(content_type),
+            timeout=60
+        )
+        
+        # Check if the upload was successful
+        if response.status_code in (200, 201):
+            return self._result(upload_url, unique_path, content_type, len(body), digest, False)
+        raise Exception(f"Upload failed ({response.status_code}): {self._error_message(response)}")
+    
+    async def upload_file_async(self, file_path, content_type=None):
+        """
+        Upload a file to Vercel Blob Storage with the asyncio HTTP client.
+        
+        Args:
+            file_path (str): Path to the file to upload
+            content_type (str, optional): Content type of the file
+            
+        Returns:
+            dict: Response with URL and other metadata
+        """
+        client = http_client.get_async_client()
+        # Hashes the file unless its digest is known
+        upload_url, unique_path, content_type, digest = await asyncio.to_thread(self._upload_target, file_path, content_type)
+        body = await asyncio.to_thread(FileBody, file_path)
+        
+        if self.content_addressed and (await client.head(upload_url)).status_code == 200:
+            return self._result(upload_url, unique_path, content_type, len(body), digest, True)
+        
+        headers = dict(self._upload_headers(content_type), **{'Content-Length': str(len(body))})
+        # httpx sends any sync iterable from a sync client, so pass the async iterator
+        response = await client.put(upload_url, content=aiter(body), headers=headers, timeout=60)
+        
+        if response.status_code in (200, 201):
+            return self._result(upload_url, unique_path, content_type, len(body), digest, False)
+        raise Exception(f"Upload failed ({response.status_code}): {self._error_message(response)}")
+    
+    def _upload_target(self, file_path, content_type):
+        # Returns (upload URL, blob path, content type, digest or None)
         from urllib.parse import quote
         
         # Determine content type if not provided
         if content_type is None:
             content_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
         
-        # Generate a unique filename
-        filename = os.path.basename(file_path)
-        timestamp = int(time.time())
-        unique_id = str(uuid.uuid4())[:8]
-        unique_path = f"{timestamp}-{unique_id}-{filename}"
+        digest = None
+        if self.content_addressed:
+            unique_path, digest = content_name(file_path)
+        else:
+            # Generate a unique filename
+            filename = os.path.basename(file_path)
+            timestamp = int(time.time())
+            unique_id = str(uuid.uuid4())[:8]
+            unique_path = f"{timestamp}-{unique_id}-{filename}"
         
         # URL-encode the unique path
-        encoded_path = quote(unique_path)
-        
-        # Construct the URL
-        upload_url = f"{self.blob_url}/{encoded_path}"
-        
-        # Read the file
-        with open(file_path, 'rb') as f:
-            file_content = f.read()
-        
-        # Upload headers
-        headers = {
+        return f"{self.blob_url}/{quote(unique_path)}", unique_path, content_type, digest
+    
+    def _upload_headers(self, content_type):
+        return {
             'Content-Type': content_type,
             'x-vercel-blob-store-id': self.store_id
         }
+    
+    def _result(self, upload_url, unique_path, content_type, size, digest, deduplicated):
+        return {
+            'url': upload_url,
+            'pathname': unique_path,
+            'contentType': content_type,
+            'size': size,
+            'provider': 'vercel-blob',
+            'digest': digest,
+            'deduplicated': deduplicated
+        }
+    
+    def _error_message(self, response):
+        # Try to parse error message
+        try:
+            error_json = response.json()
+            return error_json.get('error', {}).get('message', response.text)
+        except Exception:
+            return response.text
+
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+
+def get_s3_client(region_name='us-east-1', endpoint_url=None):
+    """
+    Return a shared S3 client for a region and endpoint.
+    
+    Creating a client resolves credentials, loads endpoint data and sets up a
+    connection pool, so one client per (region, endpoint) is created and
+    reused. boto3 clients are thread-safe once created.
+    
+    Args:
+        region_name (str): AWS region name
+        endpoint_url (str, optional): Custom endpoint, e.g. MinIO or moto
         
-        # Make the PUT request
-        response = requests.put(
-            upload_url,
-            data=file_content,
-            headers=headers,
-            timeout=60
-        )
-        
-        # Check if the upload was successful
-        if response.status_code in (200, 201):
-            return {
-                'url': upload_url,
-                'pathname': unique_path,
-                'contentType': content_type,
-                'size': len(file_content),
-                'provider': 'vercel-blob'
-            }
-        else:
-            # Try to parse error message
-            try:
-                error_json = response.json()
-                error_message = error_json.get('error', {}).get('message', response.text)
-            except:
-                error_message = response.text
-                
-            raise Exception(f"Upload failed ({response.status_code}): {error_message}")
+    Returns:
+        botocore.client.S3: The cached client
+    """
+    try:
+        import boto3
+    except ImportError:
+        raise ImportError("boto3 is required for S3Storage. Install it with: pip install boto3")
+    
+    key = (region_name, endpoint_url)
+    with _s3_clients_lock:
+        client = _s3_clients.get(key)
+        if client is None:
+            # Sessions are not thread-safe, so create the client under the lock
+            client = boto3.session.Session().client('s3', region_name=region_name, endpoint_url=endpoint_url)
+            _s3_clients[key] = client
+        return client
 
 class S3Storage(CloudStorage):
     """
-    AWS S3 storage client.
+    AWS S3 (or S3-compatible) storage client.
     
     Requires boto3 to be installed: pip install boto3
     Requires AWS credentials to be configured.
     """
     
-    def __init__(self, bucket_name, region_name='us-east-1', prefix=''):
+    name = 's3'
+    
+    def __init__(self, bucket_name, region_name='us-east-1', prefix='', endpoint_url=None,
+                 multipart_threshold=MULTIPART_THRESHOLD, multipart_chunksize=MULTIPART_PART_SIZE,
+                 max_concurrency=4, content_addressed=False):
         """
         Initialize the S3 storage client.
         
@@ -173,10 +291,52 @@ class S3Storage(CloudStorage):
             bucket_name (str): Name of the S3 bucket
             region_name (str): AWS region name
             prefix (str): Prefix for object keys (like a folder)
+            endpoint_url (str, optional): Endpoint of an S3-compatible service (MinIO, moto)
+            multipart_threshold (int): Minimum file size for multipart uploads
+            multipart_chunksize (int): Size of one part
+            max_concurrency (int): Parts uploaded in parallel (each holds one part in memory)
+            content_addressed (bool): Store files as <sha256>.<ext>, once per content
         """
         self.bucket_name = bucket_name
         self.region_name = region_name
         self.prefix = prefix.rstrip('/') + '/' if prefix else ''
+        self.endpoint_url = endpoint_url.rstrip('/') if endpoint_url else None
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunksize = multipart_chunksize
+        self.max_concurrency = max_concurrency
+        self.content_addressed = content_addressed
+        self._transfer_config = None
+    
+    def transfer_config(self):
+        """Return the boto3 TransferConfig for multipart uploads."""
+        if self._transfer_config is None:
+            from boto3.s3.transfer import TransferConfig
+            self._transfer_config = TransferConfig(
+                multipart_threshold=self.multipart_threshold,
+                multipart_chunksize=self.multipart_chunksize,
+                max_concurrency=self.max_concurrency
+            )
+        return self._transfer_config
+    
+    def object_exists(self, object_key):
+        """
+        Check with a HEAD request whether an object exists.
+        
+        Args:
+            object_key (str): Key of the object
+            
+        Returns:
+            bool: True if the object exists
+        """
+        from botocore.exceptions import ClientError
+        
+        try:
+            get_s3_client(self.region_name, self.endpoint_url).head_object(Bucket=self.bucket_name, Key=object_key)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
     
     def upload_file(self, file_path, content_type=None):
         """
@@ -189,34 +349,43 @@ class S3Storage(CloudStorage):
         Returns:
             dict: Response with URL and other metadata
         """
-        try:
-            import boto3
-        except ImportError:
-            raise ImportError("boto3 is required for S3Storage. Install it with: pip install boto3")
+        s3_client = get_s3_client(self.region_name, self.endpoint_url)
         
         # Determine content type if not provided
         if content_type is None:
             content_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
         
-        # Generate a unique key
-        filename = os.path.basename(file_path)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        unique_id = str(uuid.uuid4())[:8]
-        object_key = f"{self.prefix}{timestamp}_{unique_id}_{filename}"
+        extra_args = {'ContentType': content_type}
+        digest = None
+        deduplicated = False
+        if self.content_addressed:
+            name, digest = content_name(file_path)
+            object_key = f"{self.prefix}{name}"
+            extra_args['Metadata'] = {'sha256': digest}
+            deduplicated = self.object_exists(object_key)
+        else:
+            # Generate a unique key
+            filename = os.path.basename(file_path)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            unique_id = str(uuid.uuid4())[:8]
+            object_key = f"{self.prefix}{timestamp}_{unique_id}_{filename}"
         
-        # Create S3 client
-        s3_client = boto3.client('s3', region_name=self.region_name)
-        
-        # Upload file
-        s3_client.upload_file(
-            file_path, 
-            self.bucket_name, 
-            object_key,
-            ExtraArgs={'ContentType': content_type}
-        )
+        if not deduplicated:
+            # Upload file (streamed from disk; large files go up in parts that
+            # are retried individually, with at most max_concurrency parts in memory)
+            s3_client.upload_file(
+                file_path, 
+                self.bucket_name, 
+                object_key,
+                ExtraArgs=extra_args,
+                Config=self.transfer_config()
+            )
         
         # Generate URL
-        url = f"https://{self.bucket_name}.s3.{self.region_name}.amazonaws.com/{object_key}"
+        if self.endpoint_url:
+            url = f"{self.endpoint_url}/{self.bucket_name}/{object_key}"
+        else:
+            url = f"https://{self.bucket_name}.s3.{self.region_name}.amazonaws.com/{object_key}"
         
         return {
             'url': url,
@@ -224,7 +393,9 @@ class S3Storage(CloudStorage):
             'key': object_key,
             'contentType': content_type,
             'size': os.path.getsize(file_path),
-            'provider': 's3'
+            'provider': 's3',
+            'digest': digest,
+            'deduplicated': deduplicated
         }
 
 def get_storage_provider(provider_type=None, **kwargs):
@@ -233,7 +404,9 @@ def get_storage_provider(provider_type=None, **kwargs):
     
     Args:
         provider_type (str): Type of storage provider
-        **kwargs: Additional arguments for the storage provider
+        **kwargs: Additional arguments for the storage provider; for 's3'
+            these include endpoint_url and the TransferConfig settings
+            multipart_threshold, multipart_chunksize and max_concurrency
         
     Returns:
         CloudStorage: An instance of a storage provider
@@ -262,6 +435,7 @@ def main():
     parser.add_argument('--bucket', help='S3 bucket name (for s3 provider)')
     parser.add_argument('--region', default='us-east-1', help='AWS region (for s3 provider)')
     parser.add_argument('--prefix', help='Key prefix (for s3 provider)')
+    parser.add_argument('--endpoint-url', help='S3-compatible endpoint, e.g. MinIO (for s3 provider)')
     parser.add_argument('--blob-url', help='Vercel Blob URL (for vercel-blob provider)')
     parser.add_argument('--store-id', help='Vercel Blob store ID (for vercel-blob provider)')
     parser.add_argument('--storage-dir', default='storage', help='Local storage directory (for local provider)')
@@ -285,6 +459,8 @@ def main():
         }
         if args.prefix:
             kwargs['prefix'] = args.prefix
+        if args.endpoint_url:
+            kwargs['endpoint_url'] = args.endpoint_url
     
     elif args.provider == 'vercel-blob':
         if not args.blob_url or not args.store_id:
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+Content addressing for stored assets.
+
+In content-addressed mode the storage providers store a file under the
+SHA-256 digest of its bytes (`<digest>.<ext>`) instead of a fresh
+timestamp+uuid name, so identical files are stored once: before uploading,
+a provider checks whether the digest is already present (on disk, or with a
+HEAD request on the remote) and skips the transfer if it is. Retried uploads
+and cache hits therefore transfer no bytes.
+
+Digests are computed while a file is written where possible (`HashingWriter`)
+and otherwise by streaming the file once; they are cached per path, size and
+mtime. Which jobs (and result cache entries) use which digest is tracked by
+reference counts (`AssetReferences`), so an asset can be deleted once
+nothing refers to it any more.
+"""
+import os
+import re
+import hashlib
+import threading
+from job_store import SqliteDatabase
+
+HASH_CHUNK_SIZE = 1024 * 1024
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+_digest_cache = {}
+_digest_lock = threading.Lock()
+
+
+class HashingWriter:
+    """
+    A binary file writer that computes the SHA-256 of everything written.
+
+    Use as a context manager; the digest is recorded for the path on close.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "wb")
+        self._hash = hashlib.sha256()
+
+    def write(self, data):
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        """Return the digest of the bytes written so far."""
+        return self._hash.hexdigest()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+            record_digest(self.path, self.hexdigest())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _stat_key(path):
+    # path may also be the descriptor of an open file
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def record_digest(path, digest):
+    """
+    Remember the digest of a file that was hashed while it was written.
+
+    Args:
+        path (str): Path of the file
+        digest (str): Hex SHA-256 of its content
+    """
+    with _digest_lock:
+        _digest_cache[os.path.abspath(path)] = (_stat_key(path), digest)
+
+
+def file_sha256(path, opened=None):
+    """
+    Return the SHA-256 of a file, streaming it only if the digest is not known.
+
+    Args:
+        path (str): Path of the file
+        opened (file, optional): The file, already open in binary mode; its
+                                 size, mtime and content are used, so the
+                                 digest matches what is read from it even if
+                                 the path was replaced in the meantime
+
+    Returns:
+        str: Hex digest
+    """
+    key = _stat_key(opened.fileno() if opened is not None else path)
+    absolute = os.path.abspath(path)
+    with _digest_lock:
+        cached = _digest_cache.get(absolute)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    if opened is not None:
+        opened.seek(0)
+        for chunk in iter(lambda: opened.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    else:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+    digest = digest.hexdigest()
+    with _digest_lock:
+        _digest_cache[absolute] = (key, digest)
+    return digest
+
+
+def content_name(path, digest=None):
+    """
+    Return the content-addressed name of a file: <sha256>.<extension>.
+
+    Args:
+        path (str): Path of the file (its extension is kept)
+        digest (str, optional): Known digest of the file
+
+    Returns:
+        tuple: (name, digest)
+    """
+    digest = digest or file_sha256(path)
+    return f"{digest}{os.path.splitext(path)[1].lower()}", digest
+
+
+class AssetReferences:
+    """
+    Reference counts of content digests, stored in SQLite.
+
+    A reference is a (digest, owner) row, where the owner is a job ID or
+    another user of the content such as a result cache entry. Adding or
+    releasing references touches only the rows involved, and the database
+    is shared by all server processes.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS asset_refs ("
+        "digest TEXT NOT NULL, owner TEXT NOT NULL, PRIMARY KEY (digest, owner))",
+        "CREATE INDEX IF NOT EXISTS asset_refs_owner ON asset_refs (owner)",
+    )
+
+    def __init__(self, db_path):
+        """
+        Open the database.
+
+        Args:
+            db_path (str): SQLite database file
+        """
+        self.db = SqliteDatabase(db_path, self.SCHEMA)
+
+    def add(self, digest, owner):
+        """
+        Record that a job (or other owner) uses an asset.
+
+        Returns:
+            int: The asset's reference count
+        """
+        with self.db.transaction() as connection:
+            connection.execute("INSERT OR IGNORE INTO asset_refs (digest, owner) VALUES (?, ?)", (digest, owner))
+            return connection.execute("SELECT COUNT(*) FROM asset_refs WHERE digest = ?", (digest,)).fetchone()[0]
+
+    def release(self, owner):
+        """
+        Drop all references of a job (or other owner).
+
+        Returns:
+            list: Digests that are no longer referenced and can be deleted
+        """
+        with self.db.transaction() as connection:
+            digests = [row[0] for row in connection.execute("SELECT digest FROM asset_refs WHERE owner = ?", (owner,))]
+            connection.execute("DELETE FROM asset_refs WHERE owner = ?", (owner,))
+            return [
+                digest for digest in digests
+                if connection.execute("SELECT 1 FROM asset_refs WHERE digest = ? LIMIT 1", (digest,)).fetchone() is None
+            ]
+
+    def count(self, digest):
+        """Return the number of owners referring to an asset."""
+        return self.db.connection().execute("SELECT COUNT(*) FROM asset_refs WHERE digest = ?", (digest,)).fetchone()[0]
+
+    def stats(self):
+        """Return the number of assets and of references to them."""
+        assets, references = self.db.connection().execute(
+            "SELECT COUNT(DISTINCT digest), COUNT(*) FROM asset_refs"
+        ).fetchone()
+        return {"assets": assets, "references": references}
@@ -1,7 +1,204 @@
 #!/usr/bin/env python
 from gradio_client import Client, handle_file
 import os
-import shutil
+import time
+import queue
+import asyncio
+import tempfile
+import threading
+import http_client
+from contextlib import contextmanager
+from urllib.parse import urljoin
+from asset_placement import place_file, cleanup_download_dir
+
+# Gradio app used for the reconstruction; point it at a local Gradio-compatible
+# server (e.g. http://127.0.0.1:7860/) for testing
+INVISIBLE_STITCH_SRC = os.environ.get("INVISIBLE_STITCH_SRC", "paulengstler/invisible-stitch")
+
+# Where Gradio stores downloaded results; on the same filesystem as plys/ the
+# result is moved into place with a rename instead of being copied
+GRADIO_DOWNLOAD_DIR = os.environ.get("GRADIO_DOWNLOAD_DIR") or os.path.join(
+    os.environ.get("GRADIO_TEMP_DIR") or tempfile.gettempdir(), "gradio"
+)
+
+# Errors that mean the connection to the Gradio app is broken (not a failed prediction)
+try:
+    import httpx
+    CONNECTION_ERRORS = (ConnectionError, httpx.TransportError)
+except ImportError:
+    CONNECTION_ERRORS = (ConnectionError,)
+
+class GradioClientPool:
+    """
+    A thread-safe pool of long-lived Gradio clients.
+    
+    Creating a Client fetches the app config and performs a handshake, which
+    takes seconds, so clients are created lazily (up to the pool size) and
+    reused. Clients that have been idle for a while are health-checked before
+    being handed out, and clients that failed are replaced by new ones.
+    """
+    
+    def __init__(self, src, hf_token=None, size=2, health_check_interval=300, client_factory=None):
+        """
+        Initialize the pool.
+        
+        Args:
+            src (str): Hugging Face Space name or URL of the Gradio app
+            hf_token (str, optional): Hugging Face token
+            size (int): Maximum number of clients
+            health_check_interval (float): Idle seconds after which a client is
+                                           health-checked before reuse
+            client_factory (callable, optional): Creates a client; defaults to gradio_client.Client
+        """
+        self.src = src
+        self.hf_token = hf_token
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self.client_factory = client_factory or self._create_client
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._discarded = 0
+    
+    def _create_client(self):
+        try:
+            return Client(self.src, token=self.hf_token, download_files=GRADIO_DOWNLOAD_DIR)
+        except TypeError:
+            # gradio_client < 1.0 names these hf_token and output_dir
+            return Client(self.src, hf_token=self.hf_token, output_dir=GRADIO_DOWNLOAD_DIR)
+    
+    def acquire(self, timeout=None):
+        """
+        Take a client from the pool, creating one if none is idle.
+        
+        Args:
+            timeout (float, optional): Maximum seconds to wait for a free client
+        
+        Returns:
+            Client: A healthy Gradio client
+        
+        Raises:
+            TimeoutError: If no client became available in time
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("No Gradio client available")
+        
+        try:
+            while True:
+                try:
+                    client, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    client = self.client_factory()
+                    with self._lock:
+                        self._created += 1
+                    return client
+                
+                if time.monotonic() - last_used < self.health_check_interval or self.is_healthy(client):
+                    return client
+                self._close(client)
+        except Exception:
+            self._slots.release()
+            raise
+    
+    def release(self, client, healthy=True):
+        """
+        Return a client to the pool.
+        
+        Args:
+            client (Client): The client taken with acquire()
+            healthy (bool): False to discard the client (e.g. after a connection error)
+        """
+        try:
+            if healthy:
+                self._idle.put((client, time.monotonic()))
+            else:
+                self._close(client)
+        finally:
+            self._slots.release()
+    
+    @contextmanager
+    def client(self, timeout=None):
+        """
+        Context manager that borrows a client from the pool.
+        
+        The client is discarded instead of returned if the block raises a
+        connection error.
+        """
+        client = self.acquire(timeout)
+        healthy = True
+        try:
+            yield client
+        except CONNECTION_ERRORS:
+            healthy = False
+            raise
+        finally:
+            self.release(client, healthy)
+    
+    def is_healthy(self, client):
+        """
+        Check that the Gradio app behind a client still answers.
+        
+        Returns:
+            bool: True if the app's config endpoint responds
+        """
+        try:
+            response = http_client.get(
+                urljoin(client.src, "config"),
+                headers=getattr(client, "headers", None),
+                timeout=10
+            )
+            return response.status_code == 200
+        except Exception:
+            return False
+    
+    def stats(self):
+        """Return the pool size and client counters."""
+        with self._lock:
+            return {
+                "size": self.size,
+                "idle": self._idle.qsize(),
+                "created": self._created,
+                "discarded": self._discarded
+            }
+    
+    def _close(self, client):
+        with self._lock:
+            self._discarded += 1
+        try:
+            client.close()
+        except Exception:
+            pass
+
+_client_pool = None
+_client_pool_lock = threading.Lock()
+
+def get_client_pool():
+    """
+    Return the shared Gradio client pool, creating it on first use.
+    
+    Environment variables:
+        INVISIBLE_STITCH_SRC: Space name or URL of the Gradio app
+        HF_TOKEN: Hugging Face token
+        GRADIO_POOL_SIZE: Maximum number of clients (default 2)
+        GRADIO_HEALTH_CHECK_INTERVAL: Idle seconds before a health check (default 300)
+    
+    Returns:
+        GradioClientPool: The shared pool
+    """
+    global _client_pool
+    with _client_pool_lock:
+        if _client_pool is None:
+            hf_token = os.environ.get("HF_TOKEN")
+            if not hf_token:
+                print("Warning: HF_TOKEN not found in environment variables. Proceeding without token.")
+            _client_pool = GradioClientPool(
+                INVISIBLE_STITCH_SRC,
+                hf_token=hf_token,
+                size=int(os.environ.get("GRADIO_POOL_SIZE", 2)),
+                health_check_interval=float(os.environ.get("GRADIO_HEALTH_CHECK_INTERVAL", 300))
+            )
+        return _client_pool
 
 def generate_ply(image_path, prompt, output_filename=None):
     """
@@ -16,59 +213,316 @@ def generate_ply(image_path, prompt, output_filename=None):
     Returns:
         str: Path to the generated .ply file
     """
+    pool = get_client_pool()
+    
     try:
-        # Get token from environment if available
-        hf_token = os.environ.get("HF_TOKEN")
+        # Make prediction with a pooled client
+        with pool.client() as client:
+            result = client.predict(
+                handle_file(image_path),
+                prompt,
+                api_name="/predict"
+            )
+    except CONNECTION_ERRORS as e:
+        # The broken client was discarded; retry once with a fresh connection
+        print(f"Gradio connection failed ({str(e)}), reconnecting...")
+        with pool.client() as client:
+            result = client.predict(
+                handle_file(image_path),
+                prompt,
+                api_name="/predict"
+            )
+    
+    return place_result(result, output_filename)
 
-        if not hf_token:
-            print("Warning: HF_TOKEN not found in environment variables. Proceeding without token.")
+def place_result(result, output_filename=None):
+    """
+    Move a prediction result out of the Gradio download directory.
+    
+    Args:
+        result (str): Path of the .ply file returned by the Gradio app
+        output_filename (str, optional): Target path; if None the result path is returned
+    
+    Returns:
+        str: Path to the .ply file
+    """
+    # If output_filename is provided, move the result to the target location
+    if output_filename:
+        # If output_filename doesn't have .ply extension, add it
+        if not output_filename.endswith('.ply'):
+            output_filename += '.ply'
         
-        # Initialize client with token if available
-        client = Client(
-            "paulengstler/invisible-stitch",
-            hf_token=hf_token
-        )
+        # Rename (or link/clone) rather than copy, then drop Gradio's per-file directory
+        method = place_file(result, output_filename)
+        cleanup_download_dir(result, GRADIO_DOWNLOAD_DIR)
+        print(f"Placed PLY at {output_filename} ({method})")
+        return output_filename
+    
+    return result
+
+class PlyJobHandle:
+    """
+    Handle of a reconstruction submitted with submit_ply().
+    
+    Wraps the Gradio job so it can be polled, waited for or cancelled
+    without tying up a thread for the whole reconstruction. The handle owns
+    a pooled client until the reconstruction is done: Gradio cancels jobs
+    per client session, so jobs must not share a client to be cancellable
+    individually.
+    """
+    
+    def __init__(self, job, output_filename=None, pool=None, client=None):
+        self.job = job
+        self.output_filename = output_filename
+        self.submitted_at = time.monotonic()
+        self._pool = pool
+        self._client = client
+        self._close_lock = threading.Lock()
+    
+    def close(self, healthy=True):
+        """
+        Return the client to the pool (called automatically once done).
         
-        # Make prediction
-        result = client.predict(
-            handle_file(image_path),
-            prompt,
-            api_name="/predict"
-        )
+        Args:
+            healthy (bool): False to discard the client instead, e.g. after it lost its connection
+        """
+        with self._close_lock:
+            client, self._client = self._client, None
+        if client is not None and self._pool is not None:
+            self._pool.release(client, healthy)
+    
+    def status(self):
+        """
+        Return the current state of the reconstruction.
+        
+        Returns:
+            dict: code (e.g. IN_QUEUE, PROCESSING, FINISHED), queue_position,
+                  queue_size and eta (seconds, may be None)
+        """
+        update = self.job.status()
+        code = update.code.value if hasattr(update.code, "value") else str(update.code)
+        return {
+            "code": code,
+            "queue_position": update.rank,
+            "queue_size": update.queue_size,
+            "eta": round(update.eta, 1) if update.eta is not None else None
+        }
+    
+    def done(self):
+        """Return True once the reconstruction has finished, failed or been cancelled."""
+        return self.job.done() or self.cancelled()
+    
+    def cancelled(self):
+        """Return True if the reconstruction was cancelled."""
+        return self.job.cancelled() or self.status()["code"] == "CANCELLED"
+    
+    def cancel(self):
+        """
+        Cancel the reconstruction as far as the Gradio app allows.
+        
+        Returns:
+            bool: True if the cancellation was accepted
+        """
+        return self.job.cancel()
+    
+    def result(self, timeout=None):
+        """
+        Wait for the reconstruction and move the PLY into place.
         
-        # If output_filename is provided, copy the result to the target location
-        if output_filename:
-            # If output_filename doesn't have .ply extension, add it
-            if not output_filename.endswith('.ply'):
-                output_filename += '.ply'
+        Args:
+            timeout (float, optional): Maximum seconds to wait
+        
+        Returns:
+            str: Path to the generated .ply file
+        """
+        try:
+            result = self.job.result(timeout=timeout)
+        finally:
+            if self.job.done():
+                self.close()
+        return place_result(result, self.output_filename)
+
+def submit_ply(image_path, prompt, output_filename=None):
+    """
+    Submit a reconstruction to Invisible Stitch without waiting for it.
+    
+    Args:
+        image_path (str): Path to the input image
+        prompt (str): Prompt for expanding the scene
+        output_filename (str, optional): Base filename to use for the output .ply file
+    
+    Returns:
+        PlyJobHandle: Handle to poll, wait for or cancel the reconstruction
+    """
+    pool = get_client_pool()
+    for attempt in range(2):
+        client = pool.acquire()
+        try:
+            job = client.submit(handle_file(image_path), prompt, api_name="/predict")
+            return PlyJobHandle(job, output_filename, pool, client)
+        except CONNECTION_ERRORS as e:
+            pool.release(client, healthy=False)
+            if attempt:
+                raise
+            print(f"Gradio connection failed ({str(e)}), reconnecting...")
+        except Exception:
+            pool.release(client)
+            raise
+
+async def generate_ply_async(image_path, prompt, output_filename=None, on_status=None, should_cancel=None, poll_interval=2):
+    """
+    Reconstruct a PLY from the asyncio pipeline without holding a thread while it runs.
+    
+    The reconstruction is submitted and then polled from the event loop; the
+    blocking Gradio calls (submit, status, result) and the callbacks run in
+    worker threads.
+    
+    Args:
+        image_path (str): Path to the input image
+        prompt (str): Prompt for expanding the scene
+        output_filename (str, optional): Base filename to use for the output .ply file
+        on_status (callable, optional): Called with the status dict when it changes
+        should_cancel (callable, optional): Polled; returning True cancels the reconstruction
+        poll_interval (float): Seconds between status polls
+    
+    Returns:
+        str: Path to the generated .ply file, or None if it was cancelled
+    """
+    handle = await asyncio.to_thread(submit_ply, image_path, prompt, output_filename)
+    try:
+        last = None
+        while not await asyncio.to_thread(handle.done):
+            if should_cancel and await asyncio.to_thread(should_cancel):
+                await asyncio.to_thread(handle.cancel)
+                return None
+            status = await asyncio.to_thread(handle.status)
+            if status != last:
+                last = status
+                if on_status:
+                    await asyncio.to_thread(on_status, status)
+            await asyncio.sleep(poll_interval)
+        
+        if await asyncio.to_thread(handle.cancelled):
+            return None
+        return await asyncio.to_thread(handle.result)
+    except asyncio.CancelledError:
+        handle.cancel()
+        raise
+    finally:
+        handle.close()
+
+class PlySupervisor:
+    """
+    Supervises many submitted reconstructions from a single thread.
+    
+    The thread polls the handles, reports status changes (queue position,
+    ETA) and calls the completion callback once a reconstruction is done.
+    A reconstruction that cannot be polled max_failures times in a row (e.g.
+    the Gradio app is unreachable) is given up and its error callback called.
+    """
+    
+    def __init__(self, poll_interval=2, max_failures=5):
+        """
+        Initialize the supervisor and start its polling thread.
+        
+        Args:
+            poll_interval (float): Seconds between status polls
+            max_failures (int): Consecutive failed polls before a reconstruction is given up
+        """
+        self.poll_interval = poll_interval
+        self.max_failures = max_failures
+        self._lock = threading.Lock()
+        self._watched = {}
+        self._thread = threading.Thread(target=self._poll_loop, name="ply-supervisor", daemon=True)
+        self._thread.start()
+    
+    def watch(self, key, handle, on_status, on_done, on_error=None):
+        """
+        Start supervising a submitted reconstruction.
+        
+        Args:
+            key (str): Identifier of the reconstruction, e.g. the job ID
+            handle (PlyJobHandle): The submitted reconstruction
+            on_status (callable): Called with the status dict when it changes
+            on_done (callable): Called with the handle once it is done
+            on_error (callable, optional): Called with the handle and the last
+                                           exception if polling keeps failing
+        """
+        with self._lock:
+            self._watched[key] = {
+                "handle": handle, "on_status": on_status, "on_done": on_done, "on_error": on_error,
+                "last": None, "failures": 0
+            }
+    
+    def cancel(self, key):
+        """
+        Cancel a supervised reconstruction.
+        
+        Returns:
+            bool: True if the reconstruction was found and the cancellation accepted
+        """
+        with self._lock:
+            watched = self._watched.get(key)
+        return bool(watched and watched["handle"].cancel())
+    
+    def stats(self):
+        """Return the number of supervised reconstructions."""
+        with self._lock:
+            return {"outstanding": len(self._watched)}
+    
+    def _poll_loop(self):
+        while True:
+            with self._lock:
+                watched = list(self._watched.items())
             
-            # Create target directory if it doesn't exist
-            output_dir = os.path.dirname(output_filename)
-            if output_dir and not os.path.exists(output_dir):
-                os.makedirs(output_dir, exist_ok=True)
-                
-            # Copy the file from the result location to the target location
-            shutil.copy(result, output_filename)
-            return output_filename
-        
-        return result
-    except Exception as e:
-        # Raise the original exception
-        raise e
+            for key, entry in watched:
+                handle = entry["handle"]
+                try:
+                    if handle.done():
+                        with self._lock:
+                            del self._watched[key]
+                        handle.close()
+                        entry["on_done"](handle)
+                        continue
+                    
+                    status = handle.status()
+                    entry["failures"] = 0
+                    if status != entry["last"]:
+                        entry["last"] = status
+                        entry["on_status"](status)
+                except Exception as e:
+                    entry["failures"] += 1
+                    print(f"Error supervising reconstruction {key} "
+                          f"({entry['failures']}/{self.max_failures}): {str(e)}")
+                    if entry["failures"] >= self.max_failures:
+                        self._give_up(key, entry, e)
+            
+            time.sleep(self.poll_interval)
+    
+    def _give_up(self, key, entry, error):
+        with self._lock:
+            self._watched.pop(key, None)
+        handle = entry["handle"]
+        try:
+            handle.cancel()
+        except Exception:
+            pass
+        handle.close(healthy=False)
+        if entry["on_error"] is not None:
+            try:
+                entry["on_error"](handle, error)
+            except Exception as e:
+                print(f"Error failing reconstruction {key}: {str(e)}")
 
 if __name__ == "__main__":
     # Example usage when script is run directly
     # Example of file URL usage
-    hf_token = os.environ.get("HF_TOKEN")
-    client = Client(
-        "paulengstler/invisible-stitch", 
-        hf_token=hf_token
-    )
-    result = client.predict(
-        handle_file('https://raw.githubusercontent.com/gradio-app/gradio/main/test/test_files/bus.png'),
-        "Expand this scene with a beautiful mountain landscape",
-        api_name="/predict"
-    )
+    with get_client_pool().client() as client:
+        result = client.predict(
+            handle_file('https://raw.githubusercontent.com/gradio-app/gradio/main/test/test_files/bus.png'),
+            "Expand this scene with a beautiful mountain landscape",
+            api_name="/predict"
+        )
     print(f"Generated 3D model saved at: {result}")
     
     # Example of local file usage
@@ -0,0 +1,38 @@
+"""
+Gunicorn configuration for production serving.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Every worker process runs the Flask app and its own job pipeline. With more
+than one worker, job state is shared through SQLite (JOB_STORE=sqlite), so a
+status request can be answered by any worker, whichever accepted the job.
+"""
+import os
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get("SERVER_WORKERS", 4))
+# Threads per worker. Every open status event stream (/jobs/<id>/events)
+# holds one, so with about `threads` status pages open at once, other
+# requests to that worker wait until a stream ends. Streams are closed after
+# EVENT_STREAM_LIFETIME seconds (default 25) and the browser reconnects, so
+# a thread is held for at most that long; raise SERVER_THREADS for more
+# concurrent viewers.
+worker_class = "gthread"
+threads = int(os.environ.get("SERVER_THREADS", 16))
+timeout = int(os.environ.get("SERVER_TIMEOUT", 120))
+keepalive = 5
+# Workers are never recycled (max_requests) and the app is not preloaded:
+# each worker starts its own pipeline threads and render processes
+preload_app = False
+# Let a stopping worker drain its admitted jobs (see SHUTDOWN_DRAIN_TIMEOUT)
+graceful_timeout = int(float(os.environ.get("SHUTDOWN_DRAIN_TIMEOUT", 300)))
+accesslog = os.environ.get("SERVER_ACCESS_LOG") or None
+
+
+def on_starting(server):
+    # Runs in the master before the workers are forked, so they inherit it
+    if server.cfg.workers > 1:
+        os.environ.setdefault("JOB_STORE", "sqlite")
+        if os.environ["JOB_STORE"] != "sqlite":
+            print(f"Warning: {server.cfg.workers} workers with JOB_STORE={os.environ['JOB_STORE']}; "
+                  "status requests only see the jobs of the worker that answers them")
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""
+A shared HTTP session for all outbound requests of the server.
+
+Module-level `requests.get/put/post` calls open a new TCP (and TLS)
+connection every time. All outbound calls go through one `requests.Session`
+instead, whose connection pools keep connections to each host alive, so the
+handshake is paid once per connection rather than once per request. The
+session also applies default timeouts and retries idempotent requests with
+exponential backoff on connection errors and 429/5xx responses (honouring
+Retry-After). Requests that the caller retries itself (the parts of a
+multipart upload) use `get_upload_session`, which has the same pools and
+timeouts but no automatic retries, so attempts do not multiply.
+
+The asyncio pipeline uses an `httpx.AsyncClient` per event loop
+(`get_async_client`) with the same pool size and timeouts; it retries
+failed connection attempts, but not error responses.
+
+Environment variables:
+    HTTP_POOL_HOSTS: Number of hosts with a cached connection pool (default 10)
+    HTTP_POOL_SIZE: Maximum keep-alive connections per host (default 16)
+    HTTP_CONNECT_TIMEOUT: Connect timeout in seconds (default 10)
+    HTTP_READ_TIMEOUT: Read timeout in seconds (default 60)
+    HTTP_RETRIES: Retries of idempotent requests (default 3)
+    HTTP_BACKOFF_FACTOR: Backoff factor between retries in seconds (default 0.5)
+    HTTP_ASYNC_MAX_CONNECTIONS: Open connections of the asyncio client (default 100)
+"""
+import os
+import asyncio
+import weakref
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_session = None
+_upload_session = None
+_session_lock = threading.Lock()
+# Event loop -> httpx.AsyncClient; a client cannot be shared between loops
+_async_clients = weakref.WeakKeyDictionary()
+
+
+class TimeoutSession(requests.Session):
+    """A requests.Session that applies a default timeout to every request."""
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def create_session(pool_hosts=10, pool_size=16, connect_timeout=10, read_timeout=60, retries=3, backoff_factor=0.5):
+    """
+    Create a session with pooled keep-alive connections, timeouts and retries.
+
+    Args:
+        pool_hosts (int): Number of hosts with a cached connection pool
+        pool_size (int): Maximum connections kept alive per host
+        connect_timeout (float): Connect timeout in seconds
+        read_timeout (float): Read timeout in seconds
+        retries (int): Retries of idempotent requests; 0 disables retries
+        backoff_factor (float): Backoff factor between retries
+
+    Returns:
+        requests.Session: The configured session
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        # Only methods that are safe to repeat (not POST)
+        allowed_methods=frozenset(["GET", "HEAD", "PUT", "DELETE", "OPTIONS"]),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size, max_retries=retry)
+
+    session = TimeoutSession((connect_timeout, read_timeout))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _session_from_env(retries):
+    return create_session(
+        pool_hosts=int(os.environ.get("HTTP_POOL_HOSTS", 10)),
+        pool_size=int(os.environ.get("HTTP_POOL_SIZE", 16)),
+        connect_timeout=float(os.environ.get("HTTP_CONNECT_TIMEOUT", 10)),
+        read_timeout=float(os.environ.get("HTTP_READ_TIMEOUT", 60)),
+        retries=retries,
+        backoff_factor=float(os.environ.get("HTTP_BACKOFF_FACTOR", 0.5))
+    )
+
+
+def get_session():
+    """
+    Return the shared session, creating it from the environment on first use.
+
+    Returns:
+        requests.Session: The shared session
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _session_from_env(int(os.environ.get("HTTP_RETRIES", 3)))
+        return _session
+
+
+def get_upload_session():
+    """
+    Return the shared session without automatic retries, for requests the
+    caller retries itself.
+
+    Returns:
+        requests.Session: The shared upload session
+    """
+    global _upload_session
+    with _session_lock:
+        if _upload_session is None:
+            _upload_session = _session_from_env(0)
+        return _upload_session
+
+
+def get(url, **kwargs):
+    """Send a GET request through the shared session."""
+    return get_session().get(url, **kwargs)
+
+
+def head(url, **kwargs):
+    """Send a HEAD request through the shared session."""
+    return get_session().head(url, **kwargs)
+
+
+def post(url, **kwargs):
+    """Send a POST request through the shared session."""
+    return get_session().post(url, **kwargs)
+
+
+def put(url, **kwargs):
+    """Send a PUT request through the shared session."""
+    return get_session().put(url, **kwargs)
+
+
+def get_async_client():
+    """
+    Return the asyncio HTTP client of the running event loop, creating it on first use.
+
+    Returns:
+        httpx.AsyncClient: The loop's shared client
+    """
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                float(os.environ.get("HTTP_READ_TIMEOUT", 60)),
+                connect=float(os.environ.get("HTTP_CONNECT_TIMEOUT", 10))
+            ),
+            limits=httpx.Limits(
+                max_connections=int(os.environ.get("HTTP_ASYNC_MAX_CONNECTIONS", 100)),
+                max_keepalive_connections=int(os.environ.get("HTTP_POOL_SIZE", 16))
+            ),
+            transport=httpx.AsyncHTTPTransport(retries=int(os.environ.get("HTTP_RETRIES", 3))),
+            follow_redirects=True
+        )
+        _async_clients[loop] = client
+    return client
@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+"""
+Resized and re-encoded variants of the generated images.
+
+A 1024x1024 PNG is 1-2 MB, far more than a preview needs. Image URLs accept
+`?w=<width>&fmt=<format>` (e.g. `?w=256&fmt=webp`) and are answered with a
+derivative: the image scaled down to the width and encoded as WebP, AVIF,
+JPEG or PNG. Requested widths are rounded up to a fixed set of sizes so the
+number of variants per image stays bounded.
+
+Derivatives are named after the SHA-256 of the source image and cached on
+disk; the cache is bounded in bytes and evicts the least recently used
+files. Server processes share the directory: a cache hit updates the
+file's mtime, and eviction rescans the directory under a file lock, so no
+process removes a derivative another one has just used. Rendering runs in a process pool, so decoding and encoding do not
+hold the server's GIL, and the common variants of every new image are
+rendered ("pre-warmed") as soon as it is saved.
+"""
+import os
+import uuid
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from content_store import file_sha256
+from job_store import file_lock
+
+DERIVATIVE_FORMATS = {
+    "webp": ("WEBP", ".webp"),
+    "avif": ("AVIF", ".avif"),
+    "jpeg": ("JPEG", ".jpg"),
+    "jpg": ("JPEG", ".jpg"),
+    "png": ("PNG", ".png")
+}
+SOURCE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+DEFAULT_WIDTHS = (64, 128, 256, 512, 1024)
+# Eviction frees space down to this fraction of max_bytes, so the directory
+# is not rescanned for every new derivative once the cache is full
+EVICT_TARGET = 0.9
+EVICT_LOCK = ".evict.lock"
+
+_format_support = {}
+
+
+class DerivativeError(ValueError):
+    """Raised for derivative requests that cannot be served."""
+
+
+def parse_variants(spec):
+    """
+    Parse a variant list such as "256:webp,512:webp".
+
+    Args:
+        spec (str): Comma-separated width:format pairs
+
+    Returns:
+        list: (width, format) tuples
+    """
+    variants = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        width, _, image_format = item.partition(":")
+        variants.append((int(width), image_format.strip().lower() or "webp"))
+    return variants
+
+
+def format_supported(image_format):
+    """
+    Check whether Pillow can encode a format (AVIF needs Pillow 11.2+ or a plugin).
+
+    Args:
+        image_format (str): Key of DERIVATIVE_FORMATS
+
+    Returns:
+        bool: True if the format can be written
+    """
+    if image_format not in DERIVATIVE_FORMATS:
+        return False
+    if image_format in _format_support:
+        return _format_support[image_format]
+    from PIL import Image, features
+
+    if image_format == "avif":
+        try:
+            import pillow_avif  # noqa: F401 (registers the AVIF plugin)
+        except ImportError:
+            pass
+    Image.init()
+    supported = DERIVATIVE_FORMATS[image_format][0] in Image.SAVE
+    if image_format in ("webp", "avif") and features.check(image_format) is False:
+        supported = False
+    _format_support[image_format] = supported
+    return supported
+
+
+def render_derivative(source_path, target_path, width, image_format, quality=80):
+    """
+    Render one derivative of an image. Runs in a worker process.
+
+    Args:
+        source_path (str): Source image
+        target_path (str): Output file, written atomically
+        width (int): Maximum width; the image is never scaled up
+        image_format (str): Key of DERIVATIVE_FORMATS
+        quality (int): Encoder quality for lossy formats
+
+    Returns:
+        int: Size of the derivative in bytes
+    """
+    from PIL import Image
+
+    if image_format == "avif":
+        try:
+            import pillow_avif  # noqa: F401
+        except ImportError:
+            pass
+    pil_format, _ = DERIVATIVE_FORMATS[image_format]
+    with Image.open(source_path) as image:
+        height = max(1, round(image.height * width / image.width))
+        # JPEG sources can be decoded at a reduced scale directly
+        image.draft("RGB", (width, height))
+        image.thumbnail((width, height), Image.LANCZOS)
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        options = {}
+        if pil_format in ("WEBP", "AVIF", "JPEG"):
+            options["quality"] = quality
+        if pil_format == "PNG":
+            options["optimize"] = True
+
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        tmp_path = f"{target_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            image.save(tmp_path, format=pil_format, **options)
+            os.replace(tmp_path, target_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return os.path.getsize(target_path)
+
+
+def _noop():
+    return None
+
+
+class DerivativeCache:
+    """
+    On-disk LRU cache of image derivatives, rendered in a process pool.
+    """
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024, widths=DEFAULT_WIDTHS,
+                 quality=80, workers=2, render_timeout=60):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir (str): Directory holding the derivatives
+            max_bytes (int): Total size above which old derivatives are evicted
+            widths (tuple): Allowed widths; requests are rounded up to one of them
+            quality (int): Encoder quality for lossy formats
+            workers (int): Render processes; 0 renders in the calling thread
+            render_timeout (float): Seconds a request waits for a rendering
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.widths = tuple(sorted(widths))
+        self.quality = quality
+        self.workers = workers
+        self.render_timeout = render_timeout
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._pending = {}
+        self._pool = None
+        self._counters = {"hits": 0, "misses": 0, "prewarmed": 0, "evicted": 0, "errors": 0}
+
+    def start(self):
+        """
+        Index the existing derivatives and start the render processes.
+
+        The pool forks its workers here, so call this before the server
+        starts its own threads.
+
+        Returns:
+            int: Number of cached derivatives
+        """
+        for directory, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    os.remove(os.path.join(directory, filename))
+        with self._lock:
+            self._reindex(self._scan())
+        if self._bytes > self.max_bytes:
+            self._evict()
+
+        if self.workers > 0:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("fork"))
+            # Fork all workers now, while the process is still single-threaded
+            for future in [self._pool.submit(_noop) for _ in range(self.workers)]:
+                future.result()
+        return len(self._entries)
+
+    def shutdown(self):
+        """Stop the render processes."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def resolve(self, width=None, image_format=None, source_path=None):
+        """
+        Validate and normalize the parameters of a derivative request.
+
+        Args:
+            width (str|int, optional): Requested width; defaults to the largest allowed width
+            image_format (str, optional): Requested format; defaults to the source's format
+            source_path (str, optional): Source image, for the default format
+
+        Returns:
+            tuple: (width, format)
+
+        Raises:
+            DerivativeError: If the width or format is invalid
+        """
+        if width in (None, ""):
+            width = self.widths[-1]
+        try:
+            width = int(width)
+        except (TypeError, ValueError):
+            raise DerivativeError(f"Invalid width: {width}")
+        if width <= 0:
+            raise DerivativeError(f"Invalid width: {width}")
+        width = next((allowed for allowed in self.widths if allowed >= width), self.widths[-1])
+
+        if not image_format:
+            image_format = os.path.splitext(source_path or "")[1].lstrip(".").lower() or "png"
+        image_format = image_format.lower()
+        if not format_supported(image_format):
+            raise DerivativeError(f"Unsupported format: {image_format}")
+        return width, image_format
+
+    def get(self, source_path, width, image_format):
+        """
+        Return a derivative, rendering it if it is not cached.
+
+        Args:
+            source_path (str): Source image
+            width (int): Normalized width (see resolve)
+            image_format (str): Normalized format (see resolve)
+
+        Returns:
+            str: Derivative path relative to cache_dir
+        """
+        relative_path, future, owner = self._lookup(source_path, width, image_format)
+        if future is None:
+            return relative_path
+        if owner and self._pool is None:
+            self._render_inline(future, source_path, relative_path, width, image_format)
+        future.result(timeout=self.render_timeout)
+        return relative_path
+
+    def prewarm(self, source_path, variants):
+        """
+        Render derivatives of a new image in the background.
+
+        Args:
+            source_path (str): Source image
+            variants (list): (width, format) tuples
+        """
+        for width, image_format in variants:
+            try:
+                width, image_format = self.resolve(width, image_format)
+                relative_path, future, owner = self._lookup(source_path, width, image_format, count=False)
+            except Exception as e:
+                print(f"Error pre-warming {width}px {image_format} derivative: {str(e)}")
+                continue
+            if owner:
+                with self._lock:
+                    self._counters["prewarmed"] += 1
+                if self._pool is None:
+                    self._render_inline(future, source_path, relative_path, width, image_format)
+
+    def stats(self):
+        """Return the cache size and hit/miss counters."""
+        with self._lock:
+            stats = {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "rendering": len(self._pending)
+            }
+            stats.update(self._counters)
+            return stats
+
+    def derivative_name(self, source_path, width, image_format):
+        """Return the cache path (relative to cache_dir) of a derivative."""
+        digest = file_sha256(source_path)
+        extension = DERIVATIVE_FORMATS[image_format][1]
+        return os.path.join(digest[:2], f"{digest}_w{width}{extension}")
+
+    def _lookup(self, source_path, width, image_format, count=True):
+        # Returns (relative_path, future, owner): future is None on a cache hit,
+        # owner is True if the caller started the rendering
+        relative_path = self.derivative_name(source_path, width, image_format)
+        path = os.path.join(self.cache_dir, relative_path)
+        with self._lock:
+            if relative_path in self._entries:
+                if self._touch(path):
+                    self._entries.move_to_end(relative_path)
+                    if count:
+                        self._counters["hits"] += 1
+                    return relative_path, None, False
+                # Evicted by another server process; render it again
+                self._bytes -= self._entries.pop(relative_path)
+            elif relative_path not in self._pending:
+                if self._touch(path):
+                    # Rendered by another server process
+                    size = os.path.getsize(path)
+                    self._entries[relative_path] = size
+                    self._bytes += size
+                    if count:
+                        self._counters["hits"] += 1
+                    return relative_path, None, False
+            if count:
+                self._counters["misses"] += 1
+            future = self._pending.get(relative_path)
+            if future is not None:
+                return relative_path, future, False
+
+            if self._pool is not None:
+                future = self._pool.submit(
+                    render_derivative, source_path, path,
+                    width, image_format, self.quality
+                )
+            else:
+                future = Future()
+            self._pending[relative_path] = future
+        future.add_done_callback(lambda done: self._finished(relative_path, done))
+        return relative_path, future, True
+
+    def _render_inline(self, future, source_path, relative_path, width, image_format):
+        try:
+            future.set_result(render_derivative(
+                source_path, os.path.join(self.cache_dir, relative_path), width, image_format, self.quality
+            ))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _finished(self, relative_path, future):
+        with self._lock:
+            self._pending.pop(relative_path, None)
+            if future.cancelled() or future.exception() is not None:
+                self._counters["errors"] += 1
+                error = "cancelled" if future.cancelled() else str(future.exception())
+                print(f"Error rendering derivative {relative_path}: {error}")
+                return
+            self._bytes += future.result() - self._entries.pop(relative_path, 0)
+            self._entries[relative_path] = future.result()
+            full = self._bytes > self.max_bytes
+        if full:
+            self._evict()
+
+    def _touch(self, path):
+        # Marks a derivative as used, for the eviction of every server
+        # process; False if the file is gone
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _scan(self):
+        # (mtime, relative_path, size) of every derivative, least recently used first
+        files = []
+        for directory, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.endswith(".tmp") or filename == EVICT_LOCK:
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, os.path.relpath(path, self.cache_dir), stat.st_size))
+        return sorted(files)
+
+    def _reindex(self, files):
+        # Called with the lock held
+        self._entries = OrderedDict((relative_path, size) for _, relative_path, size in files)
+        self._bytes = sum(self._entries.values())
+
+    def _evict(self):
+        # The index of this process misses what the others rendered and used,
+        # so the directory is rescanned while holding the lock shared by all
+        # processes; the most recently used derivative is always kept
+        with file_lock(os.path.join(self.cache_dir, EVICT_LOCK)):
+            files = self._scan()
+            total = sum(size for _, _, size in files)
+            evicted = 0
+            while total > self.max_bytes * EVICT_TARGET and len(files) > 1:
+                _, relative_path, size = files.pop(0)
+                try:
+                    os.remove(os.path.join(self.cache_dir, relative_path))
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+            with self._lock:
+                self._reindex(files)
+                self._counters["evicted"] += evicted
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""
+Streaming ingestion of generated images.
+
+Images returned by the image model are written straight to disk in chunks:
+URL responses are streamed from the HTTP connection and base64 payloads are
+decoded a slice at a time, so neither the whole download nor the whole
+decoded image is held in memory. Only the file signature is checked to make
+sure the bytes are an image of the expected format; the image is decoded
+(with Pillow) only when it actually has to be transformed, e.g. converted to
+the format its file name promises.
+
+`ImageWriter` does the writing for both the blocking path and the asyncio
+pipeline (`download_image_async`).
+"""
+import os
+import base64
+import asyncio
+import binascii
+import tempfile
+import http_client
+from content_store import HashingWriter, record_digest
+
+INGEST_CHUNK_SIZE = 256 * 1024
+
+# Leading bytes identifying the supported image formats
+IMAGE_SIGNATURES = (
+    ("png", b"\x89PNG\r\n\x1a\n"),
+    ("jpeg", b"\xff\xd8\xff"),
+    ("gif", b"GIF87a"),
+    ("gif", b"GIF89a"),
+)
+EXTENSION_FORMATS = {".png": "png", ".jpg": "jpeg", ".jpeg": "jpeg", ".webp": "webp", ".gif": "gif"}
+
+
+class ImageFormatError(ValueError):
+    """Raised when ingested bytes are not an image of a supported format."""
+
+
+def detect_image_format(header):
+    """
+    Identify an image format from the first bytes of a file.
+
+    Args:
+        header (bytes): At least the first 12 bytes
+
+    Returns:
+        str: "png", "jpeg", "gif" or "webp", or None if not recognized
+    """
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    for image_format, signature in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    return None
+
+
+class ImageWriter:
+    """
+    Writes image data to a file chunk by chunk, validating its signature.
+
+    The data goes to a temporary file that replaces the target only in
+    finish(), so a partial image is never visible; abort() discards it. The
+    content is hashed while it is written.
+    """
+
+    def __init__(self, image_path):
+        """
+        Create the temporary file.
+
+        Args:
+            image_path (str): Target file
+        """
+        self.image_path = image_path
+        directory = os.path.dirname(image_path) or "."
+        fd, self.tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.splitext(image_path)[1])
+        os.close(fd)
+        self.image_format = None
+        self._header = b""
+        self._writer = HashingWriter(self.tmp_path)
+
+    def write(self, chunk):
+        """
+        Append a chunk of image data.
+
+        Raises:
+            ImageFormatError: If the data does not start like a recognized image
+        """
+        if not chunk:
+            return
+        if self.image_format is None:
+            self._header += chunk[:12]
+            if len(self._header) >= 12:
+                self.image_format = detect_image_format(self._header)
+                if self.image_format is None:
+                    raise ImageFormatError("Response is not a PNG, JPEG, GIF or WebP image")
+        self._writer.write(chunk)
+
+    def finish(self):
+        """
+        Move the complete image into place, converting it if necessary.
+
+        Returns:
+            str: The detected image format
+
+        Raises:
+            ImageFormatError: If the data is empty or truncated
+        """
+        self._writer.close()
+        if self.image_format is None:
+            self.image_format = detect_image_format(self._header)
+            if self.image_format is None:
+                raise ImageFormatError("Image data is empty or truncated")
+        converted = ensure_format(self.tmp_path, EXTENSION_FORMATS.get(os.path.splitext(self.image_path)[1].lower()), self.image_format)
+        os.replace(self.tmp_path, self.image_path)
+        if not converted:
+            record_digest(self.image_path, self._writer.hexdigest())
+        return self.image_format
+
+    def abort(self):
+        """Discard the partially written image."""
+        self._writer.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def write_image_chunks(chunks, image_path):
+    """
+    Write image data to a file chunk by chunk, validating its signature.
+
+    Args:
+        chunks (iterable): Byte strings
+        image_path (str): Target file
+
+    Returns:
+        str: The detected image format
+
+    Raises:
+        ImageFormatError: If the data is not a recognized image
+    """
+    writer = ImageWriter(image_path)
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+        return writer.finish()
+    except Exception:
+        writer.abort()
+        raise
+
+
+def ensure_format(path, expected_format, actual_format):
+    """
+    Convert an image in place if it is not in the expected format.
+
+    This is the only case in which the image is decoded.
+
+    Args:
+        path (str): Image file
+        expected_format (str): Format the file should have, or None for any
+        actual_format (str): Format detected from the signature
+
+    Returns:
+        bool: True if the image was converted
+    """
+    if expected_format is None or expected_format == actual_format:
+        return False
+
+    from PIL import Image
+
+    print(f"Converting {actual_format} image to {expected_format}...")
+    with Image.open(path) as image:
+        image.load()
+        image.save(path, format=expected_format.upper())
+    return True
+
+
+def download_image(url, image_path, chunk_size=INGEST_CHUNK_SIZE):
+    """
+    Stream an image from a URL straight to disk.
+
+    Args:
+        url (str): Image URL
+        image_path (str): Target file
+        chunk_size (int): Bytes read from the connection at a time
+
+    Returns:
+        str: The detected image format
+    """
+    with http_client.get(url, stream=True) as response:
+        response.raise_for_status()
+        return write_image_chunks(response.iter_content(chunk_size), image_path)
+
+
+async def download_image_async(url, image_path, chunk_size=INGEST_CHUNK_SIZE):
+    """
+    Stream an image from a URL straight to disk without blocking the event loop.
+
+    Chunks are written as they arrive; creating the file, writing the
+    chunks and moving (or converting) the finished image run in worker
+    threads.
+
+    Args:
+        url (str): Image URL
+        image_path (str): Target file
+        chunk_size (int): Bytes read from the connection at a time
+
+    Returns:
+        str: The detected image format
+    """
+    writer = await asyncio.to_thread(ImageWriter, image_path)
+    try:
+        async with http_client.get_async_client().stream("GET", url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(chunk_size):
+                await asyncio.to_thread(writer.write, chunk)
+        return await asyncio.to_thread(writer.finish)
+    except BaseException:
+        # Also on cancellation, so no temporary file is left behind
+        writer.abort()
+        raise
+
+
+def iter_base64_chunks(data, chunk_size=INGEST_CHUNK_SIZE):
+    """
+    Decode a base64 string incrementally.
+
+    Args:
+        data (str): Base64-encoded data without line breaks
+        chunk_size (int): Approximate number of decoded bytes per chunk
+
+    Yields:
+        bytes: Decoded chunks
+
+    Raises:
+        ImageFormatError: If the data is not valid base64
+    """
+    # A multiple of 4 characters always decodes to whole bytes
+    step = (chunk_size // 3) * 4
+    for start in range(0, len(data), step):
+        try:
+            yield base64.b64decode(data[start:start + step], validate=True)
+        except binascii.Error as e:
+            raise ImageFormatError(f"Invalid base64 image data: {str(e)}")
+
+
+def decode_base64_image(data, image_path, chunk_size=INGEST_CHUNK_SIZE):
+    """
+    Decode a base64 image straight to disk.
+
+    Args:
+        data (str): Base64-encoded image
+        image_path (str): Target file
+        chunk_size (int): Approximate number of decoded bytes per chunk
+
+    Returns:
+        str: The detected image format
+    """
+    return write_image_chunks(iter_base64_chunks(data, chunk_size), image_path)
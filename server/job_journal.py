@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+A durable journal of the jobs in the generation pipeline.
+
+Every admitted job gets a row in a SQLite table that is updated whenever the
+job completes a stage and deleted once the job has left the pipeline
+(completed, failed, dropped or cancelled). The row holds the pipeline state
+of the job (paths, intermediate results) and the server process running it.
+
+After a crash or restart, the rows of processes that are no longer running
+are the unfinished jobs: a starting server claims them and resumes each one
+after its last completed stage, instead of leaving it in "processing"
+forever.
+"""
+import os
+import json
+import time
+import uuid
+from job_store import SqliteDatabase
+
+# Stage recorded for a job that was admitted but has not completed a stage yet
+SUBMITTED = "submitted"
+
+
+def process_alive(pid):
+    """
+    Return True if a process with the given ID is running on this host.
+
+    Args:
+        pid (int): Process ID
+
+    Returns:
+        bool: Whether the process exists
+    """
+    if os.name == "nt":
+        # os.kill would terminate the process; there is only one server process on Windows
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobJournal:
+    """
+    Stage transitions of unfinished jobs, shared by all server processes.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS journal ("
+        "job_id TEXT PRIMARY KEY, job TEXT NOT NULL, stage TEXT NOT NULL, "
+        "owner TEXT NOT NULL, owner_pid INTEGER NOT NULL, updated_at REAL NOT NULL)",
+    )
+
+    def __init__(self, db_path):
+        """
+        Open the journal.
+
+        Args:
+            db_path (str): SQLite database file
+        """
+        self.db = SqliteDatabase(db_path, self.SCHEMA)
+        # Unique per process, since process IDs are reused after a restart
+        self.owner = uuid.uuid4().hex
+        self.pid = os.getpid()
+        self._resumed = 0
+
+    def record(self, job, stage=None):
+        """
+        Record that a job was admitted or completed a stage.
+
+        Args:
+            job (dict): Pipeline state of the job (JSON-serializable)
+            stage (str, optional): Name of the completed stage; None when the
+                                   job was just admitted
+        """
+        with self.db.transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO journal (job_id, job, stage, owner, owner_pid, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job["id"], json.dumps(job), stage or SUBMITTED, self.owner, self.pid, time.time())
+            )
+
+    def finish(self, job_id):
+        """Remove a job that has left the pipeline."""
+        with self.db.transaction() as connection:
+            connection.execute("DELETE FROM journal WHERE job_id = ?", (job_id,))
+
+    def claim_orphans(self):
+        """
+        Take over the unfinished jobs of server processes that are no longer running.
+
+        Returns:
+            list: (job, stage) pairs; stage is the last completed stage, or
+                  None if the job had not completed any
+        """
+        claimed = []
+        with self.db.transaction() as connection:
+            rows = connection.execute("SELECT job_id, job, stage, owner, owner_pid FROM journal ORDER BY updated_at").fetchall()
+            for job_id, job, stage, owner, owner_pid in rows:
+                # A live process with our PID is this process; with another
+                # owner token the row was left by an earlier process
+                if owner == self.owner or (owner_pid != self.pid and process_alive(owner_pid)):
+                    continue
+                connection.execute(
+                    "UPDATE journal SET owner = ?, owner_pid = ?, updated_at = ? WHERE job_id = ?",
+                    (self.owner, self.pid, time.time(), job_id)
+                )
+                claimed.append((json.loads(job), None if stage == SUBMITTED else stage))
+        self._resumed += len(claimed)
+        return claimed
+
+    def stats(self):
+        """Return the number of unfinished jobs (of all processes) and of jobs resumed by this one."""
+        unfinished = self.db.connection().execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+        return {"unfinished": unfinished, "resumed": self._resumed}
@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+"""
+A pipelined job scheduler for the generation pipeline.
+
+A job passes through a sequence of stages (image generation, 3D
+reconstruction, upload, finalize). Every stage has its own queue and its own
+pool of worker threads, so while one job is being reconstructed by Invisible
+Stitch the next one can already be generating its image.
+
+Admission is controlled at the first stage: when its queue is full new
+submissions are rejected instead of being started immediately, so the server
+can answer with 429/503 and a Retry-After header rather than overloading the
+OpenAI and Gradio backends. The number of workers per stage is the
+concurrency limit for that stage, which lets throughput be sized to the
+upstream quotas.
+
+A stage function can also hand a job off to an external system and return
+DEFERRED; the job then stays in flight in that stage until resume() is
+called, which frees the worker for other jobs in the meantime. resume() is
+called from the external system's thread and never blocks it: when the next
+stage's queue is full, the job is parked in an overflow list that the next
+stage's workers move into the queue as slots become free.
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+# Returned by a stage function whose job completes later through resume()
+DEFERRED = object()
+
+
+class QueueFullError(Exception):
+    """Raised when a job cannot be admitted because the queue is full."""
+
+    def __init__(self, message, retry_after=30):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SchedulerShutdownError(Exception):
+    """Raised when a job is submitted to a scheduler that is shutting down."""
+
+    def __init__(self, message, retry_after=30):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Stage:
+    """
+    A single pipeline stage with its own queue, workers and statistics.
+
+    The stage function receives the job and returns it to pass it on to the
+    next stage, or returns None to end the job's trip through the pipeline.
+    """
+
+    def __init__(self, name, func, num_workers=1, max_queue_size=16, latency_window=100):
+        """
+        Initialize a stage.
+
+        Args:
+            name (str): Stage name, e.g. 'image' or 'ply'
+            func (callable): Function called with the job
+            num_workers (int): Number of worker threads (the concurrency limit)
+            max_queue_size (int): Maximum number of jobs waiting for this stage
+            latency_window (int): Number of recent latencies kept for percentiles
+        """
+        self.name = name
+        self.func = func
+        self.num_workers = num_workers
+        self.max_queue_size = max_queue_size
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._processed = 0
+        self._failed = 0
+        self._total_latency = 0.0
+        self._total_wait = 0.0
+        self._latencies = deque(maxlen=latency_window)
+
+    def begin(self):
+        """Mark a job as being processed by this stage."""
+        with self._lock:
+            self._active += 1
+
+    def record(self, wait, latency, failed=False):
+        """Record the queue wait and run time of a job that left this stage."""
+        with self._lock:
+            self._active -= 1
+            self._processed += 1
+            if failed:
+                self._failed += 1
+            self._total_wait += wait
+            self._total_latency += latency
+            self._latencies.append(latency)
+
+    def stats(self):
+        """
+        Return a snapshot of the stage statistics.
+
+        Returns:
+            dict: Queue depth, active workers, counters and latencies in seconds
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            processed = self._processed
+            return {
+                "workers": self.num_workers,
+                "queue_depth": self.queue.qsize(),
+                "max_queue_size": self.max_queue_size,
+                "active": self._active,
+                "processed": processed,
+                "failed": self._failed,
+                "avg_wait": round(self._total_wait / processed, 3) if processed else None,
+                "avg_latency": round(self._total_latency / processed, 3) if processed else None,
+                "p50_latency": _percentile(latencies, 50),
+                "p95_latency": _percentile(latencies, 95),
+                "max_latency": round(latencies[-1], 3) if latencies else None
+            }
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 3)
+
+
+class JobScheduler:
+    """
+    Runs jobs through a sequence of stages, each with its own worker pool.
+    """
+
+    def __init__(self, stages, on_error=None, retry_after=30):
+        """
+        Initialize the scheduler and start the worker threads of all stages.
+
+        Args:
+            stages (list): Ordered list of Stage instances
+            on_error (callable, optional): Called as on_error(job, stage_name, exception)
+                                           when a stage function raises
+            retry_after (int): Seconds clients are told to wait when rejected
+        """
+        self.stages = list(stages)
+        self.on_error = on_error
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._completed = 0
+        self._dropped = 0
+        self._failed = 0
+        self._rejected = 0
+        self._accepting = True
+        self._deferred = {}
+        self._early_resumes = {}
+        # Jobs resumed while the next stage's queue was full, per stage
+        self._overflow = [deque() for _ in self.stages]
+        self._overflow_lock = threading.Lock()
+        self._workers = []
+
+        for index, stage in enumerate(self.stages):
+            for i in range(stage.num_workers):
+                worker = threading.Thread(
+                    target=self._worker_loop,
+                    args=(index,),
+                    name=f"{stage.name}-worker-{i}",
+                    daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, job):
+        """
+        Admit a job into the first stage of the pipeline.
+
+        Args:
+            job (dict): Job state passed from stage to stage
+
+        Raises:
+            SchedulerShutdownError: If the scheduler is draining
+            QueueFullError: If the first stage has no free queue slot
+        """
+        if not self._accepting:
+            raise SchedulerShutdownError("Server is shutting down", retry_after=self.retry_after)
+
+        first = self.stages[0]
+        with self._lock:
+            self._in_flight += 1
+        try:
+            first.queue.put_nowait((job, time.monotonic()))
+        except queue.Full:
+            with self._lock:
+                self._in_flight -= 1
+                self._rejected += 1
+            raise QueueFullError(
+                f"Job queue is full ({first.max_queue_size} jobs waiting)",
+                retry_after=self.retry_after
+            )
+
+    def restore(self, job, stage_name):
+        """
+        Re-admit a job recovered after a restart, starting at the given stage.
+
+        The job was admitted once already, so instead of being rejected it
+        waits for a free slot in the stage's queue.
+
+        Args:
+            job (dict): Job state passed from stage to stage
+            stage_name (str): Name of the stage to continue with
+        """
+        index = [stage.name for stage in self.stages].index(stage_name)
+        with self._lock:
+            self._in_flight += 1
+        self.stages[index].queue.put((job, time.monotonic()))
+
+    def stats(self):
+        """
+        Return a snapshot of the scheduler and per-stage state.
+
+        Returns:
+            dict: Pipeline counters and statistics for every stage
+        """
+        with self._lock:
+            snapshot = {
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "dropped": self._dropped,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "deferred": len(self._deferred),
+                "overflow": sum(len(overflow) for overflow in self._overflow),
+                "accepting": self._accepting
+            }
+        snapshot["stages"] = {stage.name: stage.stats() for stage in self.stages}
+        return snapshot
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stop accepting jobs and drain the pipeline.
+
+        Jobs already admitted still run through all stages; the call returns
+        once the pipeline is empty or the timeout has elapsed.
+
+        Args:
+            wait (bool): Whether to wait for the admitted jobs to finish
+            timeout (float, optional): Maximum number of seconds to wait
+
+        Returns:
+            bool: True if all jobs were drained
+        """
+        self._accepting = False
+        if not wait:
+            return False
+
+        with self._idle:
+            drained = self._idle.wait_for(lambda: self._in_flight == 0, timeout)
+        for stage in self.stages:
+            for _ in range(stage.num_workers):
+                # The sentinel may have to wait for a queue slot if jobs were left behind
+                threading.Thread(target=stage.queue.put, args=(None,), daemon=True).start()
+        return drained
+
+    def _worker_loop(self, index):
+        stage = self.stages[index]
+
+        while True:
+            item = stage.queue.get()
+            self._refill(index)
+            if item is None:
+                return
+
+            job, enqueued_at = item
+            started_at = time.monotonic()
+            stage.begin()
+            failed = False
+            result = None
+            try:
+                result = stage.func(job)
+            except Exception as e:
+                failed = True
+                self._handle_error(job, stage, e)
+
+            if result is DEFERRED:
+                # Still active in this stage until resume() is called
+                with self._lock:
+                    self._deferred[id(job)] = (job, index, enqueued_at, started_at)
+                    early = self._early_resumes.pop(id(job), None)
+                if early is not None:
+                    self.resume(job, *early)
+                continue
+
+            stage.record(started_at - enqueued_at, time.monotonic() - started_at, failed)
+            self._forward(index, result, failed)
+
+    def resume(self, job, result=None, error=None):
+        """
+        Complete a job whose stage function returned DEFERRED.
+
+        Args:
+            job (dict): The job object that was passed to the stage function
+            result (dict, optional): Job to pass on to the next stage; None drops it
+            error (Exception, optional): Failure of the deferred work, reported to on_error
+        """
+        with self._lock:
+            deferred = self._deferred.pop(id(job), None)
+            if deferred is None:
+                # The external work finished before the stage function returned
+                self._early_resumes[id(job)] = (result, error)
+                return
+            _, index, enqueued_at, started_at = deferred
+
+        stage = self.stages[index]
+        failed = error is not None
+        if failed:
+            self._handle_error(job, stage, error)
+            result = None
+        stage.record(started_at - enqueued_at, time.monotonic() - started_at, failed)
+        self._forward(index, result, failed, block=False)
+
+    def _refill(self, index):
+        # A slot of the stage's queue was just freed; move a parked job into it
+        with self._overflow_lock:
+            overflow = self._overflow[index]
+            if overflow:
+                try:
+                    self.stages[index].queue.put_nowait(overflow[0])
+                    overflow.popleft()
+                except queue.Full:
+                    pass
+
+    def _handle_error(self, job, stage, error):
+        print(f"Error in {stage.name} stage: {str(error)}")
+        if self.on_error:
+            try:
+                self.on_error(job, stage.name, error)
+            except Exception as handler_error:
+                print(f"Error in {stage.name} error handler: {str(handler_error)}")
+
+    def _forward(self, index, result, failed, block=True):
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        if result is not None and next_stage is not None:
+            item = (result, time.monotonic())
+            if block:
+                # Blocks when the next stage is saturated, which applies backpressure
+                next_stage.queue.put(item)
+                return
+            with self._overflow_lock:
+                try:
+                    next_stage.queue.put_nowait(item)
+                except queue.Full:
+                    self._overflow[index + 1].append(item)
+            return
+
+        with self._idle:
+            self._in_flight -= 1
+            if failed:
+                self._failed += 1
+            elif result is None and next_stage is not None:
+                self._dropped += 1
+            else:
+                self._completed += 1
+            self._idle.notify_all()
+
+
+def create_scheduler_from_env(stage_funcs, on_error=None):
+    """
+    Create a JobScheduler configured from environment variables.
+
+    Environment variables:
+        JOB_QUEUE_SIZE: Maximum number of jobs waiting for admission (default 16)
+        STAGE_QUEUE_SIZE: Maximum number of jobs waiting between stages (default 16)
+        <STAGE>_CONCURRENCY: Worker threads per stage, e.g. IMAGE_CONCURRENCY
+                             (defaults: image 2, ply 1, others 2)
+        JOB_RETRY_AFTER: Retry-After seconds for rejected jobs (default 30)
+
+    Args:
+        stage_funcs (list): Ordered (name, func) pairs
+        on_error (callable, optional): Error handler passed to the scheduler
+
+    Returns:
+        JobScheduler: A started scheduler
+    """
+    default_workers = {"image": 2, "ply": 1}
+    stages = []
+    for index, (name, func) in enumerate(stage_funcs):
+        env_name = "JOB_QUEUE_SIZE" if index == 0 else "STAGE_QUEUE_SIZE"
+        stages.append(Stage(
+            name,
+            func,
+            num_workers=int(os.environ.get(f"{name.upper()}_CONCURRENCY", default_workers.get(name, 2))),
+            max_queue_size=int(os.environ.get(env_name, 16))
+        ))
+
+    return JobScheduler(
+        stages,
+        on_error=on_error,
+        retry_after=int(os.environ.get("JOB_RETRY_AFTER", 30))
+    )
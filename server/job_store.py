@@ -0,0 +1,582 @@
+#!/usr/bin/env python
+"""
+An in-memory job state store with write-behind persistence.
+
+The authoritative metadata of every unfinished job lives in memory, so
+status updates and metadata requests never touch the disk. Changed jobs are
+written back to their sharded `metadata_<id>.json` file by a background
+thread; each write goes to a temporary file that is atomically renamed over
+the old one, so a reader never sees a half-written file. Finished jobs are
+evicted from memory once written (beyond a small LRU of recent ones) and are
+read back from their file when they are requested again, so memory use and
+startup time do not grow with the number of jobs ever run.
+
+Every change bumps the job's version number, and readers can block until a
+job moves past a version they have already seen (used for push updates).
+The version is written into the metadata file with the job (as `_version`,
+which readers never see), so it keeps counting after an evicted job is read
+back, and a job with a waiting reader is not evicted.
+
+When the server runs as several worker processes, SqliteJobStore keeps the
+jobs in a SQLite database shared by all of them instead, so a status request
+answered by one worker sees the jobs accepted by every other worker.
+"""
+import os
+import re
+import copy
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from storage_layout import sharded_path
+
+METADATA_FILENAME_PATTERN = re.compile(r"^metadata_(?P<id>.+)\.json$")
+# Job IDs that can be mapped to a metadata file (ULIDs and legacy timestamps)
+JOB_ID_PATTERN = re.compile(r"^[0-9A-Za-z_]+$")
+# Status of a job in the pipeline; all other jobs (including those written
+# before jobs had a status) are finished and can be evicted from memory
+ACTIVE_STATUS = "processing"
+# Key of the job's version in its metadata file
+VERSION_FIELD = "_version"
+
+
+def metadata_filename(job_id):
+    """Return the metadata file name for a job ID."""
+    return f"metadata_{job_id}.json"
+
+
+def job_id_from_filename(filename):
+    """
+    Extract the job ID from a metadata file name.
+
+    Returns:
+        str: The job ID, or None if the name is not a metadata file name
+    """
+    match = METADATA_FILENAME_PATTERN.match(os.path.basename(filename))
+    return match.group("id") if match else None
+
+
+def write_json_atomic(path, data):
+    """
+    Write JSON to a file atomically via a temporary file and os.replace.
+
+    Args:
+        path (str): Target file path
+        data (dict): JSON-serializable data
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive lock on a lock file, shared by all processes.
+
+    Without fcntl (on Windows) there is only one server process, and the
+    lock does nothing.
+
+    Args:
+        path (str): Lock file, created if missing
+    """
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+    if fcntl is None:
+        yield
+        return
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SqliteDatabase:
+    """
+    Per-thread connections to a SQLite database shared by several processes.
+
+    The database runs in WAL mode, so readers never block the writer.
+    """
+
+    def __init__(self, path, schema=()):
+        """
+        Open the database and create its tables.
+
+        Args:
+            path (str): Database file
+            schema (iterable): CREATE statements, run once
+        """
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.transaction() as connection:
+            for statement in schema:
+                connection.execute(statement)
+
+    def connection(self):
+        """Return the calling thread's connection (autocommit mode)."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run statements in a write transaction.
+
+        The write lock is taken at the start (BEGIN IMMEDIATE), so a
+        read-modify-write cannot interleave with another process.
+
+        Yields:
+            sqlite3.Connection: The calling thread's connection
+        """
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+
+class JobStore:
+    """
+    Thread-safe store of job metadata, persisted with write-behind.
+    """
+
+    def __init__(self, metadata_dir="metadata", flush_interval=0.5, max_finished_jobs=1000):
+        """
+        Initialize the store and start the write-behind thread.
+
+        Args:
+            metadata_dir (str): Directory holding the metadata JSON files
+            flush_interval (float): Seconds between write-behind flushes
+            max_finished_jobs (int): Finished jobs kept in memory after they
+                                     were written (least recently used first out)
+        """
+        self.metadata_dir = metadata_dir
+        self.flush_interval = flush_interval
+        self.max_finished_jobs = max_finished_jobs
+        os.makedirs(metadata_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._jobs = {}
+        self._versions = {}
+        self._waiters = {}
+        self._finished = OrderedDict()
+        self._dirty = set()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="job-store-flusher", daemon=True)
+        self._flusher.start()
+
+    def read_file(self, job_id):
+        """
+        Read a job's metadata from its file.
+
+        Returns:
+            dict: The metadata, or None if the job has no (readable) file
+        """
+        return self.read_file_with_version(job_id)[0]
+
+    def read_file_with_version(self, job_id):
+        """
+        Read a job's metadata and version from its file.
+
+        Returns:
+            tuple: (metadata, version), or (None, 0) if the job has no
+                   (readable) file; files written without a version count as 1
+        """
+        if not JOB_ID_PATTERN.match(job_id or ""):
+            return None, 0
+        try:
+            with open(self.path_for(job_id), "r") as f:
+                metadata = json.load(f)
+        except FileNotFoundError:
+            return None, 0
+        except Exception as e:
+            print(f"Error loading metadata for {job_id}: {str(e)}")
+            return None, 0
+        return metadata, metadata.pop(VERSION_FIELD, 1)
+
+    def write_file(self, job_id, metadata, version):
+        """Write a job's metadata and version to its file."""
+        write_json_atomic(self.path_for(job_id), dict(metadata, **{VERSION_FIELD: version}))
+
+    def _ensure_loaded(self, job_id):
+        # Bring an evicted (or never loaded) job back from its file
+        with self._lock:
+            if job_id in self._jobs:
+                self._track(job_id)
+                return
+        metadata, version = self.read_file_with_version(job_id)
+        if metadata is None:
+            return
+        with self._lock:
+            if job_id not in self._jobs:
+                self._jobs[job_id] = metadata
+                self._versions[job_id] = version
+                self._track(job_id)
+
+    def _track(self, job_id):
+        # Keep the finished jobs in least recently used order; call with the lock held
+        if self._jobs[job_id].get("status") != ACTIVE_STATUS:
+            self._finished[job_id] = None
+            self._finished.move_to_end(job_id)
+        else:
+            self._finished.pop(job_id, None)
+
+    def _evict(self):
+        # Drop the least recently used finished jobs that are on disk and
+        # that nobody waits on
+        with self._lock:
+            overflow = len(self._finished) - self.max_finished_jobs
+            for job_id in list(self._finished)[:max(overflow, 0)]:
+                if job_id in self._dirty or job_id in self._waiters:
+                    continue
+                del self._finished[job_id]
+                del self._jobs[job_id]
+                del self._versions[job_id]
+
+    def path_for(self, job_id):
+        """Return the (sharded) metadata file path for a job."""
+        return sharded_path(self.metadata_dir, metadata_filename(job_id))
+
+    def create(self, job_id, metadata):
+        """
+        Add a new job (or replace an existing one).
+
+        Args:
+            job_id (str): Job ID
+            metadata (dict): Initial metadata
+
+        Returns:
+            int: The new version of the job
+        """
+        self._ensure_loaded(job_id)
+        with self._lock:
+            self._jobs[job_id] = copy.deepcopy(metadata)
+            version = self._versions.get(job_id, 0) + 1
+            self._versions[job_id] = version
+            self._track(job_id)
+            self._dirty.add(job_id)
+            self._changed.notify_all()
+        self._wakeup.set()
+        return version
+
+    def update(self, job_id, updates):
+        """
+        Merge fields into a job's metadata.
+
+        Args:
+            job_id (str): Job ID
+            updates (dict): Fields to set
+
+        Returns:
+            int: The new version of the job
+
+        Raises:
+            KeyError: If the job is unknown
+        """
+        self._ensure_loaded(job_id)
+        with self._lock:
+            if job_id not in self._jobs:
+                raise KeyError(f"Unknown job: {job_id}")
+            self._jobs[job_id].update(copy.deepcopy(updates))
+            version = self._versions[job_id] + 1
+            self._versions[job_id] = version
+            self._track(job_id)
+            self._dirty.add(job_id)
+            self._changed.notify_all()
+        self._wakeup.set()
+        return version
+
+    def get(self, job_id):
+        """
+        Return a copy of a job's metadata.
+
+        Returns:
+            dict: The metadata, or None if the job is unknown
+        """
+        self._ensure_loaded(job_id)
+        with self._lock:
+            metadata = self._jobs.get(job_id)
+            return copy.deepcopy(metadata) if metadata is not None else None
+
+    def get_with_version(self, job_id):
+        """
+        Return a copy of a job's metadata together with its version.
+
+        Returns:
+            tuple: (metadata, version), or (None, 0) if the job is unknown
+        """
+        self._ensure_loaded(job_id)
+        with self._lock:
+            metadata = self._jobs.get(job_id)
+            if metadata is None:
+                return None, 0
+            return copy.deepcopy(metadata), self._versions[job_id]
+
+    def wait_for_change(self, job_id, version, timeout=None):
+        """
+        Block until a job's version is newer than the given one.
+
+        Args:
+            job_id (str): Job ID
+            version (int): Last version seen by the caller
+            timeout (float, optional): Maximum number of seconds to wait
+
+        Returns:
+            tuple: (metadata, version); the version equals the given one on timeout,
+                   and metadata is None if the job is unknown
+        """
+        # Pinned while waiting, so eviction cannot end the wait early
+        with self._lock:
+            self._waiters[job_id] = self._waiters.get(job_id, 0) + 1
+        try:
+            # Evicted between the caller's last read and now
+            self._ensure_loaded(job_id)
+            with self._changed:
+                self._changed.wait_for(
+                    lambda: job_id not in self._jobs or self._versions[job_id] > version,
+                    timeout
+                )
+                metadata = self._jobs.get(job_id)
+                if metadata is None:
+                    return None, 0
+                return copy.deepcopy(metadata), self._versions[job_id]
+        finally:
+            with self._lock:
+                self._waiters[job_id] -= 1
+                if not self._waiters[job_id]:
+                    del self._waiters[job_id]
+
+    def flush(self):
+        """Write all changed jobs to disk."""
+        with self._flush_lock:
+            with self._lock:
+                dirty = self._dirty
+                self._dirty = set()
+                snapshots = {job_id: (copy.deepcopy(self._jobs[job_id]), self._versions[job_id]) for job_id in dirty}
+
+            for job_id, (metadata, version) in snapshots.items():
+                try:
+                    self.write_file(job_id, metadata, version)
+                except Exception as e:
+                    print(f"Error persisting metadata for {job_id}: {str(e)}")
+                    with self._lock:
+                        self._dirty.add(job_id)
+        self._evict()
+
+    def close(self):
+        """Stop the write-behind thread and flush outstanding changes."""
+        self._closed = True
+        self._wakeup.set()
+        self._flusher.join(timeout=5)
+        self.flush()
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if self._closed:
+                return
+            self.flush()
+            # Coalesce the updates of the next interval into one write per job
+            time.sleep(self.flush_interval)
+
+
+class SqliteJobStore(JobStore):
+    """
+    Job store shared by several server processes through a SQLite database.
+
+    The database holds the authoritative metadata and version of every job;
+    nothing is cached per process. Metadata files are still written behind
+    by the process that changed a job. Changes made by other processes are
+    noticed by polling the job's version.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "id TEXT PRIMARY KEY, version INTEGER NOT NULL, metadata TEXT NOT NULL, updated_at REAL NOT NULL)",
+    )
+
+    def __init__(self, metadata_dir="metadata", db_path="cache/jobs.sqlite3", flush_interval=0.5, poll_interval=0.25):
+        """
+        Open the database and start the write-behind thread.
+
+        Args:
+            metadata_dir (str): Directory holding the metadata JSON files
+            db_path (str): SQLite database shared by the server processes
+            flush_interval (float): Seconds between write-behind flushes
+            poll_interval (float): Seconds between checks for changes made
+                                   by other processes while waiting
+        """
+        self.db = SqliteDatabase(db_path, self.SCHEMA)
+        self.poll_interval = poll_interval
+        super().__init__(metadata_dir, flush_interval)
+
+    def _import_file(self, job_id):
+        # Jobs written before the database existed are imported on first access
+        metadata, version = self.read_file_with_version(job_id)
+        if metadata is None:
+            return False
+        with self.db.transaction() as connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO jobs (id, version, metadata, updated_at) VALUES (?, ?, ?, ?)",
+                (job_id, version, json.dumps(metadata), time.time())
+            )
+        return True
+
+    def create(self, job_id, metadata):
+        """
+        Add a new job (or replace an existing one).
+
+        Args:
+            job_id (str): Job ID
+            metadata (dict): Initial metadata
+
+        Returns:
+            int: The new version of the job
+        """
+        with self.db.transaction() as connection:
+            row = connection.execute("SELECT version FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            version = (row[0] if row else 0) + 1
+            connection.execute(
+                "INSERT OR REPLACE INTO jobs (id, version, metadata, updated_at) VALUES (?, ?, ?, ?)",
+                (job_id, version, json.dumps(metadata), time.time())
+            )
+        self._changed_locally(job_id)
+        return version
+
+    def update(self, job_id, updates):
+        """
+        Merge fields into a job's metadata.
+
+        Args:
+            job_id (str): Job ID
+            updates (dict): Fields to set
+
+        Returns:
+            int: The new version of the job
+
+        Raises:
+            KeyError: If the job is unknown
+        """
+        with self.db.transaction() as connection:
+            row = connection.execute("SELECT metadata, version FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is not None:
+                metadata, version = json.loads(row[0]), row[1]
+            else:
+                # Written before the database existed
+                metadata, version = self.read_file_with_version(job_id)
+                if metadata is None:
+                    raise KeyError(f"Unknown job: {job_id}")
+            metadata.update(updates)
+            version += 1
+            connection.execute(
+                "INSERT OR REPLACE INTO jobs (id, version, metadata, updated_at) VALUES (?, ?, ?, ?)",
+                (job_id, version, json.dumps(metadata), time.time())
+            )
+        self._changed_locally(job_id)
+        return version
+
+    def get(self, job_id):
+        """
+        Return a job's metadata.
+
+        Returns:
+            dict: The metadata, or None if the job is unknown
+        """
+        return self.get_with_version(job_id)[0]
+
+    def get_with_version(self, job_id):
+        """
+        Return a job's metadata together with its version.
+
+        Returns:
+            tuple: (metadata, version), or (None, 0) if the job is unknown
+        """
+        row = self.db.connection().execute("SELECT metadata, version FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            if not self._import_file(job_id):
+                return None, 0
+            return self.get_with_version(job_id)
+        return json.loads(row[0]), row[1]
+
+    def wait_for_change(self, job_id, version, timeout=None):
+        """
+        Block until a job's version is newer than the given one.
+
+        Changes made in this process wake the caller at once, changes made by
+        other processes within poll_interval.
+
+        Args:
+            job_id (str): Job ID
+            version (int): Last version seen by the caller
+            timeout (float, optional): Maximum number of seconds to wait
+
+        Returns:
+            tuple: (metadata, version); the version equals the given one on timeout,
+                   and metadata is None if the job is unknown
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            metadata, current = self.get_with_version(job_id)
+            if metadata is None or current > version:
+                return metadata, current
+            wait = self.poll_interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return metadata, current
+            with self._changed:
+                self._changed.wait(wait)
+
+    def flush(self):
+        """Write the jobs changed by this process to disk."""
+        with self._flush_lock:
+            with self._lock:
+                dirty = self._dirty
+                self._dirty = set()
+
+            for job_id in dirty:
+                try:
+                    metadata, version = self.get_with_version(job_id)
+                    if metadata is not None:
+                        self.write_file(job_id, metadata, version)
+                except Exception as e:
+                    print(f"Error persisting metadata for {job_id}: {str(e)}")
+                    with self._lock:
+                        self._dirty.add(job_id)
+
+    def _changed_locally(self, job_id):
+        with self._lock:
+            self._dirty.add(job_id)
+            self._changed.notify_all()
+        self._wakeup.set()
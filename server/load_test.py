@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+A small HTTP load generator for comparing server setups.
+
+Runs a number of client threads, each sending requests over its own
+keep-alive connection for a fixed time, and reports requests per second and
+latency percentiles. Without paths it requests the metadata and image of a
+job found in the local metadata directory, i.e. what a status poll and the
+web viewer do.
+
+    python load_test.py --url http://localhost:5000 --concurrency 32 --duration 15
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+
+def default_paths(metadata_dir="metadata"):
+    """
+    Find the metadata and image URLs of a completed local job.
+
+    Returns:
+        list: Request paths, or an empty list if no job was found
+    """
+    for directory, _, filenames in os.walk(metadata_dir):
+        for filename in sorted(filenames):
+            if not (filename.startswith("metadata_") and filename.endswith(".json")):
+                continue
+            with open(os.path.join(directory, filename), "r") as f:
+                metadata = json.load(f)
+            paths = [f"/metadata/{filename}"]
+            if metadata.get("image_path"):
+                paths.append(f"/files/{os.path.basename(metadata['image_path'])}")
+            return paths
+    return []
+
+
+def run_client(url, paths, deadline, results):
+    """
+    Send requests until the deadline and record their latencies.
+
+    Args:
+        url (str): Server base URL
+        paths (list): Paths requested in turn
+        deadline (float): time.monotonic() value to stop at
+        results (list): Receives (latencies, status counts, errors)
+    """
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    connection = connection_class(parts.hostname, parts.port, timeout=30)
+    latencies = []
+    statuses = {}
+    errors = 0
+    index = 0
+    while time.monotonic() < deadline:
+        path = paths[index % len(paths)]
+        index += 1
+        start = time.monotonic()
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            response.read()
+        except Exception:
+            errors += 1
+            connection.close()
+            connection = connection_class(parts.hostname, parts.port, timeout=30)
+            continue
+        latencies.append(time.monotonic() - start)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+    connection.close()
+    results.append((latencies, statuses, errors))
+
+
+def percentile(values, fraction):
+    """Return the value below which the given fraction of sorted values lies."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure requests per second of a running server.')
+    parser.add_argument('--url', default='http://localhost:5000', help='Server base URL')
+    parser.add_argument('--path', action='append', help='Path to request (repeatable); defaults to a local job')
+    parser.add_argument('--concurrency', type=int, default=16, help='Number of client threads')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds to run')
+    args = parser.parse_args()
+
+    paths = args.path or default_paths()
+    if not paths:
+        print("Error: No --path given and no job found in metadata/.")
+        sys.exit(1)
+
+    results = []
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=run_client, args=(args.url, paths, deadline, results))
+        for _ in range(args.concurrency)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    statuses = {}
+    for _, result_statuses, _ in results:
+        for status, count in result_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+    errors = sum(result[2] for result in results)
+
+    print(f"Paths: {', '.join(paths)}")
+    print(f"Concurrency: {args.concurrency}, duration: {elapsed:.1f}s")
+    print(f"Requests: {len(latencies)} ({errors} errors), statuses: {statuses}")
+    print(f"Throughput: {len(latencies) / elapsed:.1f} requests/s")
+    print(f"Latency: p50 {percentile(latencies, 0.5) * 1000:.1f} ms, "
+          f"p95 {percentile(latencies, 0.95) * 1000:.1f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Level-of-detail variants of reconstructed point clouds.
+
+The viewer cannot render anything until a whole PLY has been downloaded.
+Instead, the points are split into coarse-to-fine levels: level 0 holds one
+point per cell of a coarse voxel grid, every further level adds one point per
+cell of a grid twice as fine, and the last level holds the remaining points.
+Each level is written as its own small binary PLY (with precompressed
+copies), so the viewer can draw level 0 after a few kilobytes and append the
+finer levels as they arrive; together the levels contain every point exactly
+once, so the total download is no larger than the full file.
+
+The selection is vectorized: points are shuffled once, and the representative
+of a voxel is its first point in that order (np.unique). A point that
+represents a coarse voxel is also first in its finer voxel, so the levels are
+nested and no point is picked twice.
+"""
+import os
+import numpy as np
+from ply_processing import POSITION_FIELDS, read_ply, write_binary_ply, compress_file
+
+
+def lod_order(vertices, levels=4, base_resolution=32, seed=0):
+    """
+    Order points from coarse to fine detail.
+
+    Args:
+        vertices (ndarray): Structured vertex array with x, y and z
+        levels (int): Number of levels
+        base_resolution (int): Voxels along the longest axis for level 0;
+                               doubled for every further level
+        seed (int): Seed of the shuffle, so results are reproducible
+
+    Returns:
+        tuple: (indices into vertices in level order, vertex count per level)
+    """
+    count = len(vertices)
+    shuffled = np.random.default_rng(seed).permutation(count)
+    positions = np.stack([vertices[field][shuffled].astype(np.float64) for field in POSITION_FIELDS], axis=1)
+
+    level_of = np.full(count, levels - 1, dtype=np.int64)
+    if count:
+        low = positions.min(axis=0)
+        extent = float((positions.max(axis=0) - low).max()) or 1.0
+        # Finest grid first, so points representing coarser voxels end up in the coarser level
+        for level in reversed(range(levels - 1)):
+            resolution = base_resolution * 2 ** level
+            cells = np.minimum((positions - low) / extent * resolution, resolution - 1).astype(np.int64)
+            keys = (cells[:, 0] * resolution + cells[:, 1]) * resolution + cells[:, 2]
+            _, first = np.unique(keys, return_index=True)
+            level_of[first] = level
+
+    ranking = np.argsort(level_of, kind="stable")
+    return shuffled[ranking], np.bincount(level_of, minlength=levels)
+
+
+def lod_path(path, level):
+    """Return the path of a LOD level of a PLY: generated_<id>_lod<n>.ply."""
+    return f"{os.path.splitext(path)[0]}_lod{level}.ply"
+
+
+def build_lods(path, levels=4, base_resolution=32, encodings=("br", "gzip"), brotli_quality=5):
+    """
+    Write the LOD levels of a PLY next to it.
+
+    Only the vertex element is kept; other elements are dropped from the
+    levels. Empty levels (small clouds) are skipped, so the returned levels
+    are numbered without gaps.
+
+    Args:
+        path (str): PLY file
+        levels (int): Number of levels
+        base_resolution (int): Voxels along the longest axis for level 0
+        encodings (iterable): Content codings of the compressed copies
+        brotli_quality (int): Brotli quality (0-11)
+
+    Returns:
+        list: One dict per level with level, path, vertices, bytes and
+              variants (content coding -> path)
+    """
+    header, elements = read_ply(path)
+    vertices = dict(elements).get("vertex")
+    if vertices is None:
+        raise ValueError("PLY has no vertex element")
+    vertices = vertices.astype(vertices.dtype.newbyteorder("<"))
+
+    order, counts = lod_order(vertices, levels, base_resolution)
+    lods = []
+    start = 0
+    for count in counts:
+        if count == 0:
+            continue
+        level = len(lods)
+        level_path = lod_path(path, level)
+        comments = header["comments"] + [f"comment lod_level {level}"]
+        # File order within a level keeps neighbouring points together, which compresses better
+        indices = np.sort(order[start:start + count])
+        write_binary_ply(level_path, [("vertex", vertices[indices])], comments)
+        lods.append({
+            "level": level,
+            "path": level_path,
+            "vertices": int(count),
+            "bytes": os.path.getsize(level_path),
+            "variants": compress_file(level_path, encodings, brotli_quality=brotli_quality)
+        })
+        start += count
+    return lods
@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+"""
+Normalization and compression of reconstructed PLY files.
+
+Invisible Stitch may return ASCII or big-endian PLYs, which are several times
+larger than they need to be and slow to parse in the browser. After a
+reconstruction the PLY is rewritten as little-endian binary (float64
+properties become float32, which is what the Three.js viewer uses anyway)
+and precompressed copies (`.ply.gz`, and `.ply.br` when the `brotli` package
+is installed) are written next to it; `/files` serves them with the matching
+Content-Encoding to clients that accept it.
+
+Elements are read with NumPy structured dtypes: binary bodies straight from
+the file, ASCII bodies element by element with np.loadtxt, which parses in
+chunks instead of holding every number as a Python string. Optionally, positions are quantized to integer coordinates on a
+uniform grid (stored as ushort, with the scale and offset in a header
+comment) and float colors are stored as 8-bit values, which makes the files
+much smaller. The grid is uniform across the axes, so a viewer that centers
+and fits the cloud, like ours, renders it unchanged.
+"""
+import io
+import os
+import gzip
+import itertools
+import tempfile
+import numpy as np
+from content_store import HashingWriter, record_digest
+from asset_serving import PRECOMPRESSED_EXTENSIONS
+
+PLY_TYPES = {
+    "char": "i1", "int8": "i1",
+    "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2",
+    "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4",
+    "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4",
+    "double": "f8", "float64": "f8"
+}
+# Type names written to normalized files
+PLY_TYPE_NAMES = {"i1": "char", "u1": "uchar", "i2": "short", "u2": "ushort",
+                  "i4": "int", "u4": "uint", "f4": "float", "f8": "double"}
+POSITION_FIELDS = ("x", "y", "z")
+COLOR_FIELDS = ("red", "green", "blue", "alpha")
+WRITE_CHUNK_SIZE = 1024 * 1024
+
+
+class PlyFormatError(ValueError):
+    """Raised for PLY files that cannot be parsed."""
+
+
+def read_ply_header(f):
+    """
+    Parse a PLY header.
+
+    Args:
+        f (file): File opened in binary mode, positioned at the start
+
+    Returns:
+        dict: format, comments, elements (name, count, properties as
+              (name, type) pairs) and the header length in bytes
+
+    Raises:
+        PlyFormatError: If the header is invalid or uses list properties
+    """
+    if f.readline().strip() != b"ply":
+        raise PlyFormatError("Not a PLY file")
+
+    header = {"format": None, "comments": [], "elements": []}
+    while True:
+        line = f.readline()
+        if not line:
+            raise PlyFormatError("PLY header is not terminated")
+        words = line.decode("ascii", errors="replace").split()
+        if not words:
+            continue
+        if words[0] == "end_header":
+            break
+        if words[0] == "format":
+            header["format"] = words[1]
+        elif words[0] in ("comment", "obj_info"):
+            header["comments"].append(line.decode("ascii", errors="replace").rstrip("\r\n"))
+        elif words[0] == "element":
+            header["elements"].append({"name": words[1], "count": int(words[2]), "properties": []})
+        elif words[0] == "property":
+            if words[1] == "list":
+                raise PlyFormatError("PLY list properties (e.g. faces) are not supported")
+            if not header["elements"] or words[1] not in PLY_TYPES:
+                raise PlyFormatError(f"Invalid PLY property: {' '.join(words)}")
+            header["elements"][-1]["properties"].append((words[2], PLY_TYPES[words[1]]))
+
+    if header["format"] not in ("ascii", "binary_little_endian", "binary_big_endian"):
+        raise PlyFormatError(f"Unknown PLY format: {header['format']}")
+    header["length"] = f.tell()
+    return header
+
+
+def read_ply(path):
+    """
+    Read all elements of a PLY file into structured arrays.
+
+    Args:
+        path (str): PLY file
+
+    Returns:
+        tuple: (header dict, list of (element name, structured array))
+    """
+    with open(path, "rb") as f:
+        header = read_ply_header(f)
+
+    elements = []
+    if header["format"] == "ascii":
+        with open(path, "rb") as f:
+            f.seek(header["length"])
+            lines = io.TextIOWrapper(f, encoding="ascii", errors="replace")
+            for element in header["elements"]:
+                elements.append((element["name"], read_ascii_element(lines, element)))
+        return header, elements
+
+    byte_order = "<" if header["format"] == "binary_little_endian" else ">"
+    offset = header["length"]
+    for element in header["elements"]:
+        dtype = np.dtype([(name, byte_order + ply_type) for name, ply_type in element["properties"]])
+        array = np.fromfile(path, dtype=dtype, count=element["count"], offset=offset)
+        if len(array) < element["count"]:
+            raise PlyFormatError(f"PLY element '{element['name']}' is truncated")
+        elements.append((element["name"], array))
+        offset += element["count"] * dtype.itemsize
+    return header, elements
+
+
+def read_ascii_element(lines, element):
+    """
+    Parse the rows of one element of an ASCII PLY.
+
+    The rows are read one chunk at a time by np.loadtxt and reading stops
+    after the element's last row, so memory use stays close to the size of
+    the resulting array.
+
+    Args:
+        lines (file): Text file positioned at the element's first row
+        element (dict): Element from read_ply_header
+
+    Returns:
+        numpy.ndarray: Structured array of the element
+
+    Raises:
+        PlyFormatError: If a value is invalid or the element is truncated
+    """
+    dtype = np.dtype([(name, "<" + ply_type) for name, ply_type in element["properties"]])
+    array = np.empty(element["count"], dtype=dtype)
+    if element["count"] == 0:
+        return array
+    try:
+        table = np.loadtxt(itertools.islice(lines, element["count"]), dtype=np.float64, ndmin=2)
+    except ValueError as e:
+        raise PlyFormatError(f"Invalid value in ASCII PLY: {str(e)}")
+    if table.shape[0] < element["count"]:
+        raise PlyFormatError(f"PLY element '{element['name']}' is truncated")
+    if table.shape[1] != len(dtype.names):
+        raise PlyFormatError(f"PLY element '{element['name']}' has {table.shape[1]} values per row, "
+                             f"expected {len(dtype.names)}")
+    for index, name in enumerate(dtype.names):
+        array[name] = table[:, index]
+    return array
+
+
+def normalize_elements(elements, position_bits=0, quantize_colors=False):
+    """
+    Convert elements to little-endian, float32 and optionally quantized values.
+
+    Args:
+        elements (list): (name, structured array) pairs
+        position_bits (int): Store vertex positions as integer coordinates on
+                             a grid of 2**bits steps along the longest axis
+                             of the bounding box (1-16; 0 keeps floats)
+        quantize_colors (bool): Store float colors in [0, 1] as uchar
+
+    Returns:
+        tuple: (list of (name, structured array) pairs, header comments
+                describing the quantization)
+    """
+    normalized = []
+    comments = []
+    for name, array in elements:
+        grid = None
+        if name == "vertex" and position_bits and len(array) and all(f in array.dtype.names for f in POSITION_FIELDS):
+            grid = position_grid(array, position_bits)
+            scale, (x, y, z) = grid
+            comments.append(f"comment quantized_positions scale {scale!r} offset {x!r} {y!r} {z!r}")
+
+        fields = []
+        for field in array.dtype.names:
+            kind = array.dtype[field].str[1:]
+            if kind == "f8":
+                kind = "f4"
+            if quantize_colors and name == "vertex" and field in COLOR_FIELDS and kind == "f4":
+                kind = "u1"
+            if grid is not None and field in POSITION_FIELDS:
+                kind = "u2"
+            fields.append((field, "<" + kind))
+
+        result = np.empty(len(array), dtype=fields)
+        for field, kind in fields:
+            values = array[field]
+            if grid is not None and field in POSITION_FIELDS:
+                values = np.rint((values.astype(np.float64) - grid[1][POSITION_FIELDS.index(field)]) / grid[0])
+            elif kind == "<u1" and array.dtype[field].kind == "f":
+                values = np.clip(np.rint(values * 255), 0, 255)
+            result[field] = values
+        normalized.append((name, result))
+    return normalized, comments
+
+
+def position_grid(vertices, bits):
+    """
+    Return the uniform grid positions are quantized to.
+
+    A position is stored as round((p - offset) / scale), so
+    p = q * scale + offset restores it to within scale / 2.
+
+    Args:
+        vertices (ndarray): Structured vertex array with x, y and z
+        bits (int): Bits per coordinate (at most 16)
+
+    Returns:
+        tuple: (scale, (x, y, z) offset)
+    """
+    bits = max(1, min(int(bits), 16))
+    low = [float(vertices[field].min()) for field in POSITION_FIELDS]
+    extent = max(float(vertices[field].max()) - low[index] for index, field in enumerate(POSITION_FIELDS))
+    scale = extent / (2 ** bits - 1) if extent > 0 else 1.0
+    return scale, tuple(low)
+
+
+def write_binary_ply(path, elements, comments=()):
+    """
+    Write elements as a little-endian binary PLY, atomically.
+
+    Args:
+        path (str): Output file
+        elements (list): (name, structured array) pairs with little-endian fields
+        comments (iterable): Header comment lines to keep
+    """
+    lines = ["ply", "format binary_little_endian 1.0"]
+    lines.extend(comments)
+    for name, array in elements:
+        lines.append(f"element {name} {len(array)}")
+        for field in array.dtype.names:
+            lines.append(f"property {PLY_TYPE_NAMES[array.dtype[field].str[1:]]} {field}")
+    lines.append("end_header")
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp_", suffix=".ply")
+    os.close(fd)
+    try:
+        with HashingWriter(tmp_path) as writer:
+            writer.write(("\n".join(lines) + "\n").encode("ascii"))
+            for _, array in elements:
+                data = np.ascontiguousarray(array).view(np.uint8)
+                for start in range(0, len(data), WRITE_CHUNK_SIZE):
+                    writer.write(data[start:start + WRITE_CHUNK_SIZE])
+        os.replace(tmp_path, path)
+        record_digest(path, writer.hexdigest())
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def compress_file(path, encodings=("br", "gzip"), gzip_level=9, brotli_quality=5):
+    """
+    Write precompressed copies of a file next to it (<path>.br, <path>.gz).
+
+    Brotli is skipped if the `brotli` package is not installed.
+
+    Args:
+        path (str): File to compress
+        encodings (iterable): Content codings to write
+        gzip_level (int): gzip compression level
+        brotli_quality (int): Brotli quality (0-11)
+
+    Returns:
+        dict: Content coding -> path of the compressed copy
+    """
+    written = {}
+    for encoding in encodings:
+        target = path + PRECOMPRESSED_EXTENSIONS[encoding]
+        tmp_path = f"{target}.tmp"
+        try:
+            if encoding == "br":
+                try:
+                    import brotli
+                except ImportError:
+                    print("brotli is not installed, skipping Brotli compression")
+                    continue
+                compressor = brotli.Compressor(quality=brotli_quality)
+                with open(path, "rb") as source, open(tmp_path, "wb") as output:
+                    for chunk in iter(lambda: source.read(WRITE_CHUNK_SIZE), b""):
+                        output.write(compressor.process(chunk))
+                    output.write(compressor.finish())
+            else:
+                # mtime=0 keeps the output (and its ETag) identical for identical input
+                with open(path, "rb") as source, open(tmp_path, "wb") as raw, \
+                        gzip.GzipFile(filename="", mode="wb", fileobj=raw, compresslevel=gzip_level, mtime=0) as output:
+                    for chunk in iter(lambda: source.read(WRITE_CHUNK_SIZE), b""):
+                        output.write(chunk)
+            os.replace(tmp_path, target)
+            written[encoding] = target
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return written
+
+
+def optimize_ply(path, position_bits=0, quantize_colors=False, encodings=("br", "gzip"),
+                 brotli_quality=5):
+    """
+    Rewrite a PLY as little-endian binary and write compressed copies.
+
+    Args:
+        path (str): PLY file, replaced in place
+        position_bits (int): Position quantization bits (0 disables it)
+        quantize_colors (bool): Store float colors as uchar
+        encodings (iterable): Content codings of the compressed copies
+        brotli_quality (int): Brotli quality (0-11)
+
+    Returns:
+        dict: original_bytes, bytes, vertices and variants (content coding ->
+              {"path", "bytes"})
+    """
+    original_bytes = os.path.getsize(path)
+    header, elements = read_ply(path)
+    elements, comments = normalize_elements(elements, position_bits, quantize_colors)
+    write_binary_ply(path, elements, header["comments"] + comments)
+
+    variants = compress_file(path, encodings, brotli_quality=brotli_quality)
+    return {
+        "original_bytes": original_bytes,
+        "bytes": os.path.getsize(path),
+        "vertices": sum(len(array) for name, array in elements if name == "vertex"),
+        "variants": {
+            encoding: {"path": variant_path, "bytes": os.path.getsize(variant_path)}
+            for encoding, variant_path in variants.items()
+        }
+    }
@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+"""
+A persistent cache of generation results keyed by prompt and model parameters.
+
+When the same (normalized) prompt is submitted again with the same model
+parameters, the stored image, PLY and storage URLs of the earlier job are
+reused instead of paying for another gpt-image-1 call and Invisible Stitch
+run. Entries are evicted by age and, least recently used first, by count.
+
+Identical requests that arrive while the first one is still being processed
+are coalesced onto the running job by the InflightRegistry (single-flight).
+
+Hits update the last use time of an entry in memory; these times are
+written to the index in batches (every touch_interval seconds, with the next
+change of the index and on flush()), so a hit does not rewrite the index.
+
+With several server processes, the cache index is locked and reloaded
+whenever another process changed it (keeping the unwritten use times), and
+SharedInflightRegistry keeps the in-flight jobs in the SQLite database of
+the job store. Dropped entries are reported to on_drop, e.g. to release
+their references to stored content.
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from job_store import write_json_atomic, file_lock, SqliteDatabase
+
+
+def normalize_prompt(prompt):
+    """
+    Normalize a prompt so trivially different spellings share a cache entry.
+
+    Leading/trailing whitespace is removed, runs of whitespace are collapsed
+    and the text is case-folded.
+    """
+    return re.sub(r"\s+", " ", prompt).strip().casefold()
+
+
+def cache_key(prompt, params):
+    """
+    Return the cache key for a prompt and its model parameters.
+
+    Args:
+        prompt (str): The generation prompt
+        params (dict): Model parameters that influence the result
+
+    Returns:
+        str: Hex SHA-256 key
+    """
+    payload = json.dumps({"prompt": normalize_prompt(prompt), "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Thread-safe result cache persisted as a JSON index file.
+    """
+
+    def __init__(self, cache_dir="cache", max_entries=500, max_age=7 * 24 * 3600, shared=False, touch_interval=60, on_drop=None):
+        """
+        Initialize the cache and load its index from disk.
+
+        Args:
+            cache_dir (str): Directory holding the cache index
+            max_entries (int): Maximum number of cached results
+            max_age (float): Maximum age of an entry in seconds
+            shared (bool): Whether other processes use the same index
+            touch_interval (float): Seconds between writes of the last use times
+            on_drop (callable, optional): Called with the key of every entry
+                                          that expired or was evicted
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.shared = shared
+        self.touch_interval = touch_interval
+        self.on_drop = on_drop
+        self.index_path = os.path.join(cache_dir, "results.json")
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._index_version = None
+        # Last use times of hits that are not written to the index yet
+        self._touched = {}
+        self._touched_since = time.monotonic()
+        self._hits = 0
+        self._misses = 0
+        self._reload()
+
+    @contextmanager
+    def _locked(self):
+        # Thread lock, plus the index file lock if other processes share the index
+        with self._lock:
+            if not self.shared:
+                yield
+                return
+            with file_lock(self.index_path + ".lock"):
+                self._reload()
+                yield
+
+    def _reload(self):
+        # Read the index if it changed since it was last read or written
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return
+        # A new inode on every atomic replace, so coarse mtimes are enough
+        version = (stat.st_mtime_ns, stat.st_ino)
+        if version == self._index_version:
+            return
+        try:
+            with open(self.index_path, "r") as f:
+                self._entries = json.load(f)
+            self._index_version = version
+            for key, last_used in self._touched.items():
+                entry = self._entries.get(key)
+                if entry is not None and entry.get("last_used", 0) < last_used:
+                    entry["last_used"] = last_used
+        except Exception as e:
+            print(f"Error loading result cache index: {str(e)}")
+
+    def get(self, key):
+        """
+        Look up a cached result.
+
+        Entries that are too old or whose local files are gone are dropped.
+
+        Args:
+            key (str): Cache key
+
+        Returns:
+            dict: The cached result, or None on a miss
+        """
+        dropped = []
+        with self._locked():
+            entry = self._entries.get(key)
+            if entry is not None and not self._is_valid(entry):
+                del self._entries[key]
+                self._save()
+                entry = None
+                dropped.append(key)
+
+            if entry is None:
+                self._misses += 1
+            else:
+                entry["last_used"] = self._touched[key] = time.time()
+                self._hits += 1
+                if time.monotonic() - self._touched_since >= self.touch_interval:
+                    self._save()
+                entry = dict(entry)
+        self._notify_dropped(dropped)
+        return entry
+
+    def put(self, key, result):
+        """
+        Store a result and evict old entries.
+
+        Args:
+            key (str): Cache key
+            result (dict): Result fields (image_path, ply_path, URLs, storage)
+        """
+        now = time.time()
+        with self._locked():
+            self._entries[key] = dict(result, created_at=now, last_used=now)
+            dropped = self._evict()
+            self._save()
+        self._notify_dropped(dropped)
+
+    def flush(self):
+        """Write the last use times of recent hits to the index."""
+        with self._locked():
+            if self._touched:
+                self._save()
+
+    def stats(self):
+        """Return the number of entries, hits and misses."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses
+            }
+
+    def _is_valid(self, entry):
+        if time.time() - entry.get("created_at", 0) > self.max_age:
+            return False
+        for field in ("image_path", "ply_path"):
+            if entry.get(field) and not os.path.exists(entry[field]):
+                return False
+        return True
+
+    def _evict(self):
+        # Returns the keys of the dropped entries
+        now = time.time()
+        dropped = [k for k, e in self._entries.items() if now - e.get("created_at", 0) > self.max_age]
+        for key in dropped:
+            del self._entries[key]
+
+        overflow = len(self._entries) - self.max_entries
+        if overflow > 0:
+            by_last_use = sorted(self._entries, key=lambda k: self._entries[k].get("last_used", 0))
+            for key in by_last_use[:overflow]:
+                del self._entries[key]
+                dropped.append(key)
+        return dropped
+
+    def _notify_dropped(self, keys):
+        # Called outside the locks, so the callback may take its own
+        if self.on_drop:
+            for key in keys:
+                try:
+                    self.on_drop(key)
+                except Exception as e:
+                    print(f"Error releasing result cache entry: {str(e)}")
+
+    def _save(self):
+        try:
+            write_json_atomic(self.index_path, self._entries)
+            stat = os.stat(self.index_path)
+            self._index_version = (stat.st_mtime_ns, stat.st_ino)
+            self._touched.clear()
+            self._touched_since = time.monotonic()
+        except Exception as e:
+            print(f"Error saving result cache index: {str(e)}")
+
+
+class InflightRegistry:
+    """
+    Tracks the jobs currently being generated per cache key (single-flight).
+
+    The first request for a key claims it; later requests for the same key
+    attach to that job until it is released.
+    """
+
+    # Upstream calls (gpt-image-1 and Invisible Stitch) made per generation
+    UPSTREAM_CALLS_PER_JOB = 2
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._coalesced = 0
+
+    def claim(self, key, job_info):
+        """
+        Claim a key for a new job, or find the job already running for it.
+
+        Args:
+            key (str): Cache key of the request
+            job_info (dict): Response data describing the new job
+
+        Returns:
+            dict: A copy of the running job's info if the key was already
+                  claimed (the request is coalesced), otherwise None
+        """
+        with self._lock:
+            existing = self._jobs.get(key)
+            if existing is not None:
+                self._coalesced += 1
+                return dict(existing)
+            self._jobs[key] = dict(job_info)
+            return None
+
+    def release(self, key, job_id):
+        """Release a key once its job has finished (or failed)."""
+        with self._lock:
+            existing = self._jobs.get(key)
+            if existing is not None and existing.get("id") == job_id:
+                del self._jobs[key]
+
+    def stats(self):
+        """Return the number of in-flight jobs and coalescing counters."""
+        with self._lock:
+            return {
+                "in_flight": len(self._jobs),
+                "coalesced_requests": self._coalesced,
+                "upstream_calls_saved": self._coalesced * self.UPSTREAM_CALLS_PER_JOB
+            }
+
+
+class SharedInflightRegistry(InflightRegistry):
+    """
+    Single-flight registry shared by several server processes through SQLite.
+
+    Claims older than max_age are ignored, so a claim left behind by a
+    process that died does not attach requests to a job that never finishes.
+    The coalescing counters are per process.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS inflight ("
+        "key TEXT PRIMARY KEY, job_id TEXT NOT NULL, job_info TEXT NOT NULL, claimed_at REAL NOT NULL)",
+    )
+
+    def __init__(self, db_path, max_age=3600):
+        """
+        Open the database.
+
+        Args:
+            db_path (str): SQLite database shared by the server processes
+            max_age (float): Seconds after which a claim expires
+        """
+        super().__init__()
+        self.db = SqliteDatabase(db_path, self.SCHEMA)
+        self.max_age = max_age
+
+    def claim(self, key, job_info):
+        """
+        Claim a key for a new job, or find the job already running for it.
+
+        Args:
+            key (str): Cache key of the request
+            job_info (dict): Response data describing the new job
+
+        Returns:
+            dict: The running job's info if the key was already claimed (the
+                  request is coalesced), otherwise None
+        """
+        now = time.time()
+        with self.db.transaction() as connection:
+            row = connection.execute("SELECT job_info, claimed_at FROM inflight WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] < self.max_age:
+                with self._lock:
+                    self._coalesced += 1
+                return json.loads(row[0])
+            connection.execute(
+                "INSERT OR REPLACE INTO inflight (key, job_id, job_info, claimed_at) VALUES (?, ?, ?, ?)",
+                (key, job_info.get("id"), json.dumps(job_info), now)
+            )
+        return None
+
+    def release(self, key, job_id):
+        """Release a key once its job has finished (or failed)."""
+        with self.db.transaction() as connection:
+            connection.execute("DELETE FROM inflight WHERE key = ? AND job_id = ?", (key, job_id))
+
+    def stats(self):
+        """Return the number of in-flight jobs (of all processes) and coalescing counters."""
+        in_flight = self.db.connection().execute(
+            "SELECT COUNT(*) FROM inflight WHERE claimed_at > ?", (time.time() - self.max_age,)
+        ).fetchone()[0]
+        with self._lock:
+            return {
+                "in_flight": in_flight,
+                "coalesced_requests": self._coalesced,
+                "upstream_calls_saved": self._coalesced * self.UPSTREAM_CALLS_PER_JOB
+            }
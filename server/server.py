@@ -1,17 +1,33 @@
 import os
-import base64
+import sys
 import json
+import signal
+import atexit
+import asyncio
+import threading
+import time
 from openai import OpenAI
 from datetime import datetime
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-import requests
-from io import BytesIO
-from PIL import Image
+from werkzeug.exceptions import NotFound
 from dotenv import load_dotenv
-from get_ply import generate_ply
+from get_ply import generate_ply, generate_ply_async, submit_ply, get_client_pool, PlySupervisor
 from cloud_storage import get_storage_provider
 from vercel_api import upload_to_vercel_blob
+from job_store import JobStore, SqliteJobStore, job_id_from_filename, file_lock
+from job_journal import JobJournal
+from asset_serving import send_asset, json_response, preferred_encoding, PRECOMPRESSED_EXTENSIONS
+from result_cache import ResultCache, InflightRegistry, SharedInflightRegistry, cache_key
+from asset_index import AssetIndex
+from storage_layout import StorageLayout, new_job_id, sharded_relative_path, migrate_flat_layout, ASSET_NAME_PATTERN
+from storage_fanout import StorageFanout
+from content_store import AssetReferences, content_name, file_sha256
+from image_ingest import download_image, download_image_async, decode_base64_image, detect_image_format
+from image_derivatives import DerivativeCache, DerivativeError, SOURCE_EXTENSIONS, parse_variants
+from ply_processing import optimize_ply
+from ply_lod import build_lods, lod_path
+from job_scheduler import create_scheduler_from_env, QueueFullError, SchedulerShutdownError, DEFERRED
 
 # Load environment variables from .env file if present
 load_dotenv()
@@ -23,6 +39,19 @@ CORS(app)
 # Initialize OpenAI client
 client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
+# "asyncio" runs the pipeline on one event loop, so a waiting job holds no
+# thread; "threads" runs it on worker threads (the fallback)
+PIPELINE_MODE = os.environ.get("PIPELINE_MODE", "asyncio").lower()
+if PIPELINE_MODE == "asyncio":
+    try:
+        import httpx
+        from openai import AsyncOpenAI
+        from async_scheduler import create_async_scheduler_from_env
+        async_client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    except ImportError as e:
+        print(f"Asyncio pipeline unavailable ({str(e)}), using worker threads.")
+        PIPELINE_MODE = "threads"
+
 # Get Vercel Blob token from environment
 VERCEL_BLOB_TOKEN = os.environ.get('BLOB_READ_WRITE_TOKEN')
 if VERCEL_BLOB_TOKEN:
@@ -30,28 +59,163 @@ if VERCEL_BLOB_TOKEN:
 else:
     print("No Vercel Blob API token found. Set BLOB_READ_WRITE_TOKEN environment variable for Vercel Blob API access.")
 
+# Store files under their content digest so identical files are uploaded once
+CONTENT_ADDRESSED_STORAGE = os.environ.get("STORAGE_CONTENT_ADDRESSED", "true").lower() in ("1", "true", "yes")
+
+# Vercel Blob store and its public URL
+VERCEL_BLOB_STORE_ID = 'store_vO7lSadIHJFbCUIv'
+VERCEL_BLOB_URL = 'https://vo7lsadihjfbcuiv.public.blob.vercel-storage.com'
+
 # Initialize storage providers - try Vercel Blob first, fallback to local
 storage_providers = [
     # Vercel Blob Storage provider
     get_storage_provider(
         provider_type='vercel-blob',
-        blob_url='https://vo7lsadihjfbcuiv.public.blob.vercel-storage.com',
-        store_id='store_vO7lSadIHJFbCUIv'
+        blob_url=VERCEL_BLOB_URL,
+        store_id=VERCEL_BLOB_STORE_ID,
+        content_addressed=CONTENT_ADDRESSED_STORAGE
     ),
     # Local storage provider as fallback
     get_storage_provider(
         provider_type='local',
-        storage_dir='storage'
+        storage_dir='storage',
+        sharded=True,
+        content_addressed=CONTENT_ADDRESSED_STORAGE
+    )
+]
+
+# S3 (or an S3-compatible service such as MinIO) when a bucket is configured
+if os.environ.get("S3_BUCKET"):
+    storage_providers.insert(-1, get_storage_provider(
+        provider_type='s3',
+        bucket_name=os.environ["S3_BUCKET"],
+        region_name=os.environ.get("S3_REGION", "us-east-1"),
+        prefix=os.environ.get("S3_PREFIX", ""),
+        endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
+        multipart_threshold=int(os.environ.get("S3_MULTIPART_THRESHOLD", 64 * 1024 * 1024)),
+        multipart_chunksize=int(os.environ.get("S3_MULTIPART_CHUNKSIZE", 8 * 1024 * 1024)),
+        max_concurrency=int(os.environ.get("S3_MAX_CONCURRENCY", 4)),
+        content_addressed=CONTENT_ADDRESSED_STORAGE
+    ))
+
+def upload_with_vercel_api(file_path):
+    """Upload a file with the Vercel Blob API (requires BLOB_READ_WRITE_TOKEN)."""
+    return upload_to_vercel_blob(
+        file_path=file_path,
+        store_id=VERCEL_BLOB_STORE_ID,
+        token=VERCEL_BLOB_TOKEN,
+        pathname=content_name(file_path)[0] if CONTENT_ADDRESSED_STORAGE else None,
+        blob_url=VERCEL_BLOB_URL
     )
+
+def provider_upload(provider):
+    """Return an upload function for a storage provider."""
+    return lambda file_path: provider.upload_file(file_path, content_type="application/octet-stream")
+
+def provider_upload_async(provider):
+    """Return an asyncio upload function for a storage provider."""
+    return lambda file_path: provider.upload_file_async(file_path, content_type="application/octet-stream")
+
+# Uploads race on all remote providers; local storage is the fallback and a replica.
+# STORAGE_UPLOAD_MODE=sequential tries them one after another instead.
+storage_targets = [("vercel-blob-api", upload_with_vercel_api, False)] if VERCEL_BLOB_TOKEN else []
+storage_targets += [
+    (provider.name, provider_upload(provider), provider.name == "local")
+    for provider in storage_providers
 ]
+storage_fanout = StorageFanout(
+    storage_targets,
+    mode=os.environ.get("STORAGE_UPLOAD_MODE", "fanout"),
+    max_workers=int(os.environ.get("STORAGE_UPLOAD_WORKERS", 8)),
+    failure_threshold=int(os.environ.get("STORAGE_BREAKER_THRESHOLD", 3)),
+    reset_timeout=float(os.environ.get("STORAGE_BREAKER_RESET", 60)),
+    async_uploads={provider.name: provider_upload_async(provider) for provider in storage_providers}
+)
 
 # Create output directories if they don't exist
 images_dir = "images"
 plys_dir = "plys"
 metadata_dir = "metadata"
-os.makedirs(images_dir, exist_ok=True)
-os.makedirs(plys_dir, exist_ok=True)
-os.makedirs(metadata_dir, exist_ok=True)
+storage_dir = "storage"
+layout = StorageLayout(images_dir, plys_dir, metadata_dir, storage_dir)
+
+# "sqlite" shares job state between several server processes (gunicorn.conf.py
+# selects it when it starts more than one worker); "memory" keeps it in this process
+JOB_STORE = os.environ.get("JOB_STORE", "memory").lower()
+SHARED_STATE = JOB_STORE == "sqlite"
+JOB_STORE_DB = os.environ.get("JOB_STORE_DB", os.path.join(os.environ.get("RESULT_CACHE_DIR", "cache"), "jobs.sqlite3"))
+
+# Move files of the old flat layout into their shard directories
+# (once, even if several worker processes start at the same time)
+with file_lock(os.path.join(os.environ.get("RESULT_CACHE_DIR", "cache"), "startup.lock")):
+    migrated_files = migrate_flat_layout(layout)
+if migrated_files:
+    print(f"Migrated {migrated_files} files into shard directories.")
+
+# Resized and re-encoded image variants (?w=256&fmt=webp), rendered in worker
+# processes; started before any other thread so the workers can be forked
+derivative_cache = DerivativeCache(
+    os.environ.get("DERIVATIVE_CACHE_DIR", os.path.join(os.environ.get("RESULT_CACHE_DIR", "cache"), "derivatives")),
+    max_bytes=int(os.environ.get("DERIVATIVE_CACHE_MAX_BYTES", 512 * 1024 * 1024)),
+    quality=int(os.environ.get("DERIVATIVE_QUALITY", 80)),
+    workers=int(os.environ.get("DERIVATIVE_WORKERS", 2))
+)
+print(f"Found {derivative_cache.start()} cached image derivatives.")
+# Variants rendered as soon as an image is saved
+DERIVATIVE_PREWARM = parse_variants(os.environ.get("DERIVATIVE_PREWARM", "256:webp,512:webp"))
+
+# File name -> location index for /files, kept current by the pipeline
+asset_index = AssetIndex([plys_dir, images_dir, storage_dir])
+print(f"Indexed {asset_index.build()} asset files.")
+if os.environ.get("ASSET_INDEX_WATCH", "").lower() in ("1", "true", "yes"):
+    asset_index.start_watcher(interval=float(os.environ.get("ASSET_INDEX_RESCAN_INTERVAL", 30)))
+
+# Authoritative job metadata, kept in memory and written back to metadata/
+if SHARED_STATE:
+    job_store = SqliteJobStore(metadata_dir, JOB_STORE_DB, flush_interval=float(os.environ.get("METADATA_FLUSH_INTERVAL", 0.5)))
+else:
+    job_store = JobStore(
+        metadata_dir,
+        flush_interval=float(os.environ.get("METADATA_FLUSH_INTERVAL", 0.5)),
+        max_finished_jobs=int(os.environ.get("METADATA_CACHE_SIZE", 1000))
+    )
+
+# Stage transitions of unfinished jobs, so they can be resumed after a restart
+job_journal = JobJournal(os.environ.get("JOB_JOURNAL_DB", JOB_STORE_DB))
+
+# Model parameters; together with the prompt they form the result cache key
+IMAGE_MODEL = "gpt-image-1"
+IMAGE_SIZE = "1024x1024"
+PLY_MODEL = "paulengstler/invisible-stitch"
+GENERATION_PARAMS = {"image_model": IMAGE_MODEL, "image_size": IMAGE_SIZE, "ply_model": PLY_MODEL}
+
+# Which jobs and cache entries use which stored content (by SHA-256 digest)
+asset_refs = AssetReferences(os.environ.get("ASSET_REFS_DB", JOB_STORE_DB))
+
+def cache_ref_owner(key):
+    """Return the asset reference owner of a result cache entry."""
+    return f"cache:{key}"
+
+# Results of earlier jobs, reused when the same prompt comes in again
+result_cache = ResultCache(
+    cache_dir=os.environ.get("RESULT_CACHE_DIR", "cache"),
+    max_entries=int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", 500)),
+    max_age=float(os.environ.get("RESULT_CACHE_MAX_AGE", 7 * 24 * 3600)),
+    shared=SHARED_STATE,
+    touch_interval=float(os.environ.get("RESULT_CACHE_TOUCH_INTERVAL", 60)),
+    on_drop=lambda key: asset_refs.release(cache_ref_owner(key))
+)
+# Jobs currently being generated, so identical requests can attach to them
+if SHARED_STATE:
+    inflight_jobs = SharedInflightRegistry(JOB_STORE_DB, max_age=float(os.environ.get("INFLIGHT_MAX_AGE", 3600)))
+else:
+    inflight_jobs = InflightRegistry()
+# Metadata fields copied from a finished job into the cache and back
+CACHED_RESULT_FIELDS = (
+    "image_path", "image_url", "ply_path", "ply_url",
+    "ply_status", "ply_upload_status", "storage", "image_digest", "ply_digest",
+    "ply_lod_url", "ply_lods"
+)
 
 @app.route('/generate-image', methods=['POST'])
 def generate_image():
@@ -61,23 +225,25 @@ def generate_image():
     if not prompt:
         return jsonify({"error": "Prompt is required"}), 400
     
-    # Generate timestamp for unique filenames
+    # Generate a collision-free job ID for unique filenames
+    job_id = new_job_id()
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    base_filename = f"generated_{timestamp}"
+    base_filename = f"generated_{job_id}"
     image_filename = f"{base_filename}.png"
-    image_path = os.path.join(images_dir, image_filename)
-    ply_path = os.path.join(plys_dir, base_filename)  # No extension, will be added by generate_ply
-    metadata_path = os.path.join(metadata_dir, f"metadata_{timestamp}.json")
+    image_path = layout.image_path(job_id)
+    ply_path = layout.ply_base_path(job_id)  # No extension, will be added by generate_ply
+    metadata_path = layout.metadata_path(job_id)
     
     # Create server URLs for monitoring
     server_url = request.url_root.rstrip('/')
     expected_image_url = f"{server_url}/files/{image_filename}"
     expected_ply_url = f"{server_url}/files/{base_filename}.ply"  # Assuming .ply extension
     metadata_url = f"{server_url}/metadata/{os.path.basename(metadata_path)}"
+    events_url = f"{server_url}/jobs/{job_id}/events"
     
     # Create initial metadata - will be updated as processing continues
     initial_metadata = {
-        "id": timestamp,
+        "id": job_id,
         "timestamp": timestamp,
         "prompt": prompt,
         "status": "processing",
@@ -86,256 +252,856 @@ def generate_image():
         "expected_ply_path": f"{ply_path}.ply",
         "expected_ply_url": expected_ply_url,
         "metadata_path": metadata_path,
-        "metadata_url": metadata_url
+        "metadata_url": metadata_url,
+        "events_url": events_url
     }
     
-    # Save the initial metadata
-    with open(metadata_path, 'w') as f:
-        json.dump(initial_metadata, f, indent=4)
+    # Reuse the result of an earlier job with the same prompt unless the client opted out
+    use_cache = data.get('cache', True) is not False
+    result_key = cache_key(prompt, GENERATION_PARAMS)
+    cached_result = result_cache.get(result_key) if use_cache else None
+    initial_metadata["cache_hit"] = cached_result is not None
+    
+    if cached_result:
+        print(f"Serving cached result of job {cached_result.get('job_id')} for ID: {job_id}")
+        initial_metadata.update({field: cached_result[field] for field in CACHED_RESULT_FIELDS if field in cached_result})
+        initial_metadata.update({
+            "status": "completed",
+            "image_status": "completed",
+            "cached_from": cached_result.get("job_id"),
+            "expected_image_path": cached_result.get("image_path"),
+            "expected_image_url": cached_result.get("image_url"),
+            "expected_ply_path": cached_result.get("ply_path"),
+            "expected_ply_url": cached_result.get("ply_url")
+        })
+        job_store.create(job_id, initial_metadata)
+        # The new job shares the stored content of the cached one
+        for field in ("image_digest", "ply_digest"):
+            if cached_result.get(field):
+                asset_refs.add(cached_result[field], job_id)
+        return jsonify({
+            "success": True,
+            "message": "Result served from cache.",
+            "id": job_id,
+            "metadata_path": metadata_path,
+            "metadata_url": metadata_url,
+            "events_url": events_url,
+            "expected_image_url": cached_result.get("image_url"),
+            "expected_ply_url": cached_result.get("ply_url"),
+            "status": "completed",
+            "cache_hit": True
+        })
     
     # Return the initial metadata to the client immediately so they can monitor progress
     initial_response = {
         "success": True,
         "message": "Generation started. You can monitor progress using the metadata.",
-        "id": timestamp,
+        "id": job_id,
         "metadata_path": metadata_path,
         "metadata_url": metadata_url,
+        "events_url": events_url,
         "expected_image_url": expected_image_url,
         "expected_ply_url": expected_ply_url,
-        "status": "processing"
+        "status": "processing",
+        "cache_hit": False
     }
     
-    # Start the processing in a background thread
-    import threading
-    thread = threading.Thread(target=process_generation, args=(prompt, timestamp, image_path, ply_path, metadata_path))
-    thread.daemon = True
-    thread.start()
+    # Save the initial metadata before the claim below publishes the job ID
+    # to coalesced requests, which may poll it right away
+    job_store.create(job_id, initial_metadata)
+    
+    # Attach to a job that is already generating the same prompt
+    if use_cache:
+        running_job = inflight_jobs.claim(result_key, initial_response)
+        if running_job:
+            print(f"Coalesced request onto running job {running_job['id']}")
+            # The new job never runs; nobody is given its ID
+            job_store.update(job_id, {"status": "coalesced", "coalesced_into": running_job["id"]})
+            running_job["message"] = "An identical request is already being processed; attached to it."
+            running_job["coalesced"] = True
+            return jsonify(running_job)
+    
+    # Queue the processing on the worker pool
+    job = {
+        "id": job_id,
+        "prompt": prompt,
+        "image_path": image_path,
+        "ply_path": ply_path,
+        "metadata_path": metadata_path,
+        "server_url": "http://localhost:5000",
+        "cache_key": result_key if use_cache else None
+    }
+    job_journal.record(job)
+    try:
+        scheduler.submit(job)
+    except (QueueFullError, SchedulerShutdownError) as e:
+        # Record that the job was not admitted so pollers stop waiting
+        job_journal.finish(job_id)
+        job_store.update(job_id, {"status": "rejected", "error": str(e)})
+        if use_cache:
+            inflight_jobs.release(result_key, job_id)
+        status_code = 429 if isinstance(e, QueueFullError) else 503
+        response = jsonify({"error": str(e), "retry_after": e.retry_after})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, status_code
     
     return jsonify(initial_response)
 
-def process_generation(prompt, timestamp, image_path, ply_path, metadata_path):
+def update_metadata(job, updates):
     """
-    Function to handle the image and PLY generation in a background thread.
+    Merge updates into a job's metadata in the job store.
+    
+    Args:
+        job (dict): The pipeline job
+        updates (dict): Fields to set
     """
     try:
-        # Get server URL for file URLs
-        server_url = "http://localhost:5000"  # Default fallback
-        
-        # Update metadata to indicate image generation started
+        job_store.update(job["id"], updates)
+    except Exception as e:
+        print(f"Error updating metadata: {str(e)}")
+
+def release_inflight(job):
+    """Let new requests for the job's prompt start their own job again."""
+    if job.get("cache_key"):
+        inflight_jobs.release(job["cache_key"], job["id"])
+
+def job_cancelled(job):
+    """Return True if the job was cancelled through /jobs/<id>/cancel."""
+    metadata = job_store.get(job["id"]) or {}
+    return metadata.get("status") == "cancelled"
+
+def run_image_stage(job):
+    """
+    Pipeline stage 1: generate the image with GPT-Image-1 and save it.
+    """
+    if job_cancelled(job):
+        return None
+    
+    prompt = job["prompt"]
+    image_path = job["image_path"]
+    
+    # Update metadata to indicate image generation started
+    update_metadata(job, {"image_status": "generating"})
+    
+    print(f"Generating image for prompt: {prompt[:50]}...")
+    result = client.images.generate(
+        model=IMAGE_MODEL,
+        prompt=prompt,
+        n=1,
+        size=IMAGE_SIZE
+    )
+    
+    # Save the image, streamed to disk without decoding it
+    if hasattr(result.data[0], 'url') and result.data[0].url:
+        # Download from URL if available
+        image_format = download_image(result.data[0].url, image_path)
+    elif hasattr(result.data[0], 'b64_json') and result.data[0].b64_json:
+        # Decode the base64 encoded image incrementally
+        image_format = decode_base64_image(result.data[0].b64_json, image_path)
+    else:
+        return fail_missing_image(job)
+    return complete_image_stage(job, image_format)
+
+async def run_image_stage_async(job):
+    """
+    Pipeline stage 1 of the asyncio pipeline: generate the image with AsyncOpenAI and save it.
+    
+    Metadata and file access (SQLite in shared mode) run in worker threads.
+    """
+    if await asyncio.to_thread(job_cancelled, job):
+        return None
+    
+    prompt = job["prompt"]
+    image_path = job["image_path"]
+    
+    await asyncio.to_thread(update_metadata, job, {"image_status": "generating"})
+    
+    print(f"Generating image for prompt: {prompt[:50]}...")
+    result = await async_client.images.generate(
+        model=IMAGE_MODEL,
+        prompt=prompt,
+        n=1,
+        size=IMAGE_SIZE
+    )
+    
+    if hasattr(result.data[0], 'url') and result.data[0].url:
+        image_format = await download_image_async(result.data[0].url, image_path)
+    elif hasattr(result.data[0], 'b64_json') and result.data[0].b64_json:
+        image_format = await asyncio.to_thread(decode_base64_image, result.data[0].b64_json, image_path)
+    else:
+        return await asyncio.to_thread(fail_missing_image, job)
+    return await asyncio.to_thread(complete_image_stage, job, image_format)
+
+def fail_missing_image(job):
+    """Fail a job whose image response contained no image data."""
+    print("No image data found in the response")
+    # Update metadata to indicate image generation failed
+    update_metadata(job, {
+        "image_status": "failed",
+        "status": "failed",
+        "error": "No image data found in the response"
+    })
+    release_inflight(job)
+    return None
+
+def complete_image_stage(job, image_format):
+    """Index and hash a saved image and record it in the job's metadata."""
+    image_path = job["image_path"]
+    asset_index.add(image_path)
+    image_digest = file_sha256(image_path)
+    asset_refs.add(image_digest, job["id"])
+    derivative_cache.prewarm(image_path, DERIVATIVE_PREWARM)
+    
+    # Update metadata to indicate image generation complete
+    image_filename = os.path.basename(image_path)
+    update_metadata(job, {
+        "image_status": "completed",
+        "image_digest": image_digest,
+        "image_format": image_format,
+        "image_path": image_path,
+        "image_url": f"{job['server_url']}/files/{image_filename}"
+    })
+    return job
+
+# "async" submits reconstructions and lets the supervisor track them,
+# "blocking" keeps a ply worker busy for the whole reconstruction
+PLY_SUBMIT_MODE = os.environ.get("PLY_SUBMIT_MODE", "async")
+ply_supervisor = PlySupervisor(
+    poll_interval=float(os.environ.get("PLY_POLL_INTERVAL", 2)),
+    max_failures=int(os.environ.get("PLY_POLL_MAX_FAILURES", 5))
+)
+
+def run_ply_stage(job):
+    """
+    Pipeline stage 2: reconstruct a PLY from the image with Invisible Stitch.
+    
+    In async mode the reconstruction is only submitted here; the supervisor
+    reports its queue position and ETA and resumes the job once it is done.
+    A failed reconstruction is recorded in the metadata but does not fail the job.
+    """
+    if job_cancelled(job):
+        return None
+    
+    # Update metadata to indicate PLY generation started
+    update_metadata(job, {"ply_status": "generating"})
+    
+    print(f"Generating 3D model from image: {job['image_path']}...")
+    if PLY_SUBMIT_MODE == "async":
+        # Blocks while all pooled clients are busy, which bounds the
+        # reconstructions outstanding at the Gradio app
         try:
-            with open(metadata_path, 'r') as f:
-                metadata = json.load(f)
-            metadata["image_status"] = "generating"
-            with open(metadata_path, 'w') as f:
-                json.dump(metadata, f, indent=4)
+            handle = submit_ply(job["image_path"], job["prompt"], job["ply_path"])
         except Exception as e:
-            print(f"Error updating metadata: {str(e)}")
+            record_ply_error(job, e)
+            return job
         
-        # Step 1: Generate image with GPT-Image-1
-        print(f"Generating image for prompt: {prompt[:50]}...")
-        result = client.images.generate(
-            model="gpt-image-1",
-            prompt=prompt,
-            n=1,
-            size="1024x1024"
+        def on_status(status):
+            record_ply_status(job, status)
+            # Cancelled through another server process
+            if job_cancelled(job):
+                ply_supervisor.cancel(job["id"])
+        
+        ply_supervisor.watch(job["id"], handle, on_status, lambda handle: finish_ply_job(job, handle),
+                             lambda handle, error: abandon_ply_job(job, error))
+        if job_cancelled(job):
+            # Cancelled while waiting for a free client
+            ply_supervisor.cancel(job["id"])
+        return DEFERRED
+    
+    try:
+        job["final_ply_path"] = generate_ply(
+            job["image_path"],
+            job["prompt"],
+            job["ply_path"]
+        )
+        asset_index.add(job["final_ply_path"])
+        print(f"PLY generation successful: {job['final_ply_path']}")
+    except Exception as e:
+        record_ply_error(job, e)
+    return job
+
+async def run_ply_stage_async(job):
+    """
+    Pipeline stage 2 of the asyncio pipeline: reconstruct a PLY, polling Invisible Stitch from the event loop.
+    """
+    if await asyncio.to_thread(job_cancelled, job):
+        return None
+    
+    await asyncio.to_thread(update_metadata, job, {"ply_status": "generating"})
+    
+    print(f"Generating 3D model from image: {job['image_path']}...")
+    try:
+        final_ply_path = await generate_ply_async(
+            job["image_path"],
+            job["prompt"],
+            job["ply_path"],
+            on_status=lambda status: record_ply_status(job, status),
+            should_cancel=lambda: job_cancelled(job),
+            poll_interval=float(os.environ.get("PLY_POLL_INTERVAL", 2))
+        )
+    except Exception as e:
+        await asyncio.to_thread(record_ply_error, job, e)
+        return job
+    
+    if final_ply_path is None:
+        print(f"PLY generation cancelled for ID: {job['id']}")
+        return None
+    job["final_ply_path"] = final_ply_path
+    await asyncio.to_thread(asset_index.add, final_ply_path)
+    print(f"PLY generation successful: {final_ply_path}")
+    return job
+
+def record_ply_status(job, status):
+    """Record the queue position and ETA of a running reconstruction."""
+    update_metadata(job, {
+        "ply_queue_position": status["queue_position"],
+        "ply_queue_size": status["queue_size"],
+        "ply_eta": status["eta"],
+        "ply_progress": status["code"].lower()
+    })
+
+def record_ply_error(job, error):
+    """Record a failed reconstruction in the job and its metadata."""
+    job["ply_error"] = str(error)
+    print(f"Error generating PLY: {job['ply_error']}")
+    
+    # Update metadata to indicate PLY generation failed
+    update_metadata(job, {
+        "ply_status": "failed",
+        "ply_error": job["ply_error"]
+    })
+
+def finish_ply_job(job, handle):
+    """
+    Collect a supervised reconstruction and pass the job on to the upload stage.
+    
+    Args:
+        job (dict): The pipeline job
+        handle (PlyJobHandle): The finished reconstruction
+    """
+    if handle.cancelled() or job_cancelled(job):
+        print(f"PLY generation cancelled for ID: {job['id']}")
+        record_transition(job, "ply", None)
+        scheduler.resume(job, None)
+        return
+    
+    try:
+        job["final_ply_path"] = handle.result()
+        asset_index.add(job["final_ply_path"])
+        print(f"PLY generation successful: {job['final_ply_path']}")
+    except Exception as e:
+        record_ply_error(job, e)
+    record_transition(job, "ply", job)
+    scheduler.resume(job, job)
+
+def abandon_ply_job(job, error):
+    """
+    Fail a job whose reconstruction could no longer be polled.
+    
+    Args:
+        job (dict): The pipeline job
+        error (Exception): The last polling error
+    """
+    record_ply_error(job, error)
+    scheduler.resume(job, error=Exception(f"Lost track of the reconstruction: {str(error)}"))
+
+# Rewrite PLYs as little-endian binary with precompressed (.br/.gz) copies
+PLY_OPTIMIZE = os.environ.get("PLY_OPTIMIZE", "true").lower() in ("1", "true", "yes")
+PLY_QUANTIZE_BITS = int(os.environ.get("PLY_QUANTIZE_BITS", 0))
+PLY_QUANTIZE_COLORS = os.environ.get("PLY_QUANTIZE_COLORS", "").lower() in ("1", "true", "yes")
+PLY_COMPRESSION = [coding.strip() for coding in os.environ.get("PLY_COMPRESSION", "br,gzip").split(",") if coding.strip()]
+PLY_BROTLI_QUALITY = int(os.environ.get("PLY_BROTLI_QUALITY", 5))
+# Coarse-to-fine point subsets streamed to the viewer (fewer than 2 disables them)
+PLY_LOD_LEVELS = int(os.environ.get("PLY_LOD_LEVELS", 4))
+PLY_LOD_BASE_RESOLUTION = int(os.environ.get("PLY_LOD_BASE_RESOLUTION", 32))
+
+def run_optimize_stage(job):
+    """
+    Pipeline stage 3: normalize the PLY to binary, write compressed copies and LOD levels.
+    
+    A PLY that cannot be processed is kept and served as it is.
+    """
+    if job_cancelled(job):
+        return None
+    
+    final_ply_path = job.get("final_ply_path")
+    if not final_ply_path or not os.path.exists(final_ply_path):
+        return job
+    
+    if PLY_OPTIMIZE and not optimize_job_ply(job, final_ply_path):
+        return job
+    if PLY_LOD_LEVELS > 1:
+        build_job_lods(job, final_ply_path)
+    return job
+
+def optimize_job_ply(job, final_ply_path):
+    """
+    Normalize a job's PLY and write its compressed copies.
+    
+    Returns:
+        bool: False if the PLY could not be processed
+    """
+    update_metadata(job, {"ply_optimize_status": "optimizing"})
+    try:
+        result = optimize_ply(
+            final_ply_path,
+            position_bits=PLY_QUANTIZE_BITS,
+            quantize_colors=PLY_QUANTIZE_COLORS,
+            encodings=PLY_COMPRESSION,
+            brotli_quality=PLY_BROTLI_QUALITY
+        )
+    except Exception as e:
+        print(f"Error optimizing PLY, keeping the original: {str(e)}")
+        update_metadata(job, {"ply_optimize_status": "failed", "ply_optimize_error": str(e)})
+        return False
+    
+    asset_index.add(final_ply_path)
+    for variant in result["variants"].values():
+        asset_index.add(variant["path"])
+    print(f"Optimized PLY: {result['original_bytes']} -> {result['bytes']} bytes, "
+          + ", ".join(f"{coding} {variant['bytes']}" for coding, variant in result["variants"].items()))
+    
+    update_metadata(job, {
+        "ply_optimize_status": "completed",
+        "ply_original_bytes": result["original_bytes"],
+        "ply_bytes": result["bytes"],
+        "ply_encoded_bytes": {coding: variant["bytes"] for coding, variant in result["variants"].items()}
+    })
+    return True
+
+def build_job_lods(job, final_ply_path):
+    """Write the LOD levels of a job's PLY and record them in the metadata."""
+    try:
+        lods = build_lods(
+            final_ply_path,
+            levels=PLY_LOD_LEVELS,
+            base_resolution=PLY_LOD_BASE_RESOLUTION,
+            encodings=PLY_COMPRESSION,
+            brotli_quality=PLY_BROTLI_QUALITY
         )
+    except Exception as e:
+        print(f"Error building PLY levels of detail: {str(e)}")
+        update_metadata(job, {"ply_lod_error": str(e)})
+        return
+    
+    for lod in lods:
+        asset_index.add(lod["path"])
+        for variant_path in lod["variants"].values():
+            asset_index.add(variant_path)
+    lod_url = f"{job['server_url']}/plys/{job['id']}/lod"
+    update_metadata(job, {
+        "ply_lod_url": lod_url,
+        "ply_lods": [
+            {"level": lod["level"], "url": f"{lod_url}/{lod['level']}", "vertices": lod["vertices"], "bytes": lod["bytes"]}
+            for lod in lods
+        ]
+    })
+
+def run_upload_stage(job):
+    """
+    Pipeline stage 4: upload the PLY to cloud storage (if available).
+    """
+    if job_cancelled(job):
+        return None
+    
+    final_ply_path = job.get("final_ply_path")
+    if not final_ply_path or not os.path.exists(final_ply_path):
+        return job
+    
+    # Update metadata to indicate PLY upload started
+    update_metadata(job, {"ply_upload_status": "uploading", "ply_replication_status": "replicating"})
+    
+    storage_result = None
+    try:
+        provider_name, storage_result = storage_fanout.upload(final_ply_path, on_replicated=replication_callback(job))
+        print(f"Successfully uploaded PLY to {provider_name} storage")
+    except Exception as e:
+        record_upload_error(job, e)
+    return finish_upload(job, final_ply_path, storage_result)
+
+async def run_upload_stage_async(job):
+    """
+    Pipeline stage 4 of the asyncio pipeline: upload the PLY with the asyncio storage clients.
+    """
+    if await asyncio.to_thread(job_cancelled, job):
+        return None
+    
+    final_ply_path = job.get("final_ply_path")
+    if not final_ply_path or not await asyncio.to_thread(os.path.exists, final_ply_path):
+        return job
+    
+    await asyncio.to_thread(update_metadata, job, {"ply_upload_status": "uploading", "ply_replication_status": "replicating"})
+    
+    storage_result = None
+    try:
+        provider_name, storage_result = await storage_fanout.upload_async(final_ply_path, on_replicated=replication_callback(job))
+        print(f"Successfully uploaded PLY to {provider_name} storage")
+    except Exception as e:
+        await asyncio.to_thread(record_upload_error, job, e)
+    return await asyncio.to_thread(finish_upload, job, final_ply_path, storage_result)
+
+def replication_callback(job):
+    """Return the callback recording a job's background replicas in its metadata."""
+    def on_replicated(replicas):
+        # Background copies on the remaining providers have finished
+        for replica in replicas.values():
+            path = (replica.get("result") or {}).get("path")
+            if path:
+                asset_index.add(path)
+        statuses = [replica["status"] for replica in replicas.values()]
+        update_metadata(job, {
+            "ply_replication_status": "completed" if all(status == "completed" for status in statuses) else "partial",
+            "ply_replicas": {
+                name: {"status": replica["status"], "url": (replica.get("result") or {}).get("url"), "error": replica.get("error")}
+                for name, replica in replicas.items()
+            }
+        })
+    return on_replicated
+
+def record_upload_error(job, error):
+    """Record that no storage provider could store the PLY."""
+    print(f"All storage providers failed: {str(error)}")
+    
+    # Update metadata to indicate upload failed
+    update_metadata(job, {
+        "ply_upload_status": "failed",
+        "ply_upload_error": str(error),
+        "ply_replication_status": "failed"
+    })
+
+def finish_upload(job, final_ply_path, storage_result):
+    """Index the stored PLY and count the job as a user of its content."""
+    if storage_result and storage_result.get("path"):
+        asset_index.add(storage_result["path"])
+    
+    # Count the job as a user of the PLY content (hashed once, cached per file)
+    ply_digest = (storage_result or {}).get("digest") or file_sha256(final_ply_path)
+    asset_refs.add(ply_digest, job["id"])
+    update_metadata(job, {"ply_digest": ply_digest})
+    
+    job["storage_result"] = storage_result
+    return job
+
+def run_finalize_stage(job):
+    """
+    Pipeline stage 5: final metadata update with complete results.
+    """
+    if job_cancelled(job):
+        return None
+    
+    server_url = job["server_url"]
+    final_ply_path = job.get("final_ply_path")
+    storage_result = job.get("storage_result")
+    
+    # Update status to completed
+    updates = {"status": "completed"}
+    
+    # If we have the PLY file, add its details
+    if final_ply_path:
+        ply_filename = os.path.basename(final_ply_path)
+        updates["ply_path"] = final_ply_path
+        updates["ply_url"] = f"{server_url}/files/{ply_filename}"
+        updates["ply_status"] = "completed"
         
-        # Save the image
-        if hasattr(result.data[0], 'url') and result.data[0].url:
-            # Download from URL if available
-            image_url = result.data[0].url
-            image_response = requests.get(image_url)
-            image = Image.open(BytesIO(image_response.content))
-            image.save(image_path)
-        elif hasattr(result.data[0], 'b64_json') and result.data[0].b64_json:
-            # Extract base64 encoded image
-            image_base64 = result.data[0].b64_json
-            image_bytes = base64.b64decode(image_base64)
+        # Add storage details if upload was successful
+        if storage_result:
+            updates["ply_upload_status"] = "completed"
+            storage = {
+                "provider": storage_result.get("provider"),
+                "url": storage_result.get("url"),
+                # True if the content was already stored and no bytes were sent
+                "deduplicated": storage_result.get("deduplicated", False)
+            }
             
-            # Save the image to a file
-            with open(image_path, "wb") as f:
-                f.write(image_bytes)
-        else:
-            print("No image data found in the response")
-            # Update metadata to indicate image generation failed
-            try:
-                with open(metadata_path, 'r') as f:
-                    metadata = json.load(f)
-                metadata["image_status"] = "failed"
-                metadata["status"] = "failed"
-                metadata["error"] = "No image data found in the response"
-                with open(metadata_path, 'w') as f:
-                    json.dump(metadata, f, indent=4)
-            except Exception as e:
-                print(f"Error updating metadata: {str(e)}")
-            return
+            # Add provider-specific details
+            if storage_result.get("provider") == "s3":
+                storage["bucket"] = storage_result.get("bucket")
+                storage["key"] = storage_result.get("key")
+            elif storage_result.get("provider") == "vercel-blob":
+                storage["pathname"] = storage_result.get("pathname")
+            elif storage_result.get("provider") == "local":
+                storage_filename = os.path.basename(storage_result.get("path", ""))
+                storage["local_url"] = f"{server_url}/files/{storage_filename}"
+            updates["storage"] = storage
+    elif not job.get("ply_error"):
+        updates["ply_status"] = "not_generated"
+    
+    # Save the final metadata
+    update_metadata(job, updates)
+    
+    # Only complete results (image and PLY) are worth reusing
+    if job.get("cache_key") and updates.get("ply_status") == "completed":
+        metadata = job_store.get(job["id"]) or {}
+        cached = {field: metadata[field] for field in CACHED_RESULT_FIELDS if field in metadata}
+        result_cache.put(job["cache_key"], dict(cached, job_id=job["id"]))
+        # The cache entry keeps the content alive until it is dropped
+        owner = cache_ref_owner(job["cache_key"])
+        asset_refs.release(owner)
+        for field in ("image_digest", "ply_digest"):
+            if cached.get(field):
+                asset_refs.add(cached[field], owner)
+    release_inflight(job)
+    print(f"Generation process completed for ID: {job['id']}")
+    return job
+
+def fail_job(job, stage_name, error):
+    """
+    Record an unexpected stage error in the job's metadata.
+    """
+    print(f"Error in background processing ({stage_name} stage): {str(error)}")
+    update_metadata(job, {
+        "status": "failed",
+        "error": str(error)
+    })
+    release_inflight(job)
+    asset_refs.release(job["id"])
+    finish_journal(job)
+
+PIPELINE_STAGES = ("image", "ply", "optimize", "upload", "finalize")
+
+def record_transition(job, stage_name, result):
+    """
+    Record in the job journal that a stage is done with a job.
+    
+    Args:
+        job (dict): The pipeline job
+        stage_name (str): Name of the stage
+        result: The stage's result (the job, None if the job was dropped, or DEFERRED)
+    """
+    if result is DEFERRED:
+        return
+    if result is None or stage_name == PIPELINE_STAGES[-1]:
+        if result is None and job_cancelled(job):
+            # Stages that were running when the job was cancelled may have added references
+            asset_refs.release(job["id"])
+        finish_journal(job)
+        return
+    try:
+        job_journal.record(result, stage_name)
+    except Exception as e:
+        print(f"Error writing job journal: {str(e)}")
+
+def finish_journal(job):
+    """Remove a job that left the pipeline from the job journal."""
+    try:
+        job_journal.finish(job["id"])
+    except Exception as e:
+        print(f"Error writing job journal: {str(e)}")
+
+def journaled(stage_name, func):
+    """Wrap a stage function so its transitions are recorded in the job journal."""
+    def run(job):
+        result = func(job)
+        record_transition(job, stage_name, result)
+        return result
+    return run
+
+def journaled_async(stage_name, func):
+    """Wrap a stage coroutine function so its transitions are recorded in the job journal."""
+    async def run(job):
+        result = await func(job)
+        await asyncio.to_thread(record_transition, job, stage_name, result)
+        return result
+    return run
+
+# Pipelined scheduler: every stage has its own queue and worker pool
+if PIPELINE_MODE == "asyncio":
+    # PLY processing and the final metadata update are blocking work
+    async def run_optimize_stage_async(job):
+        return await asyncio.to_thread(run_optimize_stage, job)
+    
+    async def run_finalize_stage_async(job):
+        return await asyncio.to_thread(run_finalize_stage, job)
+    
+    scheduler = create_async_scheduler_from_env([
+        (name, journaled_async(name, func)) for name, func in zip(PIPELINE_STAGES, (
+            run_image_stage_async,
+            run_ply_stage_async,
+            run_optimize_stage_async,
+            run_upload_stage_async,
+            run_finalize_stage_async
+        ))
+    ], on_error=fail_job)
+else:
+    scheduler = create_scheduler_from_env([
+        (name, journaled(name, func)) for name, func in zip(PIPELINE_STAGES, (
+            run_image_stage,
+            run_ply_stage,
+            run_optimize_stage,
+            run_upload_stage,
+            run_finalize_stage
+        ))
+    ], on_error=fail_job)
+print(f"Job pipeline running on {PIPELINE_MODE}.")
+
+def resume_stage(job, completed_stage):
+    """
+    Return the stage an interrupted job continues with.
+    
+    A stage counts as done if the journal says so or if its output file
+    exists (the process may have died before the journal was updated), so
+    no image is generated and no PLY reconstructed twice. The bookkeeping
+    of a stage whose output was found that way is redone here.
+    
+    Args:
+        job (dict): The pipeline job from the journal
+        completed_stage (str): Last completed stage, or None
         
-        # Update metadata to indicate image generation complete
-        image_filename = os.path.basename(image_path)
-        server_image_url = f"{server_url}/files/{image_filename}"
+    Returns:
+        str: Name of the stage to continue with
+    """
+    start = PIPELINE_STAGES.index(completed_stage) + 1 if completed_stage else 0
+    ply_file = job["ply_path"] + ".ply"
+    
+    if start <= 1 and os.path.exists(job["image_path"]):
+        if start == 0:
+            with open(job["image_path"], "rb") as f:
+                complete_image_stage(job, detect_image_format(f.read(16)))
+        start = 1
+    if start <= 2 and os.path.exists(ply_file):
+        if not job.get("final_ply_path"):
+            job["final_ply_path"] = ply_file
+            asset_index.add(ply_file)
+        start = 2
+    return PIPELINE_STAGES[start]
+
+def resume_unfinished_jobs():
+    """
+    Resume the jobs that server processes which are no longer running left unfinished.
+    """
+    # One process at a time, so two starting workers cannot claim the same job
+    with file_lock(os.path.join(os.environ.get("RESULT_CACHE_DIR", "cache"), "startup.lock")):
+        orphans = job_journal.claim_orphans()
+    
+    for job, completed_stage in orphans:
+        metadata = job_store.get(job["id"])
+        if metadata is not None and metadata.get("status") in FINAL_JOB_STATUSES:
+            # Finished (or cancelled) just before the process stopped
+            finish_journal(job)
+            continue
+        if metadata is None:
+            # The write-behind of the metadata did not happen before the process stopped
+            job_store.create(job["id"], {"id": job["id"], "prompt": job["prompt"], "metadata_path": job["metadata_path"]})
         try:
-            with open(metadata_path, 'r') as f:
-                metadata = json.load(f)
-            metadata["image_status"] = "completed"
-            metadata["image_path"] = image_path
-            metadata["image_url"] = server_image_url
-            with open(metadata_path, 'w') as f:
-                json.dump(metadata, f, indent=4)
+            stage_name = resume_stage(job, completed_stage)
         except Exception as e:
-            print(f"Error updating metadata: {str(e)}")
-        
-        # Step 2: Generate PLY using the get_ply function
-        ply_error = None
-        final_ply_path = None
+            fail_job(job, "resume", e)
+            continue
+        update_metadata(job, {"status": "processing", "resumed_at_stage": stage_name})
+        print(f"Resuming job {job['id']} at the {stage_name} stage")
+        scheduler.restore(job, stage_name)
+SHUTDOWN_DRAIN_TIMEOUT = float(os.environ.get("SHUTDOWN_DRAIN_TIMEOUT", 300))
+
+def drain_scheduler():
+    """Stop accepting jobs and let the admitted ones finish before exiting."""
+    print("Draining job pipeline before shutdown...")
+    if scheduler.shutdown(wait=True, timeout=SHUTDOWN_DRAIN_TIMEOUT):
+        print("All jobs drained.")
+    else:
+        print("Timed out while draining jobs; unfinished jobs are resumed on the next start.")
+    job_store.close()
+    result_cache.flush()
+    derivative_cache.shutdown()
+
+atexit.register(drain_scheduler)
+
+def derivative_response(path):
+    """
+    Serve a resized or re-encoded variant of an image if the request asks for one.
+    
+    Args:
+        path (str): Path of the source image
         
-        # Update metadata to indicate PLY generation started
-        try:
-            with open(metadata_path, 'r') as f:
-                metadata = json.load(f)
-            metadata["ply_status"] = "generating"
-            with open(metadata_path, 'w') as f:
-                json.dump(metadata, f, indent=4)
-        except Exception as e:
-            print(f"Error updating metadata: {str(e)}")
+    Returns:
+        Response: The derivative (or a 400 error), or None to serve the original
+    """
+    width = request.args.get("w")
+    image_format = request.args.get("fmt")
+    if not (width or image_format) or not path.lower().endswith(SOURCE_EXTENSIONS):
+        return None
+    
+    try:
+        width, image_format = derivative_cache.resolve(width, image_format, path)
+        relative_path = derivative_cache.get(path, width, image_format)
+    except DerivativeError as e:
+        return jsonify({"error": str(e)}), 400
+    # The name contains the source digest, so the derivative never changes
+    return send_asset(derivative_cache.cache_dir, relative_path)
+
+def locate_asset(filename):
+    """
+    Find a served file in the asset index, or on disk from its name.
+    
+    Files found on disk (e.g. written by another server process) are added
+    to the index.
+    
+    Args:
+        filename (str): Base name of the file
         
-        print(f"Generating 3D model from image: {image_path}...")
-        try:
-            final_ply_path = generate_ply(
-                image_path,
-                prompt,
-                ply_path
-            )
-            print(f"PLY generation successful: {final_ply_path}")
-        except Exception as e:
-            ply_error = str(e)
-            print(f"Error generating PLY: {ply_error}")
-            
-            # Update metadata to indicate PLY generation failed
-            try:
-                with open(metadata_path, 'r') as f:
-                    metadata = json.load(f)
-                metadata["ply_status"] = "failed"
-                metadata["ply_error"] = ply_error
-                with open(metadata_path, 'w') as f:
-                    json.dump(metadata, f, indent=4)
-            except Exception as e:
-                print(f"Error updating metadata: {str(e)}")
+    Returns:
+        dict: The file's asset index entry, or None if it does not exist
+    """
+    entry = asset_index.lookup(filename)
+    if entry is None:
+        directory, relative_path = layout.locate(filename)
+        path = os.path.join(directory, relative_path)
+        if os.path.isfile(path):
+            entry = asset_index.add(path)
+    return entry
+
+def asset_is_final(filename):
+    """
+    Check whether a file no longer changes under its name.
+    
+    A job's PLY, its levels of detail and their precompressed copies are
+    rewritten in place by the optimize stage (and again when an interrupted
+    job is resumed), so they only become final once the job has finished.
+    
+    Args:
+        filename (str): Base name of the file
         
-        # Step 3: Upload PLY to cloud storage (if available)
-        storage_result = None
-        if final_ply_path and os.path.exists(final_ply_path):
-            # Update metadata to indicate PLY upload started
-            try:
-                with open(metadata_path, 'r') as f:
-                    metadata = json.load(f)
-                metadata["ply_upload_status"] = "uploading"
-                with open(metadata_path, 'w') as f:
-                    json.dump(metadata, f, indent=4)
-            except Exception as e:
-                print(f"Error updating metadata: {str(e)}")
-                
-            # If Vercel token is available, try using the Vercel API
-            if VERCEL_BLOB_TOKEN:
-                try:
-                    print("Uploading PLY using Vercel API...")
-                    storage_result = upload_to_vercel_blob(
-                        file_path=final_ply_path,
-                        store_id="store_vO7lSadIHJFbCUIv",
-                        token=VERCEL_BLOB_TOKEN
-                    )
-                    print("Successfully uploaded PLY to Vercel Blob using API token")
-                except Exception as e:
-                    print(f"Error uploading to Vercel Blob API: {str(e)}")
-                    # Fall back to alternative storage methods
-            
-            # If Vercel API upload failed or no token was available, try alternative methods
-            if not storage_result:
-                print("Trying alternative storage methods...")
-                # Try each storage provider in order until one succeeds
-                last_error = None
-                for provider in storage_providers:
-                    try:
-                        storage_result = provider.upload_file(final_ply_path, content_type="application/octet-stream")
-                        print(f"Successfully uploaded PLY to {storage_result.get('provider')} storage")
-                        break
-                    except Exception as e:
-                        last_error = e
-                        print(f"Error uploading PLY to {provider.__class__.__name__}: {str(e)}")
-                        continue
-                
-                if not storage_result and last_error:
-                    print(f"All storage providers failed. Last error: {str(last_error)}")
-                    
-                    # Update metadata to indicate upload failed
-                    try:
-                        with open(metadata_path, 'r') as f:
-                            metadata = json.load(f)
-                        metadata["ply_upload_status"] = "failed"
-                        metadata["ply_upload_error"] = str(last_error)
-                        with open(metadata_path, 'w') as f:
-                            json.dump(metadata, f, indent=4)
-                    except Exception as e:
-                        print(f"Error updating metadata: {str(e)}")
+    Returns:
+        bool: Whether the file can be cached as immutable
+    """
+    match = ASSET_NAME_PATTERN.match(os.path.basename(filename))
+    if not match or match.group("ext") != "ply":
+        return True
+    metadata = job_store.get(match.group("id"))
+    return metadata is None or metadata.get("status") in FINAL_JOB_STATUSES
+
+def send_indexed_asset(filename, entry):
+    """
+    Send an indexed file, or the precompressed copy of it the client accepts.
+    
+    Args:
+        filename (str): Requested file name
+        entry (dict): The file's asset index entry
         
-        # Step 4: Final metadata update with complete results
-        try:
-            with open(metadata_path, 'r') as f:
-                metadata = json.load(f)
-            
-            # Update status to completed
-            metadata["status"] = "completed"
-            
-            # If we have the PLY file, add its details
-            if final_ply_path:
-                ply_filename = os.path.basename(final_ply_path)
-                server_ply_url = f"{server_url}/files/{ply_filename}"
-                
-                metadata["ply_path"] = final_ply_path
-                metadata["ply_url"] = server_ply_url
-                metadata["ply_status"] = "completed"
-                
-                # Add storage details if upload was successful
-                if storage_result:
-                    metadata["ply_upload_status"] = "completed"
-                    metadata["storage"] = {
-                        "provider": storage_result.get("provider"),
-                        "url": storage_result.get("url")
-                    }
-                    
-                    # Add provider-specific details
-                    if storage_result.get("provider") == "s3":
-                        metadata["storage"]["bucket"] = storage_result.get("bucket")
-                        metadata["storage"]["key"] = storage_result.get("key")
-                    elif storage_result.get("provider") == "vercel-blob":
-                        metadata["storage"]["pathname"] = storage_result.get("pathname")
-                    elif storage_result.get("provider") == "local":
-                        storage_filename = os.path.basename(storage_result.get("path", ""))
-                        metadata["storage"]["local_url"] = f"{server_url}/files/{storage_filename}"
-            else:
-                if not ply_error:
-                    metadata["ply_status"] = "not_generated"
-            
-            # Save the final metadata
-            with open(metadata_path, 'w') as f:
-                json.dump(metadata, f, indent=4)
-                
-            print(f"Generation process completed for ID: {timestamp}")
-            
-        except Exception as e:
-            print(f"Error updating final metadata: {str(e)}")
+    Returns:
+        Response: The file response
+    """
+    variants = {}
+    # Other processes' files are missing from this process's index
+    lookup = locate_asset if SHARED_STATE else asset_index.lookup
+    if not filename.endswith(tuple(PRECOMPRESSED_EXTENSIONS.values())):
+        for coding, extension in PRECOMPRESSED_EXTENSIONS.items():
+            variant = lookup(filename + extension)
+            if variant is not None:
+                variants[coding] = variant
     
-    except Exception as e:
-        print(f"Error in background processing: {str(e)}")
-        # Try to update metadata with error
-        try:
-            with open(metadata_path, 'r') as f:
-                metadata = json.load(f)
-            metadata["status"] = "failed"
-            metadata["error"] = str(e)
-            with open(metadata_path, 'w') as f:
-                json.dump(metadata, f, indent=4)
-        except:
-            print("Could not update metadata with error")
+    coding = preferred_encoding(request.headers.get("Accept-Encoding", ""), variants) if variants else None
+    immutable = asset_is_final(filename)
+    if coding:
+        variant = variants[coding]
+        response = send_asset(variant["directory"], variant["relative_path"], immutable=immutable,
+                              stat_key=(variant["size"], variant["mtime"]), on_stale=asset_index.add,
+                              content_encoding=coding, mimetype=entry["content_type"])
+    else:
+        response = send_asset(entry["directory"], entry["relative_path"], immutable=immutable,
+                              stat_key=(entry["size"], entry["mtime"]), on_stale=asset_index.add)
+    if variants:
+        response.vary.add("Accept-Encoding")
+    return response
 
 # Add routes for serving files directly from the server
 @app.route('/files/<path:filename>')
@@ -344,45 +1110,182 @@ def serve_file(filename):
     Serve files from various directories based on the file extension or path.
     This is a unified endpoint that will look for the file in all appropriate directories.
     """
-    # First check if the file exists in plys directory
-    if os.path.exists(os.path.join(plys_dir, filename)):
-        return send_from_directory(plys_dir, filename)
-    
-    # Then check if it exists in images directory
-    elif os.path.exists(os.path.join(images_dir, filename)):
-        return send_from_directory(images_dir, filename)
-    
-    # Finally check if it exists in storage directory
-    elif os.path.exists(os.path.join('storage', filename)):
-        return send_from_directory('storage', filename)
+    # Known files are served straight from the in-memory index,
+    # otherwise the file name determines the directory and shard
+    entry = locate_asset(filename)
+    if entry is None:
+        return jsonify({"error": f"File not found: {filename}"}), 404
     
-    # If the file doesn't exist in any of these directories, return 404
-    else:
+    try:
+        derivative = derivative_response(entry["path"])
+        if derivative is not None:
+            return derivative
+        return send_indexed_asset(filename, entry)
+    except (FileNotFoundError, NotFound):
+        # Deleted behind the index's back
+        asset_index.remove(filename)
         return jsonify({"error": f"File not found: {filename}"}), 404
 
 @app.route('/metadata/<path:filename>')
 def serve_metadata(filename):
-    """Serve a metadata file from the metadata directory."""
-    if os.path.exists(os.path.join(metadata_dir, filename)):
-        return send_from_directory(metadata_dir, filename)
-    else:
+    """Serve a job's metadata from the in-memory job store."""
+    job_id = job_id_from_filename(filename)
+    metadata = job_store.get(job_id) if job_id else None
+    if metadata is None:
         return jsonify({"error": f"Metadata file not found: {filename}"}), 404
+    return json_response(metadata)
+
+# Fields whose changes are pushed to /jobs/<id>/events subscribers
+EVENT_STATUS_FIELDS = ("status", "image_status", "ply_status", "ply_upload_status",
+                       "ply_progress", "ply_queue_position", "ply_eta")
+FINAL_JOB_STATUSES = ("completed", "failed", "rejected", "cancelled", "coalesced")
+EVENT_KEEPALIVE_INTERVAL = float(os.environ.get("EVENT_KEEPALIVE_INTERVAL", 15))
+# Each stream holds a server thread, so it is closed after this many seconds
+# and the browser reconnects (with Last-Event-ID) after EVENT_RETRY_MS
+EVENT_STREAM_LIFETIME = float(os.environ.get("EVENT_STREAM_LIFETIME", 25))
+EVENT_RETRY_MS = 1000
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """
+    Stream a job's metadata as Server-Sent Events.
+    
+    The current metadata is sent immediately (unless the client reconnects
+    with the current version as Last-Event-ID), then again whenever one of
+    the status fields changes. The stream ends once the job has finished, or
+    with a `reconnect` event after EVENT_STREAM_LIFETIME seconds.
+    """
+    metadata, version = job_store.get_with_version(job_id)
+    if metadata is None:
+        return jsonify({"error": f"Job not found: {job_id}"}), 404
+    
+    def event_stream(metadata, version, last_event_id):
+        last_status = None
+        if last_event_id == str(version) and metadata.get("status") not in FINAL_JOB_STATUSES:
+            # The client already has this version
+            last_status = tuple(metadata.get(field) for field in EVENT_STATUS_FIELDS)
+        closes_at = time.monotonic() + EVENT_STREAM_LIFETIME
+        yield f"retry: {EVENT_RETRY_MS}\n\n"
+        while metadata is not None:
+            status = tuple(metadata.get(field) for field in EVENT_STATUS_FIELDS)
+            if status != last_status:
+                last_status = status
+                yield f"id: {version}\nevent: status\ndata: {json.dumps(metadata)}\n\n"
+                if metadata.get("status") in FINAL_JOB_STATUSES:
+                    return
+            
+            remaining = closes_at - time.monotonic()
+            if remaining <= 0:
+                # Frees the thread; the client reconnects to continue
+                yield "event: reconnect\ndata: {}\n\n"
+                return
+            new_metadata, new_version = job_store.wait_for_change(
+                job_id, version, min(EVENT_KEEPALIVE_INTERVAL, remaining)
+            )
+            if new_version == version and time.monotonic() < closes_at:
+                # Comment line keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+            metadata, version = new_metadata, new_version
+    
+    response = Response(event_stream(metadata, version, request.headers.get("Last-Event-ID")),
+                        mimetype='text/event-stream')
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """
+    Cancel a job that has not finished yet.
+    
+    A queued or running reconstruction is cancelled at the Gradio app; the
+    remaining pipeline stages skip the job.
+    """
+    metadata = job_store.get(job_id)
+    if metadata is None:
+        return jsonify({"error": f"Job not found: {job_id}"}), 404
+    if metadata.get("status") in FINAL_JOB_STATUSES:
+        return jsonify({"error": f"Job already {metadata.get('status')}", "status": metadata.get("status")}), 409
+    
+    updates = {"status": "cancelled"}
+    if metadata.get("ply_status") == "generating":
+        updates["ply_status"] = "cancelled"
+    job_store.update(job_id, updates)
+    ply_supervisor.cancel(job_id)
+    inflight_jobs.release(cache_key(metadata.get("prompt", ""), GENERATION_PARAMS), job_id)
+    asset_refs.release(job_id)
+    print(f"Cancelled job {job_id}")
+    return jsonify({"success": True, "id": job_id, "status": "cancelled"})
 
 # Also keep specific endpoints for backward compatibility
 @app.route('/plys/<path:filename>')
 def serve_ply(filename):
     """Serve a PLY file from the plys directory."""
-    return send_from_directory(plys_dir, filename)
+    return send_asset(plys_dir, sharded_relative_path(filename), immutable=asset_is_final(filename))
+
+@app.route('/plys/<job_id>/lod')
+def serve_ply_lods(job_id):
+    """List a job's PLY levels of detail, coarsest first."""
+    metadata = job_store.get(job_id)
+    if metadata is None or not metadata.get("ply_lods"):
+        return jsonify({"error": f"No levels of detail for job: {job_id}"}), 404
+    return json_response({"id": job_id, "levels": metadata["ply_lods"]})
+
+@app.route('/plys/<job_id>/lod/<int:level>')
+def serve_ply_lod(job_id, level):
+    """Serve one PLY level of detail (only the points it adds to the coarser levels)."""
+    filename = os.path.basename(lod_path(f"generated_{job_id}.ply", level))
+    entry = locate_asset(filename)
+    if entry is None:
+        return jsonify({"error": f"Level of detail not found: {job_id}/{level}"}), 404
+    return send_indexed_asset(filename, entry)
 
 @app.route('/images/<path:filename>')
 def serve_image(filename):
-    """Serve an image file from the images directory."""
-    return send_from_directory(images_dir, filename)
+    """Serve an image file (or a derivative of it, see /files) from the images directory."""
+    path = os.path.join(images_dir, sharded_relative_path(filename))
+    if os.path.isfile(path):
+        derivative = derivative_response(path)
+        if derivative is not None:
+            return derivative
+    return send_asset(images_dir, sharded_relative_path(filename))
 
 @app.route('/storage/<path:filename>')
 def serve_storage(filename):
     """Serve a file from the storage directory (local fallback storage)."""
-    return send_from_directory('storage', filename)
+    return send_asset(storage_dir, sharded_relative_path(filename))
+
+@app.route('/stats')
+def stats():
+    """Return the pipeline state (per-stage queue depth, workers, latencies) and cache/coalescing counters."""
+    pipeline_stats = scheduler.stats()
+    pipeline_stats["result_cache"] = result_cache.stats()
+    pipeline_stats["single_flight"] = inflight_jobs.stats()
+    pipeline_stats["gradio_pool"] = get_client_pool().stats()
+    pipeline_stats["ply_supervisor"] = ply_supervisor.stats()
+    pipeline_stats["storage"] = storage_fanout.stats()
+    pipeline_stats["storage"]["content_addressed"] = CONTENT_ADDRESSED_STORAGE
+    pipeline_stats["storage"]["asset_references"] = asset_refs.stats()
+    pipeline_stats["image_derivatives"] = derivative_cache.stats()
+    pipeline_stats["journal"] = job_journal.stats()
+    pipeline_stats["process"] = {"pid": os.getpid(), "job_store": JOB_STORE, "pipeline_mode": PIPELINE_MODE}
+    return jsonify(pipeline_stats)
+
+# Waits for queue slots, so it must not hold up the startup
+threading.Thread(target=resume_unfinished_jobs, name="job-resume", daemon=True).start()
+
+def create_app():
+    """
+    Return the Flask application, for WSGI servers (see wsgi.py and gunicorn.conf.py).
+    
+    The application and its job pipeline are set up when this module is
+    imported, i.e. once in every worker process.
+    """
+    return app
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Turn SIGTERM into a normal exit so the job queue is drained
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # The reloader would import this module again in a child process and run a
+    # second job pipeline, derivative pool and job resume next to this one
+    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
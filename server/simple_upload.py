@@ -5,7 +5,8 @@ A simplified version of the Vercel Blob uploader to debug the issue.
 import os
 import sys
 import time
-import requests
+import http_client
+from upload_streaming import FileBody
 
 def main():
     if len(sys.argv) < 2:
@@ -31,10 +32,8 @@ def main():
     # Full URL for the upload
     upload_url = f"{blob_url}/{unique_filename}"
     
-    # Read the file
-    print(f"Reading file: {file_path}")
-    with open(file_path, 'rb') as f:
-        file_content = f.read()
+    # Stream the file instead of reading it into memory
+    body = FileBody(file_path)
     
     # Set headers
     headers = {
@@ -43,15 +42,15 @@ def main():
     }
     
     # Additional info for debugging
-    print(f"File size: {len(file_content)} bytes")
+    print(f"File size: {len(body)} bytes")
     print(f"Upload URL: {upload_url}")
     print(f"Headers: {headers}")
     
     # Make the request
     print("Making PUT request...")
-    response = requests.put(
+    response = http_client.put(
         upload_url,
-        data=file_content,
+        data=body,
         headers=headers
     )
     
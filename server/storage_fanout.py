@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+"""
+Concurrent uploads to several storage providers with circuit breakers.
+
+In fan-out mode a file is uploaded to all primary providers at once and the
+first successful upload is returned immediately; the remaining uploads (and
+the fallback providers, e.g. local storage) keep running in the background as
+replicas, and a callback reports their outcome when all of them finished.
+Fallback providers are only waited for when every primary provider failed.
+Sequential mode tries the providers one after another, as before.
+
+Every provider has a circuit breaker: after a number of consecutive failures
+the provider is skipped for a while instead of slowing down every job, then a
+single trial upload decides whether it is used again.
+
+`upload_async` does the same from an asyncio event loop: providers with an
+asyncio upload function are awaited directly, the others run in worker
+threads, and the replicas are awaited by a background task.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class CircuitBreaker:
+    """
+    Tracks consecutive failures of one provider.
+
+    States: "closed" (provider used), "open" (provider skipped) and
+    "half_open" (one trial call allowed after the reset timeout).
+    """
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=60):
+        """
+        Initialize a closed breaker.
+
+        Args:
+            name (str): Provider name
+            failure_threshold (int): Consecutive failures that open the breaker
+            reset_timeout (float): Seconds before an open breaker allows a trial call
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0
+        self._skipped = 0
+
+    def allow(self):
+        """
+        Return True if the provider may be called now.
+
+        An open breaker lets exactly one call through once the reset timeout
+        has passed (half-open); its outcome closes or re-opens the breaker.
+        """
+        with self._lock:
+            if self._state == "closed":
+                return True
+            if self._state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = "half_open"
+                return True
+            self._skipped += 1
+            return False
+
+    def record_success(self):
+        """Close the breaker after a successful call."""
+        with self._lock:
+            self._state = "closed"
+            self._failures = 0
+
+    def record_failure(self):
+        """Count a failed call and open the breaker if the threshold is reached."""
+        with self._lock:
+            self._failures += 1
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                self._state = "open"
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        """Return the breaker state and counters."""
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "skipped": self._skipped
+            }
+
+
+class AllProvidersFailedError(Exception):
+    """Raised when no provider could store the file."""
+
+
+class StorageFanout:
+    """
+    Uploads files to a set of providers, concurrently or one by one.
+    """
+
+    def __init__(self, providers, mode="fanout", max_workers=8, failure_threshold=3, reset_timeout=60, async_uploads=None):
+        """
+        Initialize the fan-out and a circuit breaker per provider.
+
+        Args:
+            providers (list): (name, upload, fallback) tuples; upload(file_path)
+                              returns the provider's result dict, fallback marks
+                              providers that are only waited for when all
+                              primary providers failed
+            mode (str): "fanout" (race providers) or "sequential"
+            max_workers (int): Threads shared by all uploads
+            failure_threshold (int): Consecutive failures that open a breaker
+            reset_timeout (float): Seconds before an open breaker is tried again
+            async_uploads (dict, optional): Provider name -> coroutine function
+                                            used by upload_async instead of upload
+        """
+        self.providers = list(providers)
+        self.mode = mode
+        self.async_uploads = dict(async_uploads or {})
+        self.breakers = {
+            name: CircuitBreaker(name, failure_threshold, reset_timeout)
+            for name, _, _ in self.providers
+        }
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="storage-upload")
+        # Background replication tasks of upload_async (referenced until done)
+        self._replication_tasks = set()
+
+    def upload(self, file_path, on_replicated=None):
+        """
+        Store a file and return the first successful upload.
+
+        Args:
+            file_path (str): File to upload
+            on_replicated (callable, optional): Called as on_replicated(replicas)
+                when all background uploads finished; replicas maps provider
+                names to {"status": "completed"|"failed"|"skipped", "result"|"error"}
+
+        Returns:
+            tuple: (provider name, result dict) of the first successful upload
+
+        Raises:
+            AllProvidersFailedError: If every provider failed or was skipped
+        """
+        if self.mode == "sequential":
+            return self._upload_sequential(file_path)
+
+        replicas = {}
+        primaries = []
+        fallbacks = []
+        for name, upload, fallback in self.providers:
+            if not self.breakers[name].allow():
+                replicas[name] = {"status": "skipped", "error": "circuit open"}
+                continue
+            future = self._executor.submit(self._call, name, upload, file_path)
+            (fallbacks if fallback else primaries).append((name, future))
+
+        winner = self._first_success(primaries, replicas)
+        if winner is None:
+            # Every primary provider failed: wait for the fallbacks
+            winner = self._first_success(fallbacks, replicas)
+            if winner is None:
+                raise AllProvidersFailedError(_describe_failures(replicas))
+
+        pending = [(name, future) for name, future in primaries + fallbacks
+                   if name != winner[0] and name not in replicas]
+        self._replicate(pending, replicas, on_replicated)
+        return winner
+
+    async def upload_async(self, file_path, on_replicated=None):
+        """
+        Store a file from an asyncio event loop and return the first successful upload.
+
+        Args:
+            file_path (str): File to upload
+            on_replicated (callable, optional): Called as on_replicated(replicas)
+                when all background uploads finished (see upload)
+
+        Returns:
+            tuple: (provider name, result dict) of the first successful upload
+
+        Raises:
+            AllProvidersFailedError: If every provider failed or was skipped
+        """
+        if self.mode == "sequential":
+            failures = {}
+            for name, upload, _ in self.providers:
+                if not self.breakers[name].allow():
+                    failures[name] = {"status": "skipped", "error": "circuit open"}
+                    continue
+                try:
+                    return name, await self._call_async(name, upload, file_path)
+                except Exception as e:
+                    failures[name] = {"status": "failed", "error": str(e)}
+            raise AllProvidersFailedError(_describe_failures(failures))
+
+        replicas = {}
+        primaries = []
+        fallbacks = []
+        for name, upload, fallback in self.providers:
+            if not self.breakers[name].allow():
+                replicas[name] = {"status": "skipped", "error": "circuit open"}
+                continue
+            task = asyncio.ensure_future(self._call_async(name, upload, file_path))
+            (fallbacks if fallback else primaries).append((name, task))
+
+        winner = await self._first_success_async(primaries, replicas)
+        if winner is None:
+            winner = await self._first_success_async(fallbacks, replicas)
+            if winner is None:
+                raise AllProvidersFailedError(_describe_failures(replicas))
+
+        pending = [(name, task) for name, task in primaries + fallbacks
+                   if name != winner[0] and name not in replicas]
+        task = asyncio.ensure_future(self._replicate_async(pending, replicas, on_replicated))
+        self._replication_tasks.add(task)
+        task.add_done_callback(self._replication_tasks.discard)
+        return winner
+
+    def stats(self):
+        """Return the mode and the circuit breaker state of every provider."""
+        return {
+            "mode": self.mode,
+            "breakers": {name: breaker.stats() for name, breaker in self.breakers.items()}
+        }
+
+    def _call(self, name, upload, file_path):
+        breaker = self.breakers[name]
+        try:
+            result = upload(file_path)
+        except Exception as e:
+            breaker.record_failure()
+            print(f"Error uploading to {name}: {str(e)}")
+            raise
+        breaker.record_success()
+        return result
+
+    async def _call_async(self, name, upload, file_path):
+        breaker = self.breakers[name]
+        try:
+            if name in self.async_uploads:
+                result = await self.async_uploads[name](file_path)
+            else:
+                result = await asyncio.to_thread(upload, file_path)
+        except Exception as e:
+            breaker.record_failure()
+            print(f"Error uploading to {name}: {str(e)}")
+            raise
+        breaker.record_success()
+        return result
+
+    def _first_success(self, named_futures, replicas):
+        futures = {future: name for name, future in named_futures}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures[future]
+                if future.exception() is None:
+                    return name, future.result()
+                replicas[name] = {"status": "failed", "error": str(future.exception())}
+        return None
+
+    def _replicate(self, pending, replicas, on_replicated):
+        def finish():
+            for name, future in pending:
+                try:
+                    replicas[name] = {"status": "completed", "result": future.result()}
+                except Exception as e:
+                    replicas[name] = {"status": "failed", "error": str(e)}
+            if on_replicated:
+                try:
+                    on_replicated(replicas)
+                except Exception as e:
+                    print(f"Error reporting replication status: {str(e)}")
+
+        if not pending:
+            finish()
+            return
+        # Wait for the replicas off the caller's thread
+        threading.Thread(target=finish, name="storage-replication", daemon=True).start()
+
+    async def _first_success_async(self, named_tasks, replicas):
+        tasks = {task: name for name, task in named_tasks}
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = tasks[task]
+                if task.exception() is None:
+                    return name, task.result()
+                replicas[name] = {"status": "failed", "error": str(task.exception())}
+        return None
+
+    async def _replicate_async(self, pending, replicas, on_replicated):
+        for name, task in pending:
+            try:
+                replicas[name] = {"status": "completed", "result": await task}
+            except Exception as e:
+                replicas[name] = {"status": "failed", "error": str(e)}
+        if on_replicated:
+            try:
+                # The callback records the replicas (files, metadata) and may block
+                await asyncio.to_thread(on_replicated, replicas)
+            except Exception as e:
+                print(f"Error reporting replication status: {str(e)}")
+
+    def _upload_sequential(self, file_path):
+        failures = {}
+        for name, upload, _ in self.providers:
+            if not self.breakers[name].allow():
+                failures[name] = {"status": "skipped", "error": "circuit open"}
+                continue
+            try:
+                return name, self._call(name, upload, file_path)
+            except Exception as e:
+                failures[name] = {"status": "failed", "error": str(e)}
+        raise AllProvidersFailedError(_describe_failures(failures))
+
+
+def _describe_failures(replicas):
+    if not replicas:
+        return "No storage providers configured"
+    return "; ".join(f"{name}: {info.get('error')}" for name, info in replicas.items())
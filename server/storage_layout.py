@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+"""
+Job IDs and the sharded on-disk layout of generated files.
+
+Job IDs are ULIDs: 26 Crockford base32 characters made of a 48-bit
+millisecond timestamp and 80 random bits. IDs generated in the same
+millisecond are made monotonic by incrementing the random part, so two
+requests can never get the same ID and IDs still sort by creation time.
+
+Files are spread over 256 shard directories named after the first two hex
+characters of a SHA-1 of the job ID (or of the file name for files that do
+not belong to a job), e.g. `images/3f/generated_<id>.png`. The shard of a
+file can be computed from its name, so lookups never have to list a
+directory. `migrate_flat_layout` moves files of the old flat layout into
+their shards.
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import secrets
+import threading
+
+CROCKFORD_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+# generated_<id>.png / generated_<id>.ply (the only job assets with a job ID in their name),
+# plus the PLY's levels of detail (generated_<id>_lod<n>.ply) and precompressed copies (.br, .gz)
+ASSET_NAME_PATTERN = re.compile(r"^generated_(?P<id>[0-9A-Za-z_]+?)(?:_lod\d+)?\.(?P<ext>[A-Za-z0-9]+)(?:\.(?:br|gz))?$")
+METADATA_NAME_PATTERN = re.compile(r"^metadata_(?P<id>[0-9A-Za-z_]+)\.json$")
+# Written to the metadata directory once the flat layout has been migrated
+MIGRATION_MARKER = ".sharded"
+
+_ulid_lock = threading.Lock()
+_last_ulid_time = 0
+_last_ulid_random = 0
+
+
+def _encode_crockford(value, length):
+    chars = []
+    for _ in range(length):
+        chars.append(CROCKFORD_ALPHABET[value & 0x1F])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def new_job_id():
+    """
+    Generate a new, unique, time-ordered job ID (monotonic ULID).
+
+    Returns:
+        str: 26-character ULID
+    """
+    global _last_ulid_time, _last_ulid_random
+
+    with _ulid_lock:
+        now = int(time.time() * 1000)
+        if now <= _last_ulid_time:
+            # Same (or an earlier) millisecond: keep ordering by incrementing
+            now = _last_ulid_time
+            random_part = (_last_ulid_random + 1) & ((1 << 80) - 1)
+            if random_part == 0:
+                now += 1
+        else:
+            random_part = secrets.randbits(80)
+        _last_ulid_time = now
+        _last_ulid_random = random_part
+
+    return _encode_crockford(now, 10) + _encode_crockford(random_part, 16)
+
+
+def shard_for(key):
+    """
+    Return the shard directory name for a job ID or file name.
+
+    Args:
+        key (str): Job ID, or file name for files without a job ID
+
+    Returns:
+        str: Two lowercase hex characters
+    """
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:2]
+
+
+def shard_key_for_filename(filename):
+    """
+    Return the key a file is sharded by: its job ID if the name contains one.
+
+    Args:
+        filename (str): Base name of the file
+
+    Returns:
+        str: Job ID or the file name itself
+    """
+    match = ASSET_NAME_PATTERN.match(filename) or METADATA_NAME_PATTERN.match(filename)
+    return match.group("id") if match else filename
+
+
+def sharded_relative_path(filename):
+    """
+    Return the path of a file relative to its top-level directory.
+
+    Args:
+        filename (str): Base name of the file
+
+    Returns:
+        str: Path of the form <shard>/<filename>
+    """
+    return os.path.join(shard_for(shard_key_for_filename(filename)), filename)
+
+
+def sharded_path(directory, filename):
+    """
+    Return the sharded location of a file inside a directory.
+
+    Args:
+        directory (str): Top-level directory (images, plys, metadata, storage)
+        filename (str): Base name of the file
+
+    Returns:
+        str: Path of the form <directory>/<shard>/<filename>
+    """
+    return os.path.join(directory, sharded_relative_path(filename))
+
+
+class StorageLayout:
+    """
+    Paths of the images, PLYs, metadata and storage files of jobs.
+    """
+
+    def __init__(self, images_dir="images", plys_dir="plys", metadata_dir="metadata", storage_dir="storage"):
+        """
+        Initialize the layout and create the top-level directories.
+
+        Args:
+            images_dir (str): Directory for generated images
+            plys_dir (str): Directory for generated PLY files
+            metadata_dir (str): Directory for metadata JSON files
+            storage_dir (str): Directory of the local storage provider
+        """
+        self.images_dir = images_dir
+        self.plys_dir = plys_dir
+        self.metadata_dir = metadata_dir
+        self.storage_dir = storage_dir
+        for directory in (images_dir, plys_dir, metadata_dir, storage_dir):
+            os.makedirs(directory, exist_ok=True)
+
+    def image_path(self, job_id):
+        """Return the path of a job's generated image."""
+        return self._job_file(self.images_dir, job_id, f"generated_{job_id}.png")
+
+    def ply_base_path(self, job_id):
+        """Return the path of a job's PLY file without the .ply extension."""
+        return self._job_file(self.plys_dir, job_id, f"generated_{job_id}")
+
+    def metadata_path(self, job_id):
+        """Return the path of a job's metadata file."""
+        return self._job_file(self.metadata_dir, job_id, f"metadata_{job_id}.json")
+
+    def locate(self, filename):
+        """
+        Find the directory a served file belongs to from its name alone.
+
+        Args:
+            filename (str): Base name of the file, e.g. generated_<id>.ply
+
+        Returns:
+            tuple: (top-level directory, path relative to that directory)
+        """
+        match = ASSET_NAME_PATTERN.match(filename)
+        if match and match.group("ext") == "ply":
+            directory = self.plys_dir
+        elif match:
+            directory = self.images_dir
+        else:
+            directory = self.storage_dir
+        return directory, sharded_relative_path(filename)
+
+    def _job_file(self, directory, job_id, filename):
+        shard_dir = os.path.join(directory, shard_for(job_id))
+        os.makedirs(shard_dir, exist_ok=True)
+        return os.path.join(shard_dir, filename)
+
+
+def migrate_flat_layout(layout, force=False):
+    """
+    Move files from the old flat directories into their shard directories.
+
+    Paths stored in metadata files are rewritten to the new locations; URLs
+    do not change. The migration is idempotent. Once it has completed, a
+    marker file is written and later calls return without scanning the
+    directories, unless force is set.
+
+    Args:
+        layout (StorageLayout): The target layout
+        force (bool): Whether to scan the directories even if the marker exists
+
+    Returns:
+        int: Number of files moved
+    """
+    marker = os.path.join(layout.metadata_dir, MIGRATION_MARKER)
+    if not force and os.path.exists(marker):
+        return 0
+
+    moved = {}
+    for directory in (layout.images_dir, layout.plys_dir, layout.storage_dir, layout.metadata_dir):
+        for entry in os.scandir(directory):
+            if not entry.is_file() or entry.name.startswith("."):
+                continue
+            target = sharded_path(directory, entry.name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(entry.path, target)
+            moved[os.path.join(directory, entry.name)] = target
+
+    if moved:
+        _rewrite_metadata_paths(layout.metadata_dir, moved)
+    with open(marker, "w") as f:
+        f.write(f"{time.time()}\n")
+    return len(moved)
+
+
+def _rewrite_metadata_paths(metadata_dir, moved):
+    from job_store import write_json_atomic
+
+    for shard in os.scandir(metadata_dir):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            if not METADATA_NAME_PATTERN.match(entry.name):
+                continue
+            try:
+                with open(entry.path, "r") as f:
+                    metadata = json.load(f)
+            except Exception as e:
+                print(f"Error reading metadata {entry.name}: {str(e)}")
+                continue
+
+            changed = False
+            for field, value in metadata.items():
+                if isinstance(value, str) and value in moved:
+                    metadata[field] = moved[value]
+                    changed = True
+            storage = metadata.get("storage")
+            if isinstance(storage, dict) and storage.get("path") in moved:
+                storage["path"] = moved[storage["path"]]
+                changed = True
+
+            if changed:
+                write_json_atomic(entry.path, metadata)
+
+
+def main():
+    """Command-line interface: migrate the flat layout in the current directory."""
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print(f"Usage: {sys.argv[0]} migrate")
+        sys.exit(1)
+
+    count = migrate_flat_layout(StorageLayout(), force=True)
+    print(f"Moved {count} files into shard directories.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+"""
+Local stand-ins for the services the generation pipeline calls, and a
+benchmark that runs the asyncio pipeline against them.
+
+`MockServices` is one HTTP server that answers like the OpenAI image API
+(POST /v1/images/generations, returning an image URL), the host of the
+generated images (GET /images/<n>.png) and a public Vercel Blob store
+(HEAD and PUT /blob/<path>), each with a configurable delay.
+`MockGradioClient` replaces gradio_client.Client in the Gradio client pool:
+a submitted reconstruction finishes after a fixed time and returns a small
+ASCII PLY, so the real pool, submit_ply and generate_ply_async are used.
+
+Run the benchmark from the server directory:
+
+    python tests/mock_services.py --jobs 200
+
+It submits the jobs through /generate-image in a temporary directory, waits
+until all of them finished and prints the elapsed time and the peak number
+of threads (not counting the mock server's request threads) as JSON.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ASCII_PLY = (
+    "ply\nformat ascii 1.0\nelement vertex 3\n"
+    "property float x\nproperty float y\nproperty float z\nend_header\n"
+    "0 0 0\n1 0 0\n0 1 0\n"
+)
+
+
+def png_bytes(size=64):
+    """Return a small PNG image."""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (size, size), (0, 128, 255)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class MockServices:
+    """
+    HTTP stand-in for the OpenAI image API, the image host and Vercel Blob.
+    """
+
+    def __init__(self, image_delay=1.0, download_delay=0.2, upload_delay=0.3):
+        """
+        Start the server on a free local port.
+
+        Args:
+            image_delay (float): Seconds an image generation takes
+            download_delay (float): Seconds before an image download starts
+            upload_delay (float): Seconds a blob upload takes
+        """
+        self.image_delay = image_delay
+        self.download_delay = download_delay
+        self.upload_delay = upload_delay
+        self.png = png_bytes()
+        self.generations = []
+        self.uploads = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, name="mock-services", daemon=True).start()
+
+    def close(self):
+        """Stop the server."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send(self, status, body=b"", content_type="application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                with services._lock:
+                    services.generations.append(request.get("prompt"))
+                    number = len(services.generations)
+                time.sleep(services.image_delay)
+                body = {"created": int(time.time()), "data": [{"url": f"{services.url}/images/{number}.png"}]}
+                self.send(200, json.dumps(body).encode())
+
+            def do_GET(self):
+                time.sleep(services.download_delay)
+                self.send(200, services.png, "image/png")
+
+            def do_HEAD(self):
+                # Nothing is stored yet, so content-addressed uploads always transfer
+                self.send(404)
+
+            def do_PUT(self):
+                if "chunked" in self.headers.get("Transfer-Encoding", ""):
+                    self.send(411)
+                    return
+                data = self.rfile.read(int(self.headers["Content-Length"]))
+                time.sleep(services.upload_delay)
+                with services._lock:
+                    services.uploads.append((self.path, len(data)))
+                self.send(200, b"{}")
+
+        return Handler
+
+
+class MockReconstruction:
+    """A submitted reconstruction; mirrors the parts of gradio_client.Job the pipeline uses."""
+
+    def __init__(self, duration, download_dir):
+        self.duration = duration
+        self.download_dir = download_dir
+        self.started = time.monotonic()
+        self._cancelled = False
+
+    def done(self):
+        return self._cancelled or time.monotonic() - self.started >= self.duration
+
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        self._cancelled = True
+        return True
+
+    def status(self):
+        remaining = max(0.0, self.duration - (time.monotonic() - self.started))
+        code = "CANCELLED" if self._cancelled else ("FINISHED" if remaining == 0 else "PROCESSING")
+        return SimpleNamespace(code=code, rank=0, queue_size=1, eta=remaining)
+
+    def result(self, timeout=None):
+        time.sleep(max(0.0, self.duration - (time.monotonic() - self.started)))
+        # Like Gradio, every result is downloaded into a directory of its own
+        directory = tempfile.mkdtemp(dir=self.download_dir)
+        path = os.path.join(directory, "result.ply")
+        with open(path, "w") as f:
+            f.write(ASCII_PLY)
+        return path
+
+
+class MockGradioClient:
+    """Stand-in for gradio_client.Client with a fixed reconstruction time."""
+
+    def __init__(self, src, duration=1.0, download_dir=None):
+        self.src = src
+        self.duration = duration
+        self.download_dir = download_dir or tempfile.gettempdir()
+
+    def submit(self, *args, api_name=None):
+        return MockReconstruction(self.duration, self.download_dir)
+
+    def predict(self, *args, api_name=None):
+        return self.submit(*args, api_name=api_name).result()
+
+    def close(self):
+        pass
+
+
+def run_benchmark(jobs=200, image_delay=1.0, reconstruction_time=1.0, upload_delay=0.3, timeout=120):
+    """
+    Run jobs through the asyncio pipeline of server.py against the mock services.
+
+    Must run in a fresh process: the server module is imported with the
+    mock configuration, in the current directory.
+
+    Returns:
+        dict: Job statuses, elapsed seconds, peak threads and mock call counts
+    """
+    services = MockServices(image_delay=image_delay, upload_delay=upload_delay)
+    sys.path.insert(0, SERVER_DIR)
+    os.environ.update({
+        "PIPELINE_MODE": "asyncio",
+        "OPENAI_API_KEY": "mock",
+        "OPENAI_BASE_URL": f"{services.url}/v1",
+        "INVISIBLE_STITCH_SRC": services.url,
+        # Every job is admitted at once and runs all stages concurrently
+        "JOB_QUEUE_SIZE": str(jobs),
+        "STAGE_QUEUE_SIZE": str(jobs),
+        "IMAGE_CONCURRENCY": str(jobs),
+        "UPLOAD_CONCURRENCY": str(jobs),
+        "GRADIO_POOL_SIZE": str(jobs),
+        "PLY_POLL_INTERVAL": "0.2",
+        "PLY_LOD_LEVELS": "0",
+        "DERIVATIVE_PREWARM": ""
+    })
+
+    import get_ply
+    download_dir = os.path.abspath("gradio")
+    os.makedirs(download_dir, exist_ok=True)
+    get_ply.GRADIO_DOWNLOAD_DIR = download_dir
+    get_ply._client_pool = get_ply.GradioClientPool(
+        services.url,
+        size=jobs,
+        client_factory=lambda: MockGradioClient(services.url, reconstruction_time, download_dir)
+    )
+
+    import server
+    server.storage_providers[0].blob_url = f"{services.url}/blob"
+    client = server.app.test_client()
+
+    started = time.monotonic()
+    ids = [client.post("/generate-image", json={"prompt": f"mock scene {i}"}).get_json()["id"] for i in range(jobs)]
+    peak_threads = 0
+    statuses = {}
+    while time.monotonic() - started < timeout:
+        peak_threads = max(peak_threads, sum(
+            1 for thread in threading.enumerate() if "process_request" not in thread.name
+        ))
+        statuses = {}
+        for job_id in ids:
+            status = server.job_store.get(job_id)["status"]
+            statuses[status] = statuses.get(status, 0) + 1
+        if not statuses.get("processing"):
+            break
+        time.sleep(0.05)
+    elapsed = time.monotonic() - started
+
+    # Also stops the derivative worker processes, which would outlive os._exit
+    server.drain_scheduler()
+    services.close()
+    return {
+        "jobs": jobs,
+        "statuses": statuses,
+        "elapsed": round(elapsed, 2),
+        "peak_threads": peak_threads,
+        "image_generations": len(services.generations),
+        "uploads": len(services.uploads)
+    }
+
+
+def main():
+    """Command-line interface: run the benchmark in a temporary directory."""
+    parser = argparse.ArgumentParser(description="Run the asyncio pipeline against mock services")
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--image-delay", type=float, default=1.0)
+    parser.add_argument("--reconstruction-time", type=float, default=1.0)
+    parser.add_argument("--upload-delay", type=float, default=0.3)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="lucidia-benchmark-"))
+    result = run_benchmark(args.jobs, args.image_delay, args.reconstruction_time, args.upload_delay)
+    print(json.dumps(result), flush=True)
+    # Skip the server's exit handlers; the pipeline is already drained
+    os._exit(0 if result["statuses"] == {"completed": args.jobs} else 1)
+
+
+if __name__ == "__main__":
+    main()
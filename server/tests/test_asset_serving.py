@@ -0,0 +1,93 @@
+import os
+
+import pytest
+from flask import Flask
+
+import asset_serving
+from asset_serving import send_asset
+
+
+@pytest.fixture
+def asset_dir(tmp_path):
+    (tmp_path / "scene.ply").write_bytes(bytes(range(256)) * 4)
+    return tmp_path
+
+
+def make_client(directory, **options):
+    app = Flask(__name__)
+
+    @app.route("/files/<path:filename>")
+    def serve(filename):
+        return send_asset(str(directory), filename, **options)
+
+    return app.test_client()
+
+
+def test_stale_stat_key_is_replaced_by_the_open_file(asset_dir):
+    path = str(asset_dir / "scene.ply")
+    stale = []
+    client = make_client(asset_dir, stat_key=(10, 0), on_stale=stale.append)
+
+    response = client.get("/files/scene.ply")
+    assert response.content_length == 1024
+    assert response.data == (asset_dir / "scene.ply").read_bytes()
+    assert response.get_etag()[0] == asset_serving.file_etag(path)
+    assert stale == [os.path.abspath(path)]
+
+
+def test_single_range(asset_dir):
+    response = make_client(asset_dir).get("/files/scene.ply", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == "bytes 10-19/1024"
+    assert response.content_length == 10
+    assert response.data == bytes(range(10, 20))
+
+    response = make_client(asset_dir).get("/files/scene.ply", headers={"Range": "bytes=-4"})
+    assert response.headers["Content-Range"] == "bytes 1020-1023/1024"
+    assert response.data == bytes(range(252, 256))
+
+
+def test_multiple_ranges_are_sent_as_multipart_byteranges(asset_dir):
+    response = make_client(asset_dir).get("/files/scene.ply", headers={"Range": "bytes=0-1,4-5,5-7"})
+    assert response.status_code == 206
+    assert response.mimetype == "multipart/byteranges"
+    boundary = response.mimetype_params["boundary"]
+    assert response.content_length == len(response.data)
+
+    parts = response.data.split(f"--{boundary}".encode())
+    assert parts[0] == b"" and parts[-1] == b"--\r\n"
+    # Overlapping ranges are merged: 0-1 and 4-7
+    bodies = [part.split(b"\r\n\r\n", 1) for part in parts[1:-1]]
+    assert [headers.split(b"Content-Range: ")[1] for headers, _ in bodies] == [b"bytes 0-1/1024", b"bytes 4-7/1024"]
+    assert [body for _, body in bodies] == [bytes([0, 1]) + b"\r\n", bytes([4, 5, 6, 7]) + b"\r\n"]
+
+
+def test_if_range(asset_dir):
+    client = make_client(asset_dir)
+    etag = client.get("/files/scene.ply").get_etag()[0]
+
+    response = client.get("/files/scene.ply", headers={"Range": "bytes=0-9", "If-Range": f'"{etag}"'})
+    assert response.status_code == 206 and response.data == bytes(range(10))
+
+    response = client.get("/files/scene.ply", headers={"Range": "bytes=0-9", "If-Range": '"outdated"'})
+    assert response.status_code == 200 and len(response.data) == 1024
+
+
+def test_unsatisfiable_range(asset_dir):
+    response = make_client(asset_dir).get("/files/scene.ply", headers={"Range": "bytes=2000-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == "bytes */1024"
+
+
+@pytest.mark.parametrize("mode, header", [("x-accel", "X-Accel-Redirect"), ("x-sendfile", "X-Sendfile")])
+def test_offload_headers(asset_dir, monkeypatch, mode, header):
+    monkeypatch.setattr(asset_serving, "ASSET_OFFLOAD", mode)
+    monkeypatch.setattr(asset_serving, "ASSET_ROOT", str(asset_dir))
+
+    response = make_client(asset_dir).get("/files/scene.ply", headers={"Range": "bytes=0-9"})
+    # The front-end server answers the range and sends the body
+    assert response.status_code == 200
+    assert response.data == b""
+    assert response.headers["Accept-Ranges"] == "bytes"
+    expected = "/protected/scene.ply" if mode == "x-accel" else os.path.join(str(asset_dir), "scene.ply")
+    assert response.headers[header] == expected
@@ -0,0 +1,24 @@
+import json
+import os
+import subprocess
+import sys
+
+MOCK_SERVICES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_services.py")
+
+
+def test_async_pipeline_runs_jobs_concurrently(tmp_path):
+    # A fresh process, since the server module configures itself on import
+    jobs = 50
+    completed = subprocess.run(
+        [sys.executable, MOCK_SERVICES, "--jobs", str(jobs)],
+        cwd=str(tmp_path), capture_output=True, text=True, timeout=120
+    )
+    assert completed.returncode == 0, completed.stdout[-2000:] + completed.stderr[-2000:]
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    assert result["statuses"] == {"completed": jobs}
+    assert result["image_generations"] == jobs and result["uploads"] == jobs
+    # One job takes about 2.5 s against the mocks; one after another they would take minutes
+    assert result["elapsed"] < 20
+    # Waiting jobs hold no thread
+    assert result["peak_threads"] < jobs
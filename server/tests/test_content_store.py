@@ -0,0 +1,18 @@
+from content_store import AssetReferences
+
+
+def test_references_are_counted_per_owner(tmp_path):
+    refs = AssetReferences(str(tmp_path / "refs.sqlite3"))
+    assert refs.add("a" * 64, "job1") == 1
+    assert refs.add("a" * 64, "job1") == 1
+    assert refs.add("a" * 64, "cache:key") == 2
+    assert refs.add("b" * 64, "job1") == 1
+    assert refs.stats() == {"assets": 2, "references": 3}
+
+    assert refs.release("job1") == ["b" * 64]
+    assert refs.count("a" * 64) == 1
+    assert refs.release("cache:key") == ["a" * 64]
+    assert refs.release("missing") == []
+
+    # Shared with other processes through the database file
+    assert AssetReferences(refs.db.path).stats() == {"assets": 0, "references": 0}
@@ -0,0 +1,142 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import get_ply
+from get_ply import GradioClientPool
+
+
+class GradioApp(BaseHTTPRequestHandler):
+    """Stand-in for the config endpoint of a Gradio app."""
+
+    healthy = True
+
+    def do_GET(self):
+        status = 200 if self.path == "/config" and GradioApp.healthy else 404
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def gradio_app():
+    GradioApp.healthy = True
+    server = ThreadingHTTPServer(("127.0.0.1", 0), GradioApp)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+
+class FakeClient:
+    def __init__(self, src, results):
+        self.src = src
+        self.results = results
+        self.closed = False
+
+    def predict(self, *args, **kwargs):
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(src, results=None, **kwargs):
+    clients = []
+
+    def factory():
+        clients.append(FakeClient(src, results if results is not None else []))
+        return clients[-1]
+
+    return GradioClientPool(src, client_factory=factory, **kwargs), clients
+
+
+def test_clients_are_reused_up_to_the_pool_size(gradio_app):
+    pool, clients = make_pool(gradio_app, size=2)
+    first = pool.acquire()
+    second = pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.1)
+
+    pool.release(first)
+    assert pool.acquire(timeout=1) is first
+    pool.release(first)
+    pool.release(second)
+    assert pool.stats() == {"size": 2, "idle": 2, "created": 2, "discarded": 0}
+
+
+def test_idle_clients_are_health_checked(gradio_app):
+    pool, clients = make_pool(gradio_app, health_check_interval=0)
+    client = pool.acquire()
+    pool.release(client)
+    assert pool.acquire() is client
+    pool.release(client)
+
+    GradioApp.healthy = False
+    replacement = pool.acquire()
+    assert replacement is not client and client.closed
+    assert pool.stats()["discarded"] == 1
+    pool.release(replacement)
+
+
+def test_connection_errors_discard_the_client_and_retry_once(gradio_app, tmp_path, monkeypatch):
+    image = tmp_path / "image.png"
+    image.write_bytes(b"png")
+    results = [ConnectionError("reset"), "/tmp/result.ply"]
+    pool, clients = make_pool(gradio_app, results)
+    monkeypatch.setattr(get_ply, "_client_pool", pool)
+
+    assert get_ply.generate_ply(str(image), "a prompt") == "/tmp/result.ply"
+    assert len(clients) == 2 and clients[0].closed
+    assert pool.stats() == {"size": 2, "idle": 1, "created": 2, "discarded": 1}
+
+    results.extend([ConnectionError("reset"), ConnectionError("reset")])
+    with pytest.raises(ConnectionError):
+        get_ply.generate_ply(str(image), "a prompt")
+    assert pool.stats()["discarded"] == 3
+
+
+class UnreachableReconstruction:
+    def __init__(self):
+        self.polls = 0
+
+    def done(self):
+        return False
+
+    def cancelled(self):
+        return False
+
+    def status(self):
+        self.polls += 1
+        raise ConnectionError("connection refused")
+
+    def cancel(self):
+        raise ConnectionError("connection refused")
+
+
+def test_supervisor_gives_up_on_reconstructions_it_cannot_poll(gradio_app):
+    pool, clients = make_pool(gradio_app, size=1)
+    reconstruction = UnreachableReconstruction()
+    handle = get_ply.PlyJobHandle(reconstruction, pool=pool, client=pool.acquire())
+    failed = threading.Event()
+    errors = []
+
+    supervisor = get_ply.PlySupervisor(poll_interval=0.01, max_failures=3)
+    supervisor.watch("job", handle, lambda status: None, lambda handle: None,
+                     lambda handle, error: errors.append(error) or failed.set())
+
+    assert failed.wait(5)
+    assert reconstruction.polls == 3
+    assert isinstance(errors[0], ConnectionError)
+    assert supervisor.stats() == {"outstanding": 0}
+    # The client that lost its connection is discarded, not reused
+    assert clients[0].closed
@@ -0,0 +1,54 @@
+import os
+import time
+
+import pytest
+
+from image_derivatives import DerivativeCache, EVICT_TARGET
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def make_source(path, color):
+    Image.new("RGB", (64, 64), color).save(path, "PNG")
+    return str(path)
+
+
+def make_cache(root, max_bytes=1024 * 1024):
+    cache = DerivativeCache(str(root / "derivatives"), max_bytes=max_bytes, workers=0)
+    cache.start()
+    return cache
+
+
+def test_derivative_evicted_by_another_process_is_rendered_again(tmp_path):
+    source = make_source(tmp_path / "a.png", (255, 0, 0))
+    first, second = make_cache(tmp_path), make_cache(tmp_path)
+
+    relative_path = first.get(source, 64, "png")
+    path = os.path.join(first.cache_dir, relative_path)
+    # The second process finds the derivative on disk without rendering it
+    assert second.get(source, 64, "png") == relative_path
+    assert second.stats()["hits"] == 1
+
+    os.remove(path)
+    assert second.get(source, 64, "png") == relative_path
+    assert os.path.isfile(path)
+    assert second.stats()["misses"] == 1
+
+
+def test_eviction_keeps_derivatives_used_by_another_process(tmp_path):
+    sources = [make_source(tmp_path / f"{i}.png", (i * 60 + 10, 20, 30)) for i in range(3)]
+    first = make_cache(tmp_path)
+    paths = [os.path.join(first.cache_dir, first.get(source, 64, "png")) for source in sources[:2]]
+    for age, path in enumerate(paths):
+        os.utime(path, (time.time() - 100 + age, time.time() - 100 + age))
+
+    second = make_cache(tmp_path)
+    # The oldest derivative is used through the other process's index
+    first.get(sources[0], 64, "png")
+    # Room for two of the three derivatives after eviction
+    second.max_bytes = int(2.5 * max(os.path.getsize(path) for path in paths) / EVICT_TARGET)
+    second.get(sources[2], 64, "png")
+
+    assert os.path.isfile(paths[0])
+    assert not os.path.exists(paths[1])
+    assert second.stats()["evicted"] == 1
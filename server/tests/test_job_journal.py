@@ -0,0 +1,102 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+import job_journal
+from job_journal import JobJournal
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEAD_PID = os.getpid() + 100000
+
+
+def orphan(journal, job, stage, pid=DEAD_PID):
+    # Journal entry left behind by a server process that died
+    journal.record(job, stage)
+    with journal.db.transaction() as connection:
+        connection.execute("UPDATE journal SET owner = ?, owner_pid = ? WHERE job_id = ?", ("dead", pid, job["id"]))
+
+
+def test_claim_orphans_takes_over_jobs_of_dead_processes(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "jobs.sqlite3")
+    orphan(JobJournal(db_path), {"id": "dead"}, "ply")
+    orphan(JobJournal(db_path), {"id": "running"}, None, pid=os.getppid())
+    monkeypatch.setattr(job_journal, "process_alive", lambda pid: pid != DEAD_PID)
+
+    journal = JobJournal(db_path)
+    assert journal.claim_orphans() == [({"id": "dead"}, "ply")]
+    # Claimed once: the entry now belongs to this journal
+    assert journal.claim_orphans() == []
+    assert journal.stats() == {"unfinished": 2, "resumed": 1}
+
+
+RESUME_SCRIPT = textwrap.dedent("""
+    import json, os, sys, time
+    sys.path.insert(0, SERVER_DIR)
+    from job_journal import JobJournal
+    from storage_layout import StorageLayout
+
+    layout = StorageLayout("images", "plys", "metadata", "storage")
+    job_id = "01JRESUMEDJOB0000000000000"
+    job = {
+        "id": job_id,
+        "prompt": "a resumed scene",
+        "image_path": layout.image_path(job_id),
+        "ply_path": layout.ply_base_path(job_id),
+        "metadata_path": layout.metadata_path(job_id),
+        "server_url": "http://localhost:5000",
+        "cache_key": None,
+        "final_ply_path": layout.ply_base_path(job_id) + ".ply"
+    }
+    for path, data in ((job["image_path"], b"\\x89PNG\\r\\n\\x1a\\n"), (job["final_ply_path"], PLY)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+    journal = JobJournal(os.path.join("cache", "jobs.sqlite3"))
+    journal.record(job, "ply")
+    with journal.db.transaction() as connection:
+        connection.execute("UPDATE journal SET owner = 'dead', owner_pid = ?", (DEAD_PID,))
+
+    # Earlier stages must not run again
+    import get_ply
+    calls = []
+    def reconstruct(*args, **kwargs):
+        calls.append("ply")
+        raise RuntimeError("the PLY stage ran again")
+    get_ply.submit_ply = get_ply.generate_ply = get_ply.generate_ply_async = reconstruct
+
+    import server
+    deadline = time.monotonic() + 30
+    metadata = None
+    while time.monotonic() < deadline:
+        metadata = server.job_store.get(job_id)
+        if metadata and metadata.get("status") != "processing":
+            break
+        time.sleep(0.05)
+    server.drain_scheduler()
+    print(json.dumps({"metadata": metadata, "calls": calls, "journal": server.job_journal.stats()}), flush=True)
+    os._exit(0)
+""")
+
+
+def test_server_resumes_an_orphaned_job_at_its_recorded_stage(tmp_path):
+    # A fresh process, since the server module resumes jobs on import
+    ply = ("ply\nformat ascii 1.0\nelement vertex 3\nproperty float x\nproperty float y\nproperty float z\n"
+           "end_header\n0 0 0\n1 0 0\n0 1 0\n").encode()
+    script = f"SERVER_DIR = {SERVER_DIR!r}\nDEAD_PID = {DEAD_PID}\nPLY = {ply!r}\n" + RESUME_SCRIPT
+    env = dict(os.environ, OPENAI_API_KEY="test", OPENAI_BASE_URL="http://127.0.0.1:9/v1",
+               DERIVATIVE_WORKERS="0", DERIVATIVE_PREWARM="", PLY_LOD_LEVELS="0")
+    env.pop("BLOB_READ_WRITE_TOKEN", None)
+    completed = subprocess.run([sys.executable, "-c", script], cwd=str(tmp_path), env=env,
+                               capture_output=True, text=True, timeout=60)
+    assert completed.returncode == 0, completed.stdout[-2000:] + completed.stderr[-2000:]
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    metadata = result["metadata"]
+    assert metadata["status"] == "completed", metadata
+    assert metadata["resumed_at_stage"] == "optimize"
+    # The image stage would have failed against the unreachable OpenAI endpoint
+    assert "error" not in metadata
+    assert result["calls"] == []
+    assert result["journal"] == {"unfinished": 0, "resumed": 1}
@@ -0,0 +1,40 @@
+import threading
+import time
+
+from job_scheduler import JobScheduler, Stage, DEFERRED
+
+
+def test_resume_does_not_block_when_the_next_stage_is_full():
+    release = threading.Event()
+    finished = []
+
+    def slow(job):
+        release.wait(10)
+        finished.append(job["id"])
+        return job
+
+    scheduler = JobScheduler([
+        Stage("ply", lambda job: DEFERRED, num_workers=1, max_queue_size=10),
+        Stage("upload", slow, num_workers=1, max_queue_size=1)
+    ])
+    jobs = [{"id": i} for i in range(5)]
+    for job in jobs:
+        scheduler.submit(job)
+    deadline = time.monotonic() + 5
+    while scheduler.stats()["deferred"] < len(jobs) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    # One job is running in the upload stage, one is queued and the rest overflow
+    scheduler.resume(jobs[0], jobs[0])
+    while scheduler.stats()["stages"]["upload"]["active"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    started = time.monotonic()
+    for job in jobs[1:]:
+        scheduler.resume(job, job)
+    assert time.monotonic() - started < 1
+    assert scheduler.stats()["overflow"] == 3
+
+    release.set()
+    assert scheduler.shutdown(timeout=5)
+    assert sorted(finished) == [0, 1, 2, 3, 4]
+    assert scheduler.stats()["overflow"] == 0
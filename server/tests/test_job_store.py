@@ -0,0 +1,70 @@
+import json
+import time
+import threading
+
+from job_store import JobStore, SqliteJobStore
+
+
+def test_finished_jobs_are_evicted_and_loaded_lazily(tmp_path):
+    store = JobStore(str(tmp_path / "metadata"), max_finished_jobs=2)
+    for i in range(5):
+        store.create(f"job{i}", {"id": f"job{i}", "status": "processing"})
+    for i in range(4):
+        store.update(f"job{i}", {"status": "completed"})
+    store.flush()
+
+    # job4 is still running; only the two most recently finished jobs stay cached
+    assert sorted(store._jobs) == ["job2", "job3", "job4"]
+    assert store.get("job0") == {"id": "job0", "status": "completed"}
+
+    store.update("job1", {"ply_replication_status": "completed"})
+    store.flush()
+    with open(store.path_for("job1")) as f:
+        assert json.load(f)["ply_replication_status"] == "completed"
+    store.close()
+
+
+def test_unknown_and_invalid_job_ids(tmp_path):
+    store = JobStore(str(tmp_path / "metadata"))
+    assert store.get("missing") is None
+    assert store.get("../secrets") is None
+    assert store.get_with_version("missing") == (None, 0)
+    store.close()
+
+
+def test_sqlite_store_imports_files_on_first_access(tmp_path):
+    metadata_dir = str(tmp_path / "metadata")
+    memory_store = JobStore(metadata_dir)
+    memory_store.create("old", {"id": "old", "status": "completed"})
+    memory_store.close()
+
+    store = SqliteJobStore(metadata_dir, str(tmp_path / "jobs.sqlite3"))
+    assert store.get("old") == {"id": "old", "status": "completed"}
+    assert store.update("old", {"note": 1}) == 2
+    assert store.get("old")["note"] == 1
+    store.close()
+
+
+def test_versions_survive_eviction_and_waiters_pin_jobs(tmp_path):
+    store = JobStore(str(tmp_path / "metadata"), max_finished_jobs=0)
+    store.create("job0", {"id": "job0", "status": "processing"})
+    assert store.update("job0", {"status": "completed"}) == 2
+    store.flush()
+    assert "job0" not in store._jobs
+    assert store.get_with_version("job0") == ({"id": "job0", "status": "completed"}, 2)
+
+    store.create("job1", {"id": "job1", "status": "processing"})
+    store.update("job1", {"status": "completed"})
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(store.wait_for_change("job1", 2, timeout=5)))
+    waiter.start()
+    while "job1" not in store._waiters:
+        time.sleep(0.01)
+    store.flush()
+    assert "job1" in store._jobs
+
+    store.update("job1", {"ply_replication_status": "completed"})
+    waiter.join()
+    assert results[0][1] == 3
+    assert results[0][0]["ply_replication_status"] == "completed"
+    store.close()
@@ -0,0 +1,73 @@
+import gzip
+import re
+
+import numpy as np
+import pytest
+
+from ply_processing import optimize_ply, read_ply, PlyFormatError
+
+ASCII_PLY = """ply
+format ascii 1.0
+comment generated by a test
+element vertex 3
+property float x
+property float y
+property float z
+property float red
+property float green
+property float blue
+end_header
+0 0 0 0 0.5 1
+1.5 -2 0.25 1 1 0
+3 2.5 1 0.2 0.4 0.6
+"""
+
+
+def test_ascii_ply_is_quantized_and_compressed(tmp_path):
+    brotli = pytest.importorskip("brotli")
+    path = tmp_path / "generated_abc.ply"
+    path.write_text(ASCII_PLY)
+
+    info = optimize_ply(str(path), position_bits=16, quantize_colors=True)
+    assert info["vertices"] == 3
+    assert set(info["variants"]) == {"br", "gzip"}
+
+    raw = path.read_bytes()
+    assert raw.startswith(b"ply\nformat binary_little_endian 1.0\ncomment generated by a test\n")
+    assert brotli.decompress((tmp_path / "generated_abc.ply.br").read_bytes()) == raw
+    assert gzip.decompress((tmp_path / "generated_abc.ply.gz").read_bytes()) == raw
+
+    header, elements = read_ply(str(path))
+    (name, vertices), = elements
+    assert name == "vertex"
+    assert vertices.dtype["x"] == np.dtype("<u2") and vertices.dtype["red"] == np.dtype("u1")
+    assert list(vertices["red"]) == [0, 255, 51] and list(vertices["green"]) == [128, 255, 102]
+
+    scale, x, y, z = map(float, re.search(
+        r"quantized_positions scale (\S+) offset (\S+) (\S+) (\S+)", "\n".join(header["comments"])
+    ).groups())
+    restored = np.stack([vertices[field] * scale + offset for field, offset in (("x", x), ("y", y), ("z", z))], axis=1)
+    expected = np.array([[0, 0, 0], [1.5, -2, 0.25], [3, 2.5, 1]])
+    assert np.allclose(restored, expected, atol=scale / 2 + 1e-6)
+
+
+def test_invalid_ascii_values_are_rejected(tmp_path):
+    path = tmp_path / "broken.ply"
+    path.write_text(ASCII_PLY.replace("2.5 1", "2.5 one"))
+    with pytest.raises(PlyFormatError):
+        read_ply(str(path))
+
+    path.write_text(ASCII_PLY.replace("3 2.5 1 0.2 0.4 0.6\n", ""))
+    with pytest.raises(PlyFormatError):
+        read_ply(str(path))
+
+    path.write_text(ASCII_PLY.replace(" 0.2 0.4 0.6", ""))
+    with pytest.raises(PlyFormatError):
+        read_ply(str(path))
+
+
+def test_ascii_rows_after_the_elements_are_not_parsed(tmp_path):
+    path = tmp_path / "trailing.ply"
+    path.write_text(ASCII_PLY + "3 0 1 2\n")
+    header, elements = read_ply(str(path))
+    assert len(elements[0][1]) == 3
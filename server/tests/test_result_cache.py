@@ -0,0 +1,50 @@
+import json
+
+from result_cache import ResultCache
+
+
+def read_index(cache):
+    with open(cache.index_path) as f:
+        return json.load(f)
+
+
+def test_last_use_survives_reload_and_is_written_in_batches(tmp_path):
+    cache = ResultCache(str(tmp_path), shared=True, touch_interval=3600)
+    other = ResultCache(str(tmp_path), shared=True, touch_interval=3600)
+    cache.put("a", {"image_url": "a.png"})
+    stored = read_index(cache)["a"]["last_used"]
+
+    hit = cache.get("a")["last_used"]
+    assert hit > stored
+    assert read_index(cache)["a"]["last_used"] == stored
+
+    # Another process changes the index; the unwritten hit is kept on reload
+    other.put("b", {"image_url": "b.png"})
+    assert cache.get("b") is not None
+    assert cache._entries["a"]["last_used"] == hit
+
+    cache.flush()
+    assert read_index(cache)["a"]["last_used"] == hit
+
+
+def test_recent_hits_are_not_evicted_after_reload(tmp_path):
+    cache = ResultCache(str(tmp_path), max_entries=2, shared=True, touch_interval=0)
+    other = ResultCache(str(tmp_path), max_entries=2, shared=True, touch_interval=0)
+    cache.put("old", {"image_url": "old.png"})
+    cache.put("new", {"image_url": "new.png"})
+    assert cache.get("old") is not None
+
+    other.put("third", {"image_url": "third.png"})
+    assert sorted(read_index(other)) == ["old", "third"]
+
+
+def test_dropped_entries_are_reported(tmp_path):
+    dropped = []
+    cache = ResultCache(str(tmp_path), max_entries=1, on_drop=dropped.append)
+    cache.put("a", {"image_path": str(tmp_path / "a.png")})
+    cache.put("b", {"image_url": "b.png"})
+    assert dropped == ["a"]
+
+    cache.put("c", {"image_path": str(tmp_path / "missing.png")})
+    assert cache.get("c") is None
+    assert dropped == ["a", "b", "c"]
@@ -0,0 +1,61 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+import cloud_storage
+from cloud_storage import S3Storage, get_s3_client
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    for name, value in (("AWS_ACCESS_KEY_ID", "testing"), ("AWS_SECRET_ACCESS_KEY", "testing"),
+                        ("AWS_SESSION_TOKEN", "testing"), ("AWS_DEFAULT_REGION", "us-east-1")):
+        monkeypatch.setenv(name, value)
+    # Clients created outside the mock would talk to AWS
+    monkeypatch.setattr(cloud_storage, "_s3_clients", {})
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="lucidia-test")
+        yield "lucidia-test"
+
+
+def test_client_is_created_once_per_region_and_endpoint(bucket):
+    client = get_s3_client("us-east-1")
+    assert get_s3_client("us-east-1") is client
+    assert get_s3_client("eu-west-1") is not client
+
+
+def test_large_files_are_uploaded_in_parts(bucket, tmp_path):
+    path = tmp_path / "generated_abc.ply"
+    path.write_bytes(b"x" * (11 * MB))
+    storage = S3Storage(bucket, multipart_threshold=5 * MB, multipart_chunksize=5 * MB, max_concurrency=2)
+
+    config = storage.transfer_config()
+    assert (config.multipart_threshold, config.multipart_chunksize, config.max_concurrency) == (5 * MB, 5 * MB, 2)
+    assert storage.transfer_config() is config
+
+    result = storage.upload_file(str(path))
+    head = get_s3_client().head_object(Bucket=bucket, Key=result["key"])
+    assert head["ContentLength"] == 11 * MB
+    # Multipart uploads get an ETag of the form <md5 of the part md5s>-<number of parts>
+    assert head["ETag"].strip('"').endswith("-3")
+
+
+def test_content_addressed_uploads_are_deduplicated(bucket, tmp_path):
+    first = tmp_path / "a.ply"
+    second = tmp_path / "b.ply"
+    first.write_bytes(b"ply data")
+    second.write_bytes(b"ply data")
+    storage = S3Storage(bucket, prefix="plys", content_addressed=True)
+
+    uploaded = storage.upload_file(str(first))
+    assert not uploaded["deduplicated"]
+    assert uploaded["key"] == f"plys/{uploaded['digest']}.ply"
+    assert storage.object_exists(uploaded["key"])
+
+    duplicate = storage.upload_file(str(second))
+    assert duplicate["deduplicated"] and duplicate["key"] == uploaded["key"]
+    assert not storage.object_exists("plys/missing.ply")
+    listing = get_s3_client().list_objects_v2(Bucket=bucket)
+    assert [item["Key"] for item in listing["Contents"]] == [uploaded["key"]]
@@ -0,0 +1,21 @@
+import os
+
+from storage_layout import StorageLayout, migrate_flat_layout, sharded_path, MIGRATION_MARKER
+
+
+def make_layout(root):
+    return StorageLayout(*(str(root / name) for name in ("images", "plys", "metadata", "storage")))
+
+
+def test_migration_runs_once_unless_forced(tmp_path):
+    layout = make_layout(tmp_path)
+    (tmp_path / "images" / "generated_abc.png").write_bytes(b"png")
+
+    assert migrate_flat_layout(layout) == 1
+    assert os.path.isfile(sharded_path(layout.images_dir, "generated_abc.png"))
+    assert os.path.exists(os.path.join(layout.metadata_dir, MIGRATION_MARKER))
+
+    (tmp_path / "images" / "generated_def.png").write_bytes(b"png")
+    assert migrate_flat_layout(layout) == 0
+    assert migrate_flat_layout(layout, force=True) == 1
+    assert os.path.isfile(sharded_path(layout.images_dir, "generated_def.png"))
@@ -0,0 +1,84 @@
+import pytest
+import requests
+
+import vercel_api
+import upload_streaming
+from vercel_api import public_blob_url, upload_to_vercel_blob
+
+BLOB_URL = "https://vo7lsadihjfbcuiv.public.blob.vercel-storage.com"
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def test_public_blob_url_is_derived_from_the_store_id():
+    assert public_blob_url("store_vO7lSadIHJFbCUIv") == BLOB_URL
+
+
+def test_existing_blob_is_reused(tmp_path, monkeypatch):
+    path = tmp_path / "a.ply"
+    path.write_bytes(b"ply")
+    checked = []
+    monkeypatch.setattr(vercel_api.http_client, "head", lambda url: checked.append(url) or Response(200))
+
+    result = upload_to_vercel_blob(str(path), "store_vO7lSadIHJFbCUIv", token="t", pathname="abc.ply",
+                                   blob_url=BLOB_URL + "/")
+    assert checked == [f"{BLOB_URL}/abc.ply"]
+    assert result["url"] == f"{BLOB_URL}/abc.ply" and result["deduplicated"]
+
+
+def test_failed_head_request_uploads_the_file(tmp_path, monkeypatch):
+    path = tmp_path / "a.ply"
+    path.write_bytes(b"ply")
+
+    def head(url):
+        raise requests.ConnectionError("name resolution failed")
+
+    monkeypatch.setattr(vercel_api.http_client, "head", head)
+    monkeypatch.setattr(vercel_api, "upload_signed", lambda *args: f"{BLOB_URL}/abc.ply")
+
+    result = upload_to_vercel_blob(str(path), "store_vO7lSadIHJFbCUIv", token="t", pathname="abc.ply")
+    assert result["url"] == f"{BLOB_URL}/abc.ply" and not result["deduplicated"]
+
+
+class JsonResponse(Response):
+    def __init__(self, status_code, data=None):
+        super().__init__(status_code)
+        self.data = data or {}
+        self.text = str(self.data)
+
+    def json(self):
+        return self.data
+
+
+def test_failed_multipart_upload_is_aborted_and_parts_are_retried_once_per_attempt(tmp_path, monkeypatch):
+    path = tmp_path / "a.ply"
+    path.write_bytes(b"ply" * 100)
+    actions = []
+    puts = []
+
+    def post(url, params=None, headers=None, json=None):
+        actions.append(headers["x-mpu-action"])
+        return JsonResponse(200, {"key": "abc.ply", "uploadId": "u1"})
+
+    class UploadSession:
+        def put(self, url, params=None, data=None, headers=None):
+            puts.append(headers["x-mpu-part-number"])
+            raise requests.ConnectionError("connection reset")
+
+    monkeypatch.setattr(vercel_api.http_client, "post", post)
+    monkeypatch.setattr(vercel_api.http_client, "get_upload_session", UploadSession)
+    monkeypatch.setattr(upload_streaming.time, "sleep", lambda seconds: None)
+
+    with pytest.raises(requests.ConnectionError):
+        vercel_api.upload_multipart(str(path), "abc.ply", "application/octet-stream", "t")
+    assert actions == ["create", "abort"]
+    assert puts == ["1"] * 4
+
+
+def test_upload_session_does_not_retry():
+    session = vercel_api.http_client.get_upload_session()
+    assert session.get_adapter("https://blob.vercel-storage.com").max_retries.total == 0
+    assert session is not vercel_api.http_client.get_session()
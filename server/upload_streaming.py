@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Streaming request bodies and multipart uploads for the storage providers.
+
+Uploads never read a whole file into memory. `FileBody` is an iterable
+request body that reads a file (or a byte range of it) in fixed-size chunks
+and reports its length, so `requests` sends it with a Content-Length header
+while holding only one chunk at a time. Large files can be uploaded in parts
+with `upload_in_parts`, which retries a failed part on its own instead of
+restarting the whole upload. `FileBody` is also an async iterable, for the
+uploads of the asyncio pipeline. Peak memory per upload is one chunk, whatever
+the file size.
+"""
+import os
+import time
+import asyncio
+
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+# Files at least this large are uploaded in parts where the provider supports it
+MULTIPART_THRESHOLD = int(os.environ.get("UPLOAD_MULTIPART_THRESHOLD", 64 * 1024 * 1024))
+MULTIPART_PART_SIZE = int(os.environ.get("UPLOAD_PART_SIZE", 8 * 1024 * 1024))
+PART_MAX_RETRIES = int(os.environ.get("UPLOAD_PART_RETRIES", 3))
+
+
+class FileBody:
+    """
+    A request body that streams a file, or a byte range of it, in chunks.
+
+    Each iteration reopens the file at the start of the range, so the same
+    body can be sent again when a request is retried.
+    """
+
+    def __init__(self, file_path, offset=0, length=None, chunk_size=UPLOAD_CHUNK_SIZE):
+        """
+        Initialize the body.
+
+        Args:
+            file_path (str): File to stream
+            offset (int): First byte of the range
+            length (int, optional): Number of bytes; defaults to the rest of the file
+            chunk_size (int): Bytes read per chunk
+        """
+        self.file_path = file_path
+        self.offset = offset
+        if length is None:
+            length = os.path.getsize(file_path) - offset
+        self.length = length
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        remaining = self.length
+        with open(self.file_path, "rb") as f:
+            f.seek(self.offset)
+            while remaining > 0:
+                chunk = f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    raise IOError(f"{self.file_path} shrank while it was being uploaded")
+                remaining -= len(chunk)
+                yield chunk
+
+    async def __aiter__(self):
+        # For httpx.AsyncClient; the file is opened and read in worker threads
+        remaining = self.length
+        f = await asyncio.to_thread(open, self.file_path, "rb")
+        try:
+            await asyncio.to_thread(f.seek, self.offset)
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(self.chunk_size, remaining))
+                if not chunk:
+                    raise IOError(f"{self.file_path} shrank while it was being uploaded")
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+
+def iter_parts(file_path, part_size=MULTIPART_PART_SIZE):
+    """
+    Split a file into parts without reading it.
+
+    Args:
+        file_path (str): File to split
+        part_size (int): Bytes per part (the last part may be smaller)
+
+    Returns:
+        list: (part_number, FileBody) pairs, numbered from 1
+    """
+    size = os.path.getsize(file_path)
+    parts = []
+    for number, offset in enumerate(range(0, max(size, 1), part_size), start=1):
+        parts.append((number, FileBody(file_path, offset, min(part_size, size - offset))))
+    return parts
+
+
+def upload_in_parts(file_path, upload_part, part_size=MULTIPART_PART_SIZE, max_retries=PART_MAX_RETRIES):
+    """
+    Upload a file part by part, retrying each failed part individually.
+
+    Args:
+        file_path (str): File to upload
+        upload_part (callable): Called as upload_part(part_number, body) with a
+                                FileBody; returns provider data for the part (e.g. its ETag)
+        part_size (int): Bytes per part
+        max_retries (int): Retries per part before the upload fails
+
+    Returns:
+        list: The results of upload_part, in part order
+    """
+    results = []
+    for number, body in iter_parts(file_path, part_size):
+        for attempt in range(max_retries + 1):
+            try:
+                results.append(upload_part(number, body))
+                break
+            except Exception as e:
+                if attempt == max_retries:
+                    raise
+                delay = 2 ** attempt
+                print(f"Upload of part {number} failed ({str(e)}), retrying in {delay}s...")
+                time.sleep(delay)
+    return results
@@ -7,10 +7,50 @@ import os
 import sys
 import json
 import requests
-from urllib.parse import urlparse
+import http_client
+from urllib.parse import urlparse, quote
 import mimetypes
+from upload_streaming import FileBody, upload_in_parts, MULTIPART_THRESHOLD
 
-def upload_to_vercel_blob(file_path, store_id, token=None):
+# Multipart upload endpoint of the Vercel Blob API
+BLOB_MPU_URL = 'https://blob.vercel-storage.com/mpu'
+BLOB_API_VERSION = '7'
+
+def public_blob_url(store_id):
+    """
+    Return the public URL of a blob store.
+    
+    Blobs are served from https://<store id without "store_", lower-cased>.public.blob.vercel-storage.com.
+    
+    Args:
+        store_id (str): Store ID, e.g. store_vO7lSadIHJFbCUIv
+        
+    Returns:
+        str: The store's public URL, without a trailing slash
+    """
+    store = store_id[len('store_'):] if store_id.startswith('store_') else store_id
+    return f"https://{store.lower()}.public.blob.vercel-storage.com"
+
+def blob_exists(url):
+    """
+    Check with a HEAD request whether a public blob exists.
+    
+    A failed request (DNS, connection, timeout) counts as not present, so
+    the file is uploaded instead.
+    
+    Args:
+        url (str): Public URL of the blob
+        
+    Returns:
+        bool: True if the blob exists
+    """
+    try:
+        return http_client.head(url).status_code == 200
+    except requests.RequestException as e:
+        print(f"Could not check for an existing blob at {url}: {str(e)}")
+        return False
+
+def upload_to_vercel_blob(file_path, store_id, token=None, pathname=None, blob_url=None):
     """
     Upload a file to Vercel Blob Storage using the Vercel API.
     
@@ -19,6 +59,11 @@ def upload_to_vercel_blob(file_path, store_id, token=None):
         store_id (str): Store ID for the Vercel Blob storage
         token (str, optional): Vercel API token with Blob access
             If not provided, tries to get it from BLOB_READ_WRITE_TOKEN env var
+        pathname (str, optional): Blob pathname; defaults to the file name. When
+            given (e.g. a content digest), an existing blob with that pathname
+            is reused instead of uploading the file again
+        blob_url (str, optional): Public URL of the blob store; derived from
+            the store ID if not provided
             
     Returns:
         dict: Response with URL and other metadata
@@ -29,11 +74,56 @@ def upload_to_vercel_blob(file_path, store_id, token=None):
         raise ValueError("Vercel API token is required. Provide it as a parameter or set BLOB_READ_WRITE_TOKEN env var.")
     
     # Get file name and content type
-    file_name = os.path.basename(file_path)
+    file_name = pathname or os.path.basename(file_path)
     content_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
     
+    # Skip the upload if a blob with this (content-addressed) pathname exists
+    if pathname:
+        existing_url = f"{(blob_url or public_blob_url(store_id)).rstrip('/')}/{quote(pathname)}"
+        if blob_exists(existing_url):
+            print(f"Blob already stored at: {existing_url}")
+            return {
+                'url': existing_url,
+                'filepath': file_name,
+                'contentType': content_type,
+                'size': os.path.getsize(file_path),
+                'provider': 'vercel-blob-api',
+                'deduplicated': True
+            }
+    
     print(f"Uploading {file_path} to Vercel Blob Storage...")
     
+    # Large files go up in parts so a failed part can be retried on its own
+    if os.path.getsize(file_path) >= MULTIPART_THRESHOLD:
+        blob_url = upload_multipart(file_path, file_name, content_type, token)
+    else:
+        blob_url = upload_signed(file_path, file_name, content_type, store_id, token)
+    
+    print(f"File available at: {blob_url}")
+    
+    return {
+        'url': blob_url,
+        'filepath': file_name,
+        'contentType': content_type,
+        'size': os.path.getsize(file_path),
+        'provider': 'vercel-blob-api',
+        'deduplicated': False
+    }
+
+def upload_signed(file_path, file_name, content_type, store_id, token):
+    """
+    Upload a file in a single streamed PUT to a signed upload URL.
+    
+    Args:
+        file_path (str): Path to the file to upload
+        file_name (str): Name of the blob
+        content_type (str): Content type of the file
+        store_id (str): Store ID for the Vercel Blob storage
+        token (str): Vercel API token with Blob access
+        
+    Returns:
+        str: URL of the uploaded blob
+    """
     # Step 1: Generate a signed upload URL using the v2 API endpoint
     print("Generating signed upload URL...")
     url = f'https://api.vercel.com/v2/blob/upload-url?storeId={store_id}'
@@ -43,7 +133,7 @@ def upload_to_vercel_blob(file_path, store_id, token=None):
     }
     
     # Make the request to get the upload URL
-    response = requests.post(url, headers=headers)
+    response = http_client.post(url, headers=headers)
     if response.status_code != 200:
         print(f"Error response: {response.text}")
         raise Exception(f"Failed to get upload URL: {response.status_code} - {response.text}")
@@ -52,18 +142,17 @@ def upload_to_vercel_blob(file_path, store_id, token=None):
     upload_url = response.json()['url']
     print(f"Got upload URL: {upload_url}")
     
-    # Step 2: Upload the file to the signed URL
+    # Step 2: Stream the file to the signed URL
     print("Uploading file to signed URL...")
-    with open(file_path, 'rb') as file:
-        upload_response = requests.put(
-            upload_url, 
-            data=file,
-            headers={
-                'Content-Type': content_type
-            }
-        )
-        if upload_response.status_code not in (200, 201):
-            raise Exception(f"Failed to upload file: {upload_response.status_code} - {upload_response.text}")
+    upload_response = http_client.put(
+        upload_url, 
+        data=FileBody(file_path),
+        headers={
+            'Content-Type': content_type
+        }
+    )
+    if upload_response.status_code not in (200, 201):
+        raise Exception(f"Failed to upload file: {upload_response.status_code} - {upload_response.text}")
     
     print("File uploaded successfully!")
     
@@ -71,18 +160,91 @@ def upload_to_vercel_blob(file_path, store_id, token=None):
     blob_url = upload_response.headers.get('x-vercel-blob-url')
     if not blob_url:
         # If the URL isn't in the headers, construct it
-        blob_url = f"https://{store_id}.public.blob.vercel-storage.com/{file_name}"
+        blob_url = f"{public_blob_url(store_id)}/{file_name}"
         print(f"Warning: Could not find blob URL in response headers, using constructed URL: {blob_url}")
     
-    print(f"File available at: {blob_url}")
+    return blob_url
+
+def upload_multipart(file_path, pathname, content_type, token):
+    """
+    Upload a large file with the Vercel Blob multipart API.
     
-    return {
-        'url': blob_url,
-        'filepath': file_name,
-        'contentType': content_type,
-        'size': os.path.getsize(file_path),
-        'provider': 'vercel-blob-api'
+    The file is sent in parts streamed from disk; each part is retried on
+    its own if it fails (by upload_in_parts only: the parts go through the
+    session without automatic retries). If the upload fails, it is aborted
+    so no incomplete upload is left on the store.
+    
+    Args:
+        file_path (str): Path to the file to upload
+        pathname (str): Pathname of the blob
+        content_type (str): Content type of the file
+        token (str): Vercel Blob read-write token
+        
+    Returns:
+        str: URL of the uploaded blob
+    """
+    params = {'pathname': pathname}
+    headers = {
+        'Authorization': f'Bearer {token}',
+        'x-api-version': BLOB_API_VERSION,
+        'x-content-type': content_type
     }
+    
+    response = http_client.post(BLOB_MPU_URL, params=params, headers=dict(headers, **{'x-mpu-action': 'create'}))
+    if response.status_code != 200:
+        raise Exception(f"Failed to start multipart upload: {response.status_code} - {response.text}")
+    upload = response.json()
+    part_headers = dict(headers, **{
+        'x-mpu-key': quote(upload['key']),
+        'x-mpu-upload-id': upload['uploadId']
+    })
+    
+    def upload_part(part_number, body):
+        print(f"Uploading part {part_number} ({len(body)} bytes)...")
+        part_response = http_client.get_upload_session().put(
+            BLOB_MPU_URL,
+            params=params,
+            data=body,
+            headers=dict(part_headers, **{'x-mpu-action': 'upload', 'x-mpu-part-number': str(part_number)})
+        )
+        if part_response.status_code != 200:
+            raise Exception(f"Part {part_number} failed: {part_response.status_code} - {part_response.text}")
+        return {'partNumber': part_number, 'etag': part_response.json()['etag']}
+    
+    try:
+        parts = upload_in_parts(file_path, upload_part)
+        
+        response = http_client.post(
+            BLOB_MPU_URL,
+            params=params,
+            json=parts,
+            headers=dict(part_headers, **{'x-mpu-action': 'complete'})
+        )
+        if response.status_code != 200:
+            raise Exception(f"Failed to complete multipart upload: {response.status_code} - {response.text}")
+    except Exception:
+        abort_multipart(params, part_headers)
+        raise
+    return response.json()['url']
+
+def abort_multipart(params, part_headers):
+    """
+    Abort a multipart upload, discarding the parts uploaded so far.
+    
+    Failures are only logged; the upload's original error is what the
+    caller reports.
+    
+    Args:
+        params (dict): Query parameters of the upload (pathname)
+        part_headers (dict): Headers identifying the upload (key and upload ID)
+    """
+    try:
+        response = http_client.post(BLOB_MPU_URL, params=params, headers=dict(part_headers, **{'x-mpu-action': 'abort'}))
+        if response.status_code != 200:
+            print(f"Failed to abort multipart upload {part_headers['x-mpu-upload-id']}: "
+                  f"{response.status_code} - {response.text}")
+    except requests.RequestException as e:
+        print(f"Failed to abort multipart upload {part_headers['x-mpu-upload-id']}: {str(e)}")
 
 def main():
     """Command-line interface for testing Vercel Blob Storage."""
@@ -2,11 +2,12 @@
 """
 A client for Vercel Blob Storage that follows the Vercel Blob API documentation.
 """
-import requests
+import http_client
 import os
 import json
 import time
 import sys
+from upload_streaming import FileBody
 
 class VercelBlobClient:
     def __init__(self, store_id):
@@ -42,7 +43,7 @@ class VercelBlobClient:
         
         # 1. Request a presigned URL for upload
         print("Requesting presigned URL...")
-        presigned_req = requests.post(
+        presigned_req = http_client.post(
             f"{base_url}/upload/presigned",
             headers={
                 "Content-Type": "application/json",
@@ -72,12 +73,9 @@ class VercelBlobClient:
         
         # 2. Upload the file to the presigned URL
         print(f"Uploading file ({file_size} bytes) to presigned URL...")
-        with open(file_path, "rb") as f:
-            file_content = f.read()
-            
-        upload_response = requests.put(
+        upload_response = http_client.put(
             upload_url,
-            data=file_content,
+            data=FileBody(file_path),
             headers={
                 "Content-Type": content_type
             }
@@ -10,10 +10,11 @@ import sys
 import json
 import time
 import mimetypes
-import requests
+import http_client
 import base64
 import hashlib
 from urllib.parse import quote
+from upload_streaming import FileBody
 
 def upload_to_vercel_blob(file_path, blob_url, store_id):
     """
@@ -47,9 +48,8 @@ def upload_to_vercel_blob(file_path, blob_url, store_id):
     # Construct the URL
     upload_url = f"{blob_url}/{encoded_path}"
     
-    # Read the file
-    with open(file_path, 'rb') as f:
-        file_content = f.read()
+    # Stream the file instead of reading it into memory
+    body = FileBody(file_path)
     
     # Upload headers
     headers = {
@@ -57,13 +57,13 @@ def upload_to_vercel_blob(file_path, blob_url, store_id):
         'x-vercel-blob-store-id': store_id
     }
     
-    print(f"Uploading {file_path} ({len(file_content)} bytes) to {upload_url}")
+    print(f"Uploading {file_path} ({len(body)} bytes) to {upload_url}")
     print(f"Headers: {headers}")
     
     # Make the PUT request
-    response = requests.put(
+    response = http_client.put(
         upload_url,
-        data=file_content,
+        data=body,
         headers=headers,
         timeout=60
     )
@@ -78,7 +78,7 @@ def upload_to_vercel_blob(file_path, blob_url, store_id):
             'url': upload_url,
             'pathname': unique_path,
             'contentType': content_type,
-            'size': len(file_content)
+            'size': len(body)
         }
     else:
         # Try to parse error message
@@ -1,7 +1,8 @@
-import requests
+import http_client
 import os
 import json
 import time
+from upload_streaming import FileBody
 
 class VercelBlobStorage:
     """
@@ -38,10 +39,6 @@ class VercelBlobStorage:
         # Prepare the request URL - use the direct URL pattern
         upload_url = f"{self.blob_url}/{pathname}"
         
-        # Read the file
-        with open(file_path, 'rb') as f:
-            file_content = f.read()
-        
         # Make the PUT request to upload the file
         headers = {
             'Content-Type': content_type,
@@ -52,9 +49,9 @@ class VercelBlobStorage:
         print(f"Uploading to: {upload_url}")
         print(f"Headers: {headers}")
         
-        response = requests.put(
+        response = http_client.put(
             upload_url,
-            data=file_content,
+            data=FileBody(file_path),
             headers=headers
         )
         
@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+"""
+Entry points for production servers.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+    uvicorn wsgi:asgi_app --workers 4    (needs a2wsgi and JOB_STORE=sqlite)
+
+Every worker process imports the server and runs its own job pipeline; with
+more than one worker, job state must be shared through JOB_STORE=sqlite.
+"""
+from server import create_app
+
+app = create_app()
+
+# ASGI servers such as uvicorn need an adapter around the WSGI app
+try:
+    from a2wsgi import WSGIMiddleware
+    asgi_app = WSGIMiddleware(app)
+except ImportError:
+    asgi_app = None
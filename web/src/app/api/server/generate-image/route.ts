@@ -42,6 +42,7 @@ export const POST = async (req: Request) => {
       success: true,
       id: data.id,
       metadataUrl: data.metadata_url,
+      eventsUrl: data.events_url,
       expectedImageUrl: data.expected_image_url,
       expectedPlyUrl: data.expected_ply_url,
       status: data.status,
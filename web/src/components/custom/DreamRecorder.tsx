@@ -39,8 +39,10 @@ export function DreamRecorder() {
 
   // Added for 3D model generation
   const [metadataUrl, setMetadataUrl] = useState<string | undefined>(undefined);
+  const [eventsUrl, setEventsUrl] = useState<string | undefined>(undefined);
   const [isGenerating3D, setIsGenerating3D] = useState(false);
   const [plyUrl, setPlyUrl] = useState<string | undefined>(undefined);
+  const [plyLodUrl, setPlyLodUrl] = useState<string | undefined>(undefined);
   const [plyGenerationStatus, setPlyGenerationStatus] = useState("");
   const [errorMessage, setErrorMessage] = useState<string>("");
   const [isViewerOpen, setIsViewerOpen] = useState(false);
@@ -75,9 +77,10 @@ export function DreamRecorder() {
   );
 
   const handlePlyComplete = useCallback(
-    (plyUrl: string) => {
-      debugLog("PLY file completed", { plyUrl });
+    (plyUrl: string, lodUrl?: string) => {
+      debugLog("PLY file completed", { plyUrl, lodUrl });
       setPlyUrl(plyUrl);
+      setPlyLodUrl(lodUrl);
       setPlyGenerationStatus("completed");
 
       // Notify parent component about the completed PLY model
@@ -89,7 +92,7 @@ export function DreamRecorder() {
         );
       }
     },
-    [debugLog, setPlyUrl, setPlyGenerationStatus],
+    [debugLog, setPlyUrl, setPlyLodUrl, setPlyGenerationStatus],
   );
 
   const handleGenerationComplete = useCallback(
@@ -124,6 +127,7 @@ export function DreamRecorder() {
   // Use our generation status hook to monitor the 3D model creation
   const { metadata, isPolling } = useGenerationStatus({
     metadataUrl,
+    eventsUrl,
     onImageComplete: handleImageComplete,
     onPlyComplete: handlePlyComplete,
     onComplete: handleGenerationComplete,
@@ -253,6 +257,7 @@ export function DreamRecorder() {
         setPlyGenerationStatus("pending");
         setMetadataUrl(undefined);
         setPlyUrl(undefined);
+        setPlyLodUrl(undefined);
         setErrorMessage("");
 
         debugLog("Starting image and 3D generation", {
@@ -295,7 +300,8 @@ export function DreamRecorder() {
           expectedPlyUrl: data.expectedPlyUrl,
         });
 
-        // Store metadata URL to start polling
+        // Store metadata URL to start monitoring (events when available)
+        setEventsUrl(data.eventsUrl);
         setMetadataUrl(data.metadataUrl);
       } catch (error) {
         debugLog("Generation request error", {
@@ -422,6 +428,7 @@ export function DreamRecorder() {
         setCompleteConversation(""); // Reset conversation history
         setShouldGenerateImagePrompt(false);
         setPlyUrl(undefined);
+        setPlyLodUrl(undefined);
         setMetadataUrl(undefined);
         setPlyGenerationStatus("");
         setErrorMessage("");
@@ -496,6 +503,7 @@ export function DreamRecorder() {
         <ThreePlyViewer
           key={`viewer-${plyUrl}`}
           filePath={plyUrl}
+          lodUrl={plyLodUrl}
           isOpen={isViewerOpen}
           onClose={() => {
             debugLog("Closing 3D viewer");
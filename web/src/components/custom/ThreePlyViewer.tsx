@@ -6,6 +6,7 @@ import * as THREE from "three";
 import { AlertCircle, X } from "lucide-react";
 import { OrbitControls } from "three/examples/jsm/controls/OrbitControls.js";
 import { PLYLoader } from "three/examples/jsm/loaders/PLYLoader.js";
+import { mergeGeometries } from "three/examples/jsm/utils/BufferGeometryUtils.js";
 
 import { Button } from "@/components/ui/button";
 
@@ -13,12 +14,15 @@ interface ThreePlyViewerProps {
   isOpen: boolean;
   onClose: () => void;
   filePath?: string;
+  // Coarse-to-fine LOD manifest, loaded progressively instead of filePath
+  lodUrl?: string;
 }
 
 export function ThreePlyViewer({
   isOpen,
   onClose,
   filePath = "/generated_20250427_073743.ply",
+  lodUrl,
 }: ThreePlyViewerProps) {
   const containerRef = useRef<HTMLDivElement>(null);
   const rendererRef = useRef<THREE.WebGLRenderer | null>(null);
@@ -134,263 +138,343 @@ export function ThreePlyViewer({
     // Load PLY file
     const loader = new PLYLoader();
 
-    loader.load(
-      filePath,
-      // onLoad callback
-      (geometry) => {
-        if (!mounted) return;
-
-        // Center the geometry
-        geometry.computeBoundingBox();
-        if (geometry.boundingBox) {
-          const center = new THREE.Vector3();
-          geometry.boundingBox.getCenter(center);
-          geometry.translate(-center.x, -center.y, -center.z);
-
-          // Adjust scale if needed based on bounding box
-          const size = new THREE.Vector3();
-          geometry.boundingBox.getSize(size);
-          const maxDim = Math.max(size.x, size.y, size.z);
-
-          // Position camera at a good distance
-          camera.position.set(0, 0, maxDim * 1.5);
-
-          // Set controls target to center
-          controls.target.set(0, 0, 0);
-          controls.update();
-        }
-
-        // Check if the geometry has color attributes
-        const hasVertexColors = geometry.hasAttribute("color");
-        console.log("Geometry has vertex colors:", hasVertexColors);
-
-        // Process color attributes
-        if (hasVertexColors) {
-          // Log the first few colors for debugging
-          if (geometry.hasAttribute("color")) {
-            console.log(
-              "Color attribute exists with type:",
-              geometry.attributes.color.array.constructor.name,
-            );
-            console.log(
-              "First few color values:",
-              Array.from(geometry.attributes.color.array).slice(0, 12),
-            );
-
-            // For non-normalized colors (0-255 instead of 0-1), normalize them
-            const colorAttrib = geometry.attributes.color;
-            if (colorAttrib && colorAttrib.array.length > 0) {
-              // Check if colors seem to be in 0-255 range
-              let needsNormalization = false;
-              for (let i = 0; i < Math.min(20, colorAttrib.array.length); i++) {
-                if (colorAttrib.array[i] > 1.1) {
-                  // if any value is clearly > 1
-                  needsNormalization = true;
-                  break;
-                }
-              }
+    // Offset and bounds of the first geometry; finer LOD levels share them
+    const center = new THREE.Vector3();
+    const bounds = new THREE.Box3();
+
+    // Center a geometry and prepare its vertex colors
+    const prepareGeometry = (geometry: THREE.BufferGeometry) => {
+      geometry.translate(-center.x, -center.y, -center.z);
+      geometry.boundingBox = bounds.clone();
+
+      // Check if the geometry has color attributes
+      const hasVertexColors = geometry.hasAttribute("color");
+      console.log("Geometry has vertex colors:", hasVertexColors);
+
+      // Process color attributes
+      if (hasVertexColors) {
+        // Log the first few colors for debugging
+        if (geometry.hasAttribute("color")) {
+          console.log(
+            "Color attribute exists with type:",
+            geometry.attributes.color.array.constructor.name,
+          );
+          console.log(
+            "First few color values:",
+            Array.from(geometry.attributes.color.array).slice(0, 12),
+          );
 
-              // Normalize if needed
-              if (needsNormalization) {
-                console.log("Normalizing colors from 0-255 to 0-1 range");
-                for (let i = 0; i < colorAttrib.array.length; i++) {
-                  colorAttrib.array[i] /= 255.0;
-                }
-                colorAttrib.needsUpdate = true;
+          // For non-normalized colors (0-255 instead of 0-1), normalize them
+          const colorAttrib = geometry.attributes.color;
+          if (colorAttrib && colorAttrib.array.length > 0) {
+            // Check if colors seem to be in 0-255 range
+            let needsNormalization = false;
+            for (let i = 0; i < Math.min(20, colorAttrib.array.length); i++) {
+              if (colorAttrib.array[i] > 1.1) {
+                // if any value is clearly > 1
+                needsNormalization = true;
+                break;
               }
+            }
 
-              // Enhance colors by boosting saturation slightly
-              for (let i = 0; i < colorAttrib.array.length; i += 3) {
-                const r = colorAttrib.array[i];
-                const g = colorAttrib.array[i + 1];
-                const b = colorAttrib.array[i + 2];
-
-                // Convert to HSL to boost saturation
-                const max = Math.max(r, g, b);
-                const min = Math.min(r, g, b);
-                let h,
-                  s,
-                  l = (max + min) / 2;
-
-                if (max === min) {
-                  h = s = 0; // achromatic
-                } else {
-                  const d = max - min;
-                  s = l > 0.5 ? d / (2 - max - min) : d / (max + min);
-
-                  if (max === r) h = (g - b) / d + (g < b ? 6 : 0);
-                  else if (max === g) h = (b - r) / d + 2;
-                  else h = (r - g) / d + 4;
-
-                  h /= 6;
-                }
-
-                // Boost saturation by 20%
-                s = Math.min(1, s * 1.2);
-
-                // Convert back to RGB
-                if (s === 0) {
-                  // achromatic
-                  colorAttrib.array[i] = l;
-                  colorAttrib.array[i + 1] = l;
-                  colorAttrib.array[i + 2] = l;
-                } else {
-                  const q = l < 0.5 ? l * (1 + s) : l + s - l * s;
-                  const p = 2 * l - q;
-
-                  const hueToRGB = (p: number, q: number, t: number) => {
-                    if (t < 0) t += 1;
-                    if (t > 1) t -= 1;
-                    if (t < 1 / 6) return p + (q - p) * 6 * t;
-                    if (t < 1 / 2) return q;
-                    if (t < 2 / 3) return p + (q - p) * (2 / 3 - t) * 6;
-                    return p;
-                  };
-
-                  colorAttrib.array[i] = hueToRGB(p, q, h + 1 / 3);
-                  colorAttrib.array[i + 1] = hueToRGB(p, q, h);
-                  colorAttrib.array[i + 2] = hueToRGB(p, q, h - 1 / 3);
-                }
+            // Normalize if needed
+            if (needsNormalization) {
+              console.log("Normalizing colors from 0-255 to 0-1 range");
+              for (let i = 0; i < colorAttrib.array.length; i++) {
+                colorAttrib.array[i] /= 255.0;
               }
-
               colorAttrib.needsUpdate = true;
             }
-          }
-        } else {
-          // If no vertex colors, create them based on position
-          const colorAttribute = new THREE.Float32BufferAttribute(
-            new Float32Array(geometry.attributes.position.count * 3),
-            3,
-          );
 
-          // Generate colors based on position for better visualization
-          for (let i = 0; i < geometry.attributes.position.count; i++) {
-            const x = geometry.attributes.position.getX(i);
-            const y = geometry.attributes.position.getY(i);
-            const z = geometry.attributes.position.getZ(i);
-
-            // Normalize values between 0-1 based on position
-            const normalizedPos = new THREE.Vector3(x, y, z);
-            if (geometry.boundingBox) {
-              normalizedPos.sub(geometry.boundingBox.min);
-              normalizedPos.divide(
-                new THREE.Vector3().subVectors(
-                  geometry.boundingBox.max,
-                  geometry.boundingBox.min,
-                ),
-              );
+            // Enhance colors by boosting saturation slightly
+            for (let i = 0; i < colorAttrib.array.length; i += 3) {
+              const r = colorAttrib.array[i];
+              const g = colorAttrib.array[i + 1];
+              const b = colorAttrib.array[i + 2];
+
+              // Convert to HSL to boost saturation
+              const max = Math.max(r, g, b);
+              const min = Math.min(r, g, b);
+              let h,
+                s,
+                l = (max + min) / 2;
+
+              if (max === min) {
+                h = s = 0; // achromatic
+              } else {
+                const d = max - min;
+                s = l > 0.5 ? d / (2 - max - min) : d / (max + min);
+
+                if (max === r) h = (g - b) / d + (g < b ? 6 : 0);
+                else if (max === g) h = (b - r) / d + 2;
+                else h = (r - g) / d + 4;
+
+                h /= 6;
+              }
+
+              // Boost saturation by 20%
+              s = Math.min(1, s * 1.2);
+
+              // Convert back to RGB
+              if (s === 0) {
+                // achromatic
+                colorAttrib.array[i] = l;
+                colorAttrib.array[i + 1] = l;
+                colorAttrib.array[i + 2] = l;
+              } else {
+                const q = l < 0.5 ? l * (1 + s) : l + s - l * s;
+                const p = 2 * l - q;
+
+                const hueToRGB = (p: number, q: number, t: number) => {
+                  if (t < 0) t += 1;
+                  if (t > 1) t -= 1;
+                  if (t < 1 / 6) return p + (q - p) * 6 * t;
+                  if (t < 1 / 2) return q;
+                  if (t < 2 / 3) return p + (q - p) * (2 / 3 - t) * 6;
+                  return p;
+                };
+
+                colorAttrib.array[i] = hueToRGB(p, q, h + 1 / 3);
+                colorAttrib.array[i + 1] = hueToRGB(p, q, h);
+                colorAttrib.array[i + 2] = hueToRGB(p, q, h - 1 / 3);
+              }
             }
 
-            // Set RGB values based on position - brighter colors
-            colorAttribute.setXYZ(
-              i,
-              0.5 + 0.5 * normalizedPos.x,
-              0.5 + 0.5 * normalizedPos.y,
-              0.5 + 0.5 * normalizedPos.z,
+            colorAttrib.needsUpdate = true;
+          }
+        }
+      } else {
+        // If no vertex colors, create them based on position
+        const colorAttribute = new THREE.Float32BufferAttribute(
+          new Float32Array(geometry.attributes.position.count * 3),
+          3,
+        );
+
+        // Generate colors based on position for better visualization
+        for (let i = 0; i < geometry.attributes.position.count; i++) {
+          const x = geometry.attributes.position.getX(i);
+          const y = geometry.attributes.position.getY(i);
+          const z = geometry.attributes.position.getZ(i);
+
+          // Normalize values between 0-1 based on position
+          const normalizedPos = new THREE.Vector3(x, y, z);
+          if (geometry.boundingBox) {
+            normalizedPos.sub(geometry.boundingBox.min);
+            normalizedPos.divide(
+              new THREE.Vector3().subVectors(
+                geometry.boundingBox.max,
+                geometry.boundingBox.min,
+              ),
             );
           }
 
-          // Add the color attribute to the geometry
-          geometry.setAttribute("color", colorAttribute);
+          // Set RGB values based on position - brighter colors
+          colorAttribute.setXYZ(
+            i,
+            0.5 + 0.5 * normalizedPos.x,
+            0.5 + 0.5 * normalizedPos.y,
+            0.5 + 0.5 * normalizedPos.z,
+          );
         }
 
-        // Helper function to create a circular point texture
-        const createCircleTexture = (size: number, color: string) => {
-          const canvas = document.createElement("canvas");
-          canvas.width = size;
-          canvas.height = size;
-          const context = canvas.getContext("2d");
-          if (!context) return null;
-
-          // Draw a circle
-          const radius = size / 2;
-          context.beginPath();
-          context.arc(radius, radius, radius, 0, 2 * Math.PI, false);
-          context.fillStyle = color;
-          context.fill();
-
-          // Create texture from canvas
-          const texture = new THREE.CanvasTexture(canvas);
-          texture.needsUpdate = true;
-          return texture;
+        // Add the color attribute to the geometry
+        geometry.setAttribute("color", colorAttribute);
+      }
+    };
+
+    // Show the first geometry: the full PLY or the coarsest LOD level
+    const showGeometry = (geometry: THREE.BufferGeometry) => {
+      // Center the geometry
+      geometry.computeBoundingBox();
+      if (geometry.boundingBox) {
+        geometry.boundingBox.getCenter(center);
+        bounds.copy(geometry.boundingBox).translate(center.clone().negate());
+
+        // Adjust scale if needed based on bounding box
+        const size = new THREE.Vector3();
+        geometry.boundingBox.getSize(size);
+        const maxDim = Math.max(size.x, size.y, size.z);
+
+        // Position camera at a good distance
+        camera.position.set(0, 0, maxDim * 1.5);
+
+        // Set controls target to center
+        controls.target.set(0, 0, 0);
+        controls.update();
+      }
+
+      prepareGeometry(geometry);
+
+      // Helper function to create a circular point texture
+      const createCircleTexture = (size: number, color: string) => {
+        const canvas = document.createElement("canvas");
+        canvas.width = size;
+        canvas.height = size;
+        const context = canvas.getContext("2d");
+        if (!context) return null;
+
+        // Draw a circle
+        const radius = size / 2;
+        context.beginPath();
+        context.arc(radius, radius, radius, 0, 2 * Math.PI, false);
+        context.fillStyle = color;
+        context.fill();
+
+        // Create texture from canvas
+        const texture = new THREE.CanvasTexture(canvas);
+        texture.needsUpdate = true;
+        return texture;
+      };
+
+      // Create an improved point material with better size and round points
+      const pointsMaterial = new THREE.PointsMaterial({
+        size: 0.08, // Larger point size for better visibility
+        vertexColors: true,
+        sizeAttenuation: true,
+        transparent: true,
+        alphaTest: 0.1,
+        depthWrite: true,
+        map: createCircleTexture(256, "#ffffff"),
+      });
+
+      // Create a clone of the geometry for the mesh
+      const meshGeometry = geometry.clone();
+
+      // Compute vertex normals for the mesh geometry if not present
+      if (!meshGeometry.hasAttribute("normal")) {
+        meshGeometry.computeVertexNormals();
+      }
+
+      // Create a material for the mesh - adjusted for better colors
+      const meshMaterial = new THREE.MeshStandardMaterial({
+        vertexColors: true, // Use vertex colors for the mesh
+        flatShading: false, // Smooth shading
+        roughness: 0.7, // Less shiny
+        metalness: 0.1, // Slightly metallic for better light response
+        side: THREE.DoubleSide, // Render both sides of faces
+        envMapIntensity: 0.5, // Subtle environment reflections
+      });
+
+      // Create points mesh with standard material
+      const points = new THREE.Points(geometry, pointsMaterial);
+      scene.add(points);
+      pointsRef.current = points;
+
+      // Create surface mesh (hidden by default)
+      const mesh = new THREE.Mesh(meshGeometry, meshMaterial);
+      mesh.visible = false; // Start with mesh hidden
+      scene.add(mesh);
+      meshRef.current = mesh;
+
+      // Update loading state
+      if (mounted) {
+        setIsLoading(false);
+
+        // Start animation loop
+        const animate = () => {
+          if (!mounted) return;
+
+          frameIdRef.current = requestAnimationFrame(animate);
+
+          if (controlsRef.current) {
+            controlsRef.current.update();
+          }
+
+          if (rendererRef.current && cameraRef.current && sceneRef.current) {
+            rendererRef.current.render(sceneRef.current, cameraRef.current);
+          }
         };
 
-        // Create an improved point material with better size and round points
-        const pointsMaterial = new THREE.PointsMaterial({
-          size: 0.08, // Larger point size for better visibility
-          vertexColors: true,
-          sizeAttenuation: true,
-          transparent: true,
-          alphaTest: 0.1,
-          depthWrite: true,
-          map: createCircleTexture(256, "#ffffff"),
-        });
-
-        // Create a clone of the geometry for the mesh
-        const meshGeometry = geometry.clone();
-
-        // Compute vertex normals for the mesh geometry if not present
-        if (!meshGeometry.hasAttribute("normal")) {
-          meshGeometry.computeVertexNormals();
-        }
+        animate();
+      }
+    };
 
-        // Create a material for the mesh - adjusted for better colors
-        const meshMaterial = new THREE.MeshStandardMaterial({
-          vertexColors: true, // Use vertex colors for the mesh
-          flatShading: false, // Smooth shading
-          roughness: 0.7, // Less shiny
-          metalness: 0.1, // Slightly metallic for better light response
-          side: THREE.DoubleSide, // Render both sides of faces
-          envMapIntensity: 0.5, // Subtle environment reflections
-        });
-
-        // Create points mesh with standard material
-        const points = new THREE.Points(geometry, pointsMaterial);
-        scene.add(points);
-        pointsRef.current = points;
-
-        // Create surface mesh (hidden by default)
-        const mesh = new THREE.Mesh(meshGeometry, meshMaterial);
-        mesh.visible = false; // Start with mesh hidden
-        scene.add(mesh);
-        meshRef.current = mesh;
-
-        // Update loading state
-        if (mounted) {
-          setIsLoading(false);
-
-          // Start animation loop
-          const animate = () => {
-            if (!mounted) return;
-
-            frameIdRef.current = requestAnimationFrame(animate);
-
-            if (controlsRef.current) {
-              controlsRef.current.update();
-            }
+    // Add the points of a finer LOD level to the ones shown so far
+    const appendGeometry = (geometry: THREE.BufferGeometry) => {
+      const points = pointsRef.current;
+      const mesh = meshRef.current;
+      if (!points || !mesh) return;
+
+      prepareGeometry(geometry);
+      const merged = mergeGeometries([points.geometry, geometry]);
+      if (!merged) return;
+      points.geometry.dispose();
+      points.geometry = merged;
+
+      const meshGeometry = merged.clone();
+      if (!meshGeometry.hasAttribute("normal")) {
+        meshGeometry.computeVertexNormals();
+      }
+      mesh.geometry.dispose();
+      mesh.geometry = meshGeometry;
+    };
 
-            if (rendererRef.current && cameraRef.current && sceneRef.current) {
-              rendererRef.current.render(sceneRef.current, cameraRef.current);
-            }
-          };
+    const handleError = (err: unknown) => {
+      console.error("Error loading PLY:", err);
+      if (mounted) {
+        const errorMessage = err instanceof Error ? err.message : String(err);
+        setError(`Failed to load PLY file: ${errorMessage}`);
+        setIsLoading(false);
+      }
+    };
 
-          animate();
+    // Load the whole PLY file at once
+    const loadFullPly = () => {
+      loader.load(
+        filePath,
+        // onLoad callback
+        (geometry) => {
+          if (!mounted) return;
+          showGeometry(geometry);
+        },
+        // onProgress callback
+        (xhr) => {
+          console.log(`${(xhr.loaded / xhr.total) * 100}% loaded`);
+        },
+        // onError callback
+        handleError,
+      );
+    };
+
+    // Load the LOD levels coarse to fine: the first level is shown as soon
+    // as it arrives and every further level adds detail
+    const loadLevels = async (manifestUrl: string) => {
+      const response = await fetch(manifestUrl);
+      if (!response.ok) {
+        throw new Error(`Failed to load LOD levels: ${response.status}`);
+      }
+      const { levels }: { levels: { url: string }[] } = await response.json();
+      if (levels.length === 0) {
+        throw new Error("No LOD levels available");
+      }
+
+      for (let index = 0; index < levels.length; index++) {
+        const geometry = await loader.loadAsync(levels[index].url);
+        if (!mounted) return;
+
+        if (index === 0) {
+          showGeometry(geometry);
+        } else {
+          appendGeometry(geometry);
         }
-      },
-      // onProgress callback
-      (xhr) => {
-        console.log(`${(xhr.loaded / xhr.total) * 100}% loaded`);
-      },
-      // onError callback
-      (err: unknown) => {
-        console.error("Error loading PLY:", err);
-        if (mounted) {
-          const errorMessage = err instanceof Error ? err.message : String(err);
-          setError(`Failed to load PLY file: ${errorMessage}`);
-          setIsLoading(false);
+      }
+    };
+
+    if (lodUrl) {
+      loadLevels(lodUrl).catch((err: unknown) => {
+        if (!mounted) return;
+
+        if (pointsRef.current) {
+          // Keep the levels shown so far
+          console.error("Error loading LOD level:", err);
+        } else {
+          console.warn("LOD levels unavailable, loading full PLY:", err);
+          loadFullPly();
         }
-      },
-    );
+      });
+    } else {
+      loadFullPly();
+    }
 
     // Handle window resize
     const handleResize = () => {
@@ -466,7 +550,7 @@ export function ThreePlyViewer({
       // Remove resize listener
       window.removeEventListener("resize", handleResize);
     };
-  }, [isOpen, filePath]);
+  }, [isOpen, filePath, lodUrl]);
 
   if (!isOpen) return null;
 
@@ -12,6 +12,7 @@ export interface GenerationMetadata {
   ply_status?: string;
   ply_url?: string;
   ply_path?: string;
+  ply_lod_url?: string;
   error?: string;
   storage?: {
     provider: string;
@@ -23,15 +24,17 @@ export interface GenerationMetadata {
 
 interface UseGenerationStatusOptions {
   metadataUrl?: string;
+  eventsUrl?: string;
   pollingInterval?: number;
   onComplete?: (metadata: GenerationMetadata) => void;
   onImageComplete?: (imageUrl: string) => void;
-  onPlyComplete?: (plyUrl: string) => void;
+  onPlyComplete?: (plyUrl: string, lodUrl?: string) => void;
   onError?: (error: Error) => void;
 }
 
 export function useGenerationStatus({
   metadataUrl,
+  eventsUrl,
   pollingInterval = 2000,
   onComplete,
   onImageComplete,
@@ -46,28 +49,23 @@ export function useGenerationStatus({
   const imageCompletedRef = useRef(false);
   const plyCompletedRef = useRef(false);
   const pollingTimeoutRef = useRef<NodeJS.Timeout | null>(null);
+  const eventSourceRef = useRef<EventSource | null>(null);
 
   const stopPolling = useCallback(() => {
     if (pollingTimeoutRef.current) {
       clearTimeout(pollingTimeoutRef.current);
       pollingTimeoutRef.current = null;
     }
+    if (eventSourceRef.current) {
+      eventSourceRef.current.close();
+      eventSourceRef.current = null;
+    }
     setIsPolling(false);
   }, []);
 
-  const checkMetadata = useCallback(async () => {
-    if (!metadataUrl) return;
-
-    try {
-      const response = await fetch(metadataUrl);
-
-      if (!response.ok) {
-        throw new Error(
-          `Failed to fetch metadata: ${response.status} ${response.statusText}`,
-        );
-      }
-
-      const data = (await response.json()) as GenerationMetadata;
+  // Apply a metadata update and fire callbacks; returns true once the job has finished
+  const handleMetadata = useCallback(
+    (data: GenerationMetadata) => {
       setMetadata(data);
 
       // Check for image completion
@@ -87,36 +85,97 @@ export function useGenerationStatus({
         !plyCompletedRef.current
       ) {
         plyCompletedRef.current = true;
-        onPlyComplete?.(data.ply_url);
+        onPlyComplete?.(data.ply_url, data.ply_lod_url);
       }
 
       // Check for overall completion
       if (data.status === "completed") {
         onComplete?.(data);
         stopPolling();
-      } else if (data.status === "failed") {
+        return true;
+      } else if (data.status === "failed" || data.status === "rejected") {
         throw new Error(`Generation failed: ${data.error || "Unknown error"}`);
-      } else {
+      } else if (data.status === "cancelled") {
+        throw new Error("Generation cancelled");
+      }
+      return false;
+    },
+    [onComplete, onImageComplete, onPlyComplete, stopPolling],
+  );
+
+  const handleError = useCallback(
+    (err: unknown) => {
+      const error = err instanceof Error ? err : new Error(String(err));
+      setError(error);
+      onError?.(error);
+      stopPolling();
+    },
+    [onError, stopPolling],
+  );
+
+  const checkMetadata = useCallback(async () => {
+    if (!metadataUrl) return;
+
+    try {
+      const response = await fetch(metadataUrl);
+
+      if (!response.ok) {
+        throw new Error(
+          `Failed to fetch metadata: ${response.status} ${response.statusText}`,
+        );
+      }
+
+      const data = (await response.json()) as GenerationMetadata;
+      if (!handleMetadata(data)) {
         // Continue polling
         pollingTimeoutRef.current = setTimeout(() => {
           void checkMetadata();
         }, pollingInterval);
       }
     } catch (err) {
-      const error = err instanceof Error ? err : new Error(String(err));
-      setError(error);
-      onError?.(error);
-      stopPolling();
+      handleError(err);
     }
-  }, [
-    metadataUrl,
-    onComplete,
-    onImageComplete,
-    onPlyComplete,
-    onError,
-    stopPolling,
-    pollingInterval,
-  ]);
+  }, [metadataUrl, handleMetadata, handleError, pollingInterval]);
+
+  // Subscribe to server-sent status events; falls back to polling on failure
+  const subscribe = useCallback(() => {
+    if (!eventsUrl || typeof EventSource === "undefined") return false;
+
+    const source = new EventSource(eventsUrl);
+    eventSourceRef.current = source;
+    // Set when the server announces it closes the stream (every ~25s); the
+    // EventSource then reconnects by itself instead of falling back to polling
+    let reconnecting = false;
+
+    source.addEventListener("status", (event) => {
+      try {
+        const data = JSON.parse(
+          (event as MessageEvent<string>).data,
+        ) as GenerationMetadata;
+        handleMetadata(data);
+      } catch (err) {
+        handleError(err);
+      }
+    });
+
+    source.addEventListener("reconnect", () => {
+      reconnecting = true;
+    });
+
+    source.onerror = () => {
+      if (eventSourceRef.current !== source) return;
+      if (reconnecting && source.readyState === EventSource.CONNECTING) {
+        // Only the announced close; a failing reconnect falls back to polling
+        reconnecting = false;
+        return;
+      }
+      source.close();
+      eventSourceRef.current = null;
+      void checkMetadata();
+    };
+
+    return true;
+  }, [eventsUrl, handleMetadata, handleError, checkMetadata]);
 
   // Start polling when metadataUrl changes
   useEffect(() => {
@@ -130,9 +189,11 @@ export function useGenerationStatus({
       setIsPolling(true);
 
       // Use setTimeout with 0 delay to avoid potential infinite update loops
-      // This ensures the checkMetadata call is made in the next event loop tick
+      // This ensures the first request is made in the next event loop tick
       const initialPoll = setTimeout(() => {
-        void checkMetadata();
+        if (!subscribe()) {
+          void checkMetadata();
+        }
       }, 0);
 
       return () => {
@@ -140,7 +201,7 @@ export function useGenerationStatus({
         stopPolling();
       };
     }
-  }, [metadataUrl, checkMetadata, stopPolling]);
+  }, [metadataUrl, subscribe, checkMetadata, stopPolling]);
 
   return { metadata, isPolling, error };
 }